@@ -0,0 +1,208 @@
+"""
+    Throughput of the SDK against the local Graph Api stand-in
+    (benchmarks/graph_server.py), started in a subprocess so only the
+    client is measured.
+
+        python -m <package>.benchmarks.graph [--repeat 5] [--latency 0.01]
+            [--save baseline.json] [--baseline baseline.json]
+
+    With --baseline the run fails (exit status 1) when a scenario is
+    slower, or uses more memory, than the baseline by more than
+    --tolerance.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from ..facebook_request import GraphAPIRequest, GraphAPIError, \
+    set_graph_url
+from ..facebook_retry import RetryPolicy, get_retry_policy, set_retry_policy
+from ..facebook_hooks import register_hook, unregister_hook, AFTER_RESPONSE
+from ..facebook_helper import GraphAPIHelper
+from ..facebook_login import FacebookLoginHandler
+
+PACKAGE = __package__.rsplit('.', 1)[0]
+
+VERSION = 'v2.4'
+TOKEN = 'benchmark-token'
+
+
+def get_all(page_size):
+    return GraphAPIRequest(TOKEN, VERSION + '/me/photos',
+                           {'limit': page_size}).get_all()
+
+
+def get_all_stream(page_size):
+    return GraphAPIRequest(TOKEN, VERSION + '/me/photos',
+                           {'limit': page_size}).get_all(stream=True)
+
+
+def get_all_prefetch(page_size):
+    return GraphAPIRequest(TOKEN, VERSION + '/me/photos',
+                           {'limit': page_size}).get_all(prefetch=2)
+
+
+def helper_photos(page_size):
+    return GraphAPIHelper.get_user_photos('me', TOKEN)
+
+
+def helper_media_batch(page_size):
+    media = GraphAPIHelper.get_user_media('me', TOKEN)
+    return [item for items in media.values() for item in items]
+
+
+def helper_nested(page_size):
+    edges = GraphAPIHelper.get_user_edges('me', TOKEN, limit=page_size)
+    return [item for items in edges.values() for item in items]
+
+
+def login(page_size):
+    res = FacebookLoginHandler.get_access_token_from_code(
+        'code', 'http://localhost/', '1', 'secret')
+    access_token = res['access_token']
+    GraphAPIHelper.invalidate_access_token(access_token)
+    GraphAPIHelper.validate_access_token(access_token)
+    return [GraphAPIRequest(access_token, '/me', {}).get().response]
+
+
+SCENARIOS = (get_all, get_all_stream, get_all_prefetch, helper_photos,
+             helper_media_batch, helper_nested, login)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def start_server(args):
+    command = [sys.executable, '-m', PACKAGE + '.benchmarks.graph_server',
+               '--items', str(args.items),
+               '--page-size', str(args.page_size),
+               '--latency', str(args.latency),
+               '--error-rate', str(args.error_rate),
+               '--throttle', str(args.throttle)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    url = process.stdout.readline().decode('utf-8').strip()
+    if not url:
+        process.kill()
+        raise RuntimeError('Graph stand-in server did not start')
+    return process, url
+
+
+def measure(scenario, page_size, repeat):
+    latencies = []
+
+    def on_response(seconds, **info):
+        latencies.append(seconds)
+
+    register_hook(AFTER_RESPONSE, on_response)
+    tracemalloc.start()
+    try:
+        items = failures = 0
+        started = time.time()
+        for _ in range(repeat):
+            try:
+                items = len(scenario(page_size))
+            except GraphAPIError:
+                failures += 1
+        seconds = time.time() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        unregister_hook(AFTER_RESPONSE, on_response)
+    return {
+        'scenario': scenario.__name__,
+        'items': items,
+        'failures': failures,
+        'requests': len(latencies),
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else 0.0,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'peak_bytes': peak,
+    }
+
+
+def run(args):
+    process, url = start_server(args)
+    retry = get_retry_policy()
+    set_graph_url(url)
+    # injected errors are retried without the production backoff
+    set_retry_policy(RetryPolicy(backoff=0.01, max_backoff=0.1))
+    try:
+        return [measure(scenario, args.page_size, args.repeat)
+                for scenario in SCENARIOS
+                if not args.only or scenario.__name__ in args.only]
+    finally:
+        set_graph_url(None)
+        set_retry_policy(retry)
+        process.kill()
+        process.wait()
+
+
+def regressions(results, baseline, tolerance):
+    """
+        return a message for every scenario worse than the baseline
+    """
+    baseline = dict((result['scenario'], result) for result in baseline)
+    failures = []
+    for result in results:
+        base = baseline.get(result['scenario'])
+        if base is None:
+            continue
+        checks = (
+            ('failures', result['failures'] > base['failures']),
+            ('requests_per_second',
+             result['requests_per_second'] <
+             base['requests_per_second'] * (1 - tolerance)),
+            ('p99', result['p99'] > base['p99'] * (1 + tolerance)),
+            ('peak_bytes',
+             result['peak_bytes'] > base['peak_bytes'] * (1 + tolerance)),
+        )
+        for name, failed in checks:
+            if failed:
+                failures.append('%s: %s %r, baseline %r' % (
+                    result['scenario'], name, result[name], base[name]))
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle', type=int, default=0)
+    parser.add_argument('--only', nargs='*')
+    parser.add_argument('--save')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run(args)
+    print('%-20s %6s %6s %6s %9s %8s %8s %10s' % (
+        'scenario', 'items', 'failed', 'reqs', 'req/s', 'p50 ms', 'p99 ms',
+        'peak KB'))
+    for result in results:
+        print('%-20s %6d %6d %6d %9.1f %8.2f %8.2f %10.1f' % (
+            result['scenario'], result['items'], result['failures'],
+            result['requests'],
+            result['requests_per_second'], result['p50'] * 1000,
+            result['p99'] * 1000, result['peak_bytes'] / 1024.0))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print('REGRESSION ' + failure)
+        sys.exit(1 if failures else 0)
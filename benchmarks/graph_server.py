@@ -0,0 +1,271 @@
+"""
+    Local stand-in for the Graph Api, used by the benchmarks.
+
+    Serves paginated /me/photos, /me/videos and /me/posts (also under a
+    user id), /me with nested edge expansion, /debug_token,
+    /oauth/access_token and the batch endpoint, with configurable
+    latency, page size, throttling headers and error injection.
+
+        python -m <package>.benchmarks.graph_server [--port 8000] ...
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qsl, urlencode
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qsl
+    from urllib import urlencode
+
+EDGES = ('photos', 'videos', 'posts')
+
+_VERSION = re.compile(r'^v\d+(\.\d+)?$')
+
+# edge.limit(n){fields} of a nested field expansion, one level of braces
+_NESTED = re.compile(r'(\w+)\.limit\((\d+)\)\{((?:[^{}]|\{[^{}]*\})*)\}')
+
+TRANSIENT_ERROR = {'error': {
+    'message': 'An unexpected error has occurred. Please retry your '
+               'request later.',
+    'type': 'OAuthException', 'code': 2, 'is_transient': True}}
+
+THROTTLE_ERROR = {'error': {
+    'message': '(#4) Application request limit reached',
+    'type': 'OAuthException', 'code': 4, 'is_transient': True}}
+
+
+def make_item(edge, i, likes):
+    return {
+        'id': '%d' % (10150000000000000 + i),
+        'name': '%s %d' % (edge, i),
+        'picture': 'https://scontent.xx.fbcdn.net/v/t1/%d_s.jpg' % i,
+        'created_time': time.strftime(
+            '%Y-%m-%dT%H:%M:%S+0000', time.gmtime(1500000000 - i * 3600)),
+        'likes': {
+            'data': [{
+                'id': '%d' % (100000000000000 + j),
+                'name': 'User %d' % j,
+                'pic_small': 'https://scontent.xx.fbcdn.net/v/t1/%d_t.jpg' % j,
+                'can_post': False,
+            } for j in range(likes)],
+            'summary': {'total_count': likes},
+        },
+    }
+
+
+class GraphStandIn(object):
+
+    """
+        Answers Graph Api calls, independent from the HTTP layer.
+
+        items - items of every edge.
+        page_size - largest page served, smaller `limit` are honoured.
+        latency - seconds slept before every answer.
+        error_rate - share of calls answered with a transient error.
+        throttle - call_count percent sent in x-app-usage, 100 or more
+            answers with the request limit error.
+    """
+
+    def __init__(self, items=1000, page_size=100, likes=5, latency=0.0,
+                 error_rate=0.0, throttle=0, seed=0):
+        self.items = items
+        self.page_size = page_size
+        self.likes = likes
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def usage_headers(self):
+        usage = {'call_count': self.throttle,
+                 'total_time': self.throttle,
+                 'total_cputime': self.throttle}
+        return {'x-app-usage': json.dumps(usage)}
+
+    def handle(self, method, path, args, base_url):
+        """
+            return (status, body dict) of one call
+        """
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle >= 100:
+            return 400, THROTTLE_ERROR
+        if failed:
+            return 500, TRANSIENT_ERROR
+
+        parts = [part for part in path.split('/') if part]
+        if parts and _VERSION.match(parts[0]):
+            parts = parts[1:]
+
+        if method == 'POST' and not parts and 'batch' in args:
+            return 200, self.batch(args, base_url)
+        if parts == ['debug_token']:
+            return 200, {'data': {
+                'app_id': '1', 'user_id': '1000',
+                'is_valid': args.get('input_token') != 'invalid',
+                'expires_at': int(time.time()) + 3600}}
+        if parts == ['oauth', 'access_token']:
+            if args.get('code') in (None, '', 'invalid'):
+                return 400, {'error': {
+                    'message': 'Invalid verification code format.',
+                    'type': 'OAuthException', 'code': 100}}
+            return 200, {'access_token': 'token-%s' % args['code'],
+                         'token_type': 'bearer', 'expires_in': 5183999}
+        if len(parts) == 1:
+            user = {'id': '1000' if parts[0] == 'me' else parts[0],
+                    'name': 'Benchmark User'}
+            for edge, limit, fields in _NESTED.findall(
+                    args.get('fields', '')):
+                if edge in EDGES:
+                    edge_args = {'limit': limit, 'fields': fields}
+                    if 'access_token' in args:
+                        edge_args['access_token'] = args['access_token']
+                    user[edge] = self.page(path.rstrip('/') + '/' + edge,
+                                           edge, edge_args, base_url)
+            return 200, user
+        if len(parts) == 2 and parts[1] in EDGES:
+            return 200, self.page(path, parts[1], args, base_url)
+        return 404, {'error': {
+            'message': 'Unknown path components: /%s' % '/'.join(parts),
+            'type': 'OAuthException', 'code': 2500}}
+
+    def page(self, path, edge, args, base_url):
+        limit = min(int(args.get('limit') or self.page_size),
+                    self.page_size)
+        offset = int(args.get('after') or 0)
+        end = min(offset + limit, self.items)
+        page = {'data': [make_item(edge, i, self.likes)
+                         for i in range(offset, end)]}
+        paging = {'cursors': {'before': str(offset), 'after': str(end)}}
+        if end < self.items:
+            next_args = dict(args, limit=limit, after=end)
+            paging['next'] = '%s/%s?%s' % (base_url, path.lstrip('/'),
+                                           urlencode(sorted(
+                                               next_args.items())))
+        page['paging'] = paging
+        return page
+
+    def batch(self, args, base_url):
+        results = []
+        for entry in json.loads(args['batch']):
+            url = urlsplit('/' + entry['relative_url'].lstrip('/'))
+            entry_args = dict(parse_qsl(url.query))
+            entry_args.update(parse_qsl(entry.get('body', '')))
+            status, body = self.handle(entry.get('method', 'GET'),
+                                       url.path, entry_args, base_url)
+            results.append({
+                'code': status,
+                'headers': [{'name': 'Content-Type',
+                             'value': 'application/json'}],
+                'body': json.dumps(body),
+            })
+        return results
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body in one segment, flushed after every request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _answer(self, method):
+        url = urlsplit(self.path)
+        args = dict(parse_qsl(url.query))
+        length = int(self.headers.get('content-length') or 0)
+        if length:
+            body = self.rfile.read(length).decode('utf-8')
+            args.update(parse_qsl(body))
+        base_url = 'http://%s:%d' % self.server.server_address[:2]
+        graph = self.server.graph
+        status, response = graph.handle(method, url.path, args, base_url)
+        content = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in graph.usage_headers().items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._answer('GET')
+
+    def do_POST(self):
+        self._answer('POST')
+
+    def do_DELETE(self):
+        self._answer('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GraphServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, graph, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.graph = graph
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address[:2]
+
+    def start(self):
+        """
+            Serve on a background thread, return the base url
+        """
+        thread = threading.Thread(target=self.serve_forever,
+                                  name='graph-server')
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--likes', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = GraphServer(GraphStandIn(args.items, args.page_size,
+                                      args.likes, args.latency,
+                                      args.error_rate, args.throttle,
+                                      args.seed),
+                         args.host, args.port)
+    # the benchmark runner reads the url from the first line
+    sys.stdout.write(server.url + '\n')
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
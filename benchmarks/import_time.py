@@ -0,0 +1,51 @@
+"""
+    Import time of the SDK modules, each imported in a fresh interpreter.
+    Also reports whether Django, mongoengine or the login models were
+    loaded along the way.
+
+        python -m <package>.benchmarks.import_time [runs]
+"""
+import json
+import subprocess
+import sys
+
+PACKAGE = __package__.rsplit('.', 1)[0]
+
+MODULES = ('facebook_request', 'facebook_batch', 'facebook_helper',
+           'facebook_login')
+
+HEAVY = ('django', 'mongoengine', 'login.models')
+
+SCRIPT = """
+import json, sys, time
+started = time.time()
+__import__(%r)
+print(json.dumps({'seconds': time.time() - started,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure(module, runs=5):
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             SCRIPT % (PACKAGE + '.' + module, HEAVY)])
+        results.append(json.loads(output.decode('utf-8')))
+    return {
+        'module': module,
+        'seconds': min(result['seconds'] for result in results),
+        'loaded': results[0]['loaded'],
+    }
+
+
+def run(runs=5):
+    return [measure(module, runs) for module in MODULES]
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for result in run(runs):
+        print('%-20s %7.1f ms  %s' % (
+            result['module'], result['seconds'] * 1000,
+            ', '.join(result['loaded']) or '-'))
@@ -0,0 +1,62 @@
+"""
+    Memory of get_user_* items held as dicts vs MediaItem records.
+
+        python -m <package>.benchmarks.records [items] [likes per item]
+"""
+import gc
+import sys
+import tracemalloc
+from ..facebook_records import MediaItem
+
+
+def make_item(i, likes):
+    return {
+        'id': '%d' % (10150000000000000 + i),
+        'name': 'Photo %d' % i,
+        'picture': 'https://scontent.xx.fbcdn.net/v/t1/%d_s.jpg' % i,
+        'created_time': '2015-07-20T10:00:00+0000',
+        'likes': {
+            'data': [{
+                'id': '%d' % (100000000000000 + j),
+                'name': 'User %d' % j,
+                'pic_small': 'https://scontent.xx.fbcdn.net/v/t1/%d_t.jpg' % j,
+                'can_post': False,
+            } for j in range(likes)],
+            'summary': {'total_count': likes},
+        },
+    }
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    items = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return items, size
+
+
+def run(count=20000, likes=10):
+    dicts, dict_size = measure(
+        lambda: [make_item(i, likes) for i in range(count)])
+    del dicts
+    records, record_size = measure(
+        lambda: [MediaItem.from_dict(make_item(i, likes), lazy=False)
+                 for i in range(count)])
+    del records
+    return {
+        'items': count,
+        'likes_per_item': likes,
+        'dict_bytes': dict_size,
+        'record_bytes': record_size,
+        'ratio': float(record_size) / dict_size,
+    }
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    result = run(*args)
+    print('%(items)d items, %(likes_per_item)d likes each' % result)
+    print('dict:   %10d bytes' % result['dict_bytes'])
+    print('record: %10d bytes (%.0f%%)' % (result['record_bytes'],
+                                           result['ratio'] * 100))
@@ -0,0 +1,334 @@
+import asyncio
+import json
+import time
+import weakref
+from .facebook_request import GraphReponse, GraphAPIError, get_graph_url, \
+    notify_auth_error
+from .facebook_log import get_log_sink
+from .facebook_conf import get_setting
+from .facebook_ratelimit import get_scheduler
+from .facebook_retry import get_retry_policy, AUTH_EXPIRED
+from .facebook_hooks import (get_hooks, BEFORE_REQUEST, AFTER_RESPONSE,
+                             ON_ERROR, ON_RETRY, AFTER_PAGINATION)
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if aiohttp is not None:
+    CONNECTION_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+else:
+    CONNECTION_ERRORS = (asyncio.TimeoutError, OSError)
+
+
+class AsyncRawResponse(object):
+
+    """
+        Fully read aiohttp response, shaped like a requests Response
+        so GraphReponse can parse it
+    """
+
+    def __init__(self, status_code, headers, content, url, encoding=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.encoding = encoding or 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncGraphSession(object):
+
+    """
+        Shared aiohttp connection pool with bounded concurrency.
+
+        limit - max requests in flight over the whole session.
+        token_limit - default max requests in flight per access token.
+        app_limit - default max requests in flight per app id.
+
+        The semaphore of a token or an app only lives while requests
+        of it are in flight or waiting.
+    """
+
+    def __init__(self, limit=100, token_limit=None, app_limit=None,
+                 keepalive_timeout=30):
+        if aiohttp is None:
+            raise ImportError('AsyncGraphSession requires aiohttp')
+        self.limit = limit
+        self.token_limit = token_limit
+        self.app_limit = app_limit
+        self.keepalive_timeout = keepalive_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self._token_limits = {}
+        self._app_limits = {}
+        self._token_semaphores = {}
+        self._app_semaphores = {}
+        self._session = None
+
+    def set_token_limit(self, access_token, limit):
+        self._token_limits[access_token] = limit
+        self._token_semaphores.pop(access_token, None)
+
+    def set_app_limit(self, app_id, limit):
+        self._app_limits[app_id] = limit
+        self._app_semaphores.pop(app_id, None)
+
+    def _get_semaphore(self, semaphores, limits, default, key):
+        if key is None:
+            return None
+        limit = limits.get(key, default)
+        if not limit:
+            return None
+        if key not in semaphores:
+            semaphores[key] = [asyncio.Semaphore(limit), 0]
+        semaphores[key][1] += 1
+        return semaphores[key][0]
+
+    @staticmethod
+    def _put_semaphore(semaphores, key):
+        entry = semaphores.get(key)
+        if entry is not None:
+            entry[1] -= 1
+            if not entry[1]:
+                del semaphores[key]
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request(self, method, url, access_token=None, app_id=None,
+                      timeout=60, params=None, data=None):
+        # most specific limit first, so a busy token does not hold
+        # a slot of the shared pool while it waits
+        semaphores = [semaphore for semaphore in (
+            self._get_semaphore(self._token_semaphores, self._token_limits,
+                                self.token_limit, access_token),
+            self._get_semaphore(self._app_semaphores, self._app_limits,
+                                self.app_limit, app_id),
+            self._semaphore) if semaphore is not None]
+
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                await semaphore.acquire()
+                acquired.append(semaphore)
+            async with self._get_session().request(
+                    method, url, params=params, data=data,
+                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                content = await response.read()
+                return AsyncRawResponse(response.status,
+                                        response.headers,
+                                        content,
+                                        str(response.url),
+                                        response.charset)
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+            self._put_semaphore(self._token_semaphores, access_token)
+            self._put_semaphore(self._app_semaphores, app_id)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_default_sessions = weakref.WeakKeyDictionary()
+
+
+def get_default_async_session():
+    """
+        return the AsyncGraphSession shared by every request running on
+        the current event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _default_sessions:
+        _default_sessions[loop] = AsyncGraphSession()
+    return _default_sessions[loop]
+
+
+async def close_default_async_session():
+    """
+        Close the connections of the default session of the current
+        event loop, await it before the loop ends
+    """
+    session = _default_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+class AsyncGraphAPIRequest(object):
+
+    """
+        asyncio variant of GraphAPIRequest, paced by the same
+        RateLimitScheduler, retried by the same RetryPolicy and
+        reported to the same hooks
+    """
+
+    def __init__(self, access_token, path, args={}, session=None,
+                 app_id=None, scheduler=None, retry=None):
+        self.path = path
+        self.access_token = access_token
+        self.args = args
+        self.session = session
+        self.app_id = app_id
+        self.scheduler = scheduler
+        self.retry = retry
+        self.response = {}
+
+    async def get(self):
+        """
+            return the response from the request
+        """
+        return await self._request()
+
+    async def get_all(self, max_items=None, max_pages=None):
+        """
+            Fetch All data, until there no more data to retrive form.
+        """
+        self.response = [item async for item in
+                         self.iter_all(max_items, max_pages)]
+        return self.response
+
+    async def iter_all(self, max_items=None, max_pages=None):
+        """
+            Yield the items of every page one by one.
+        """
+        if max_items is not None and max_items <= 0:
+            return
+        count = 0
+        async for page in self.iter_pages(max_pages):
+            for item in page.response.get('data', []):
+                yield item
+                count += 1
+                if max_items is not None and count >= max_items:
+                    return
+
+    async def iter_pages(self, max_pages=None):
+        """
+            Yield the GraphReponse of every page, following paging.next
+        """
+        pages = 0
+        next_url = None
+        try:
+            while max_pages is None or pages < max_pages:
+                response = await self._request(next_url)
+                pages += 1
+                yield response
+                next_url = response.next_page
+                if not next_url:
+                    break
+        finally:
+            get_hooks().emit(AFTER_PAGINATION, request=self, path=self.path,
+                             pages=pages)
+
+    async def _request(self, path=None, args=None, post_args=None,
+                       method=None, timeout=60):
+        args = dict(args or self.args)
+        path = path or self.path
+
+        if post_args is not None:
+            method = "POST"
+            post_args = dict(post_args)
+
+        if self.access_token:
+            if post_args is not None:
+                post_args["access_token"] = self.access_token
+            else:
+                args["access_token"] = self.access_token
+
+        if not path.startswith(('https://', 'http://')):
+            path = get_graph_url() + path
+
+        session = self.session or get_default_async_session()
+        scheduler = self.scheduler or get_scheduler()
+        retry = self.retry or get_retry_policy()
+        hooks = get_hooks()
+        app_id = self.app_id or get_setting('FACEBOOK_APP_ID')
+        params = dict((k, str(v)) for k, v in args.items())
+        deadline = retry.start()
+        attempt = 0
+        while True:
+            if scheduler is not None:
+                while True:
+                    wait = scheduler.reserve(self.access_token, app_id)
+                    if not wait:
+                        break
+                    await asyncio.sleep(wait)
+            response = None
+            hooks.emit(BEFORE_REQUEST, request=self, method=method or "GET",
+                       path=path, attempt=attempt)
+            started = time.time()
+            try:
+                raw_response = await session.request(
+                    method or "GET", path,
+                    access_token=self.access_token,
+                    app_id=app_id,
+                    timeout=timeout,
+                    params=params,
+                    data=post_args)
+            except CONNECTION_ERRORS as e:
+                error = GraphAPIError.from_exception(e)
+            else:
+                received = time.time()
+                get_log_sink().emit({
+                    'method': method,
+                    'path': path,
+                    'timeout': timeout,
+                    'params': args,
+                    'data': post_args,
+                    'files': None
+                })
+                logged = time.time()
+                try:
+                    response = GraphReponse(raw_response)
+                except (GraphAPIError, ValueError) as e:
+                    if not isinstance(e, GraphAPIError):
+                        e = GraphAPIError({"error": {"message": str(e)}})
+                    error = e
+                    error.set_status(getattr(raw_response, 'status_code',
+                                             None))
+                else:
+                    error = response.error
+                    if scheduler is not None:
+                        scheduler.observe(response, self.access_token,
+                                          app_id)
+                content = getattr(raw_response, 'content', None)
+                hooks.emit(AFTER_RESPONSE, request=self,
+                           method=method or "GET", path=path,
+                           attempt=attempt, response=response,
+                           status=getattr(raw_response, 'status_code', None),
+                           bytes=len(content)
+                           if isinstance(content, bytes) else None,
+                           seconds=received - started, server_seconds=None,
+                           parse_seconds=time.time() - logged,
+                           log_seconds=logged - received)
+
+            if error is None:
+                return response
+            hooks.emit(ON_ERROR, request=self, method=method or "GET",
+                       path=path, attempt=attempt, error=error)
+            delay = retry.next_delay(error, attempt, method or "GET",
+                                     deadline)
+            if delay is None:
+                break
+            hooks.emit(ON_RETRY, request=self, method=method or "GET",
+                       path=path, attempt=attempt, error=error, delay=delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if error.category == AUTH_EXPIRED and self.access_token:
+            notify_auth_error(self.access_token)
+        if response is None:
+            raise error
+        return response
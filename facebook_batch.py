@@ -0,0 +1,206 @@
+import copy
+import json
+import time
+from requests.structures import CaseInsensitiveDict
+from .facebook_request import GraphAPIRequest, GraphReponse, GraphAPIError, \
+    get_graph_url
+from .facebook_retry import get_retry_policy
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+class BatchItemResponse(object):
+
+    """
+        One sub-response of a batch call, shaped like a requests
+        Response so GraphReponse can parse it
+    """
+
+    def __init__(self, item, url):
+        self.status_code = item.get('code', 200)
+        self.headers = CaseInsensitiveDict(
+            (header['name'], header['value'])
+            for header in item.get('headers') or [])
+        self.headers.setdefault('content-type', 'application/json')
+        self.text = item.get('body') or ''
+        self.content = self.text.encode('utf-8')
+        self.url = url
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class GraphBatchRequest(object):
+
+    """
+        Collects GraphAPIRequest objects and sends them through the
+        Graph Api batch endpoint, `batch_size` (at most 50) per POST.
+        A batch of idempotent requests only is retried like a GET, and
+        the items failing with a transient error are sent again in the
+        following batches as the retry policy allows.
+    """
+
+    MAX_BATCH_SIZE = 50
+
+    def __init__(self, access_token, session=None,
+                 batch_size=MAX_BATCH_SIZE, retry=None):
+        self.access_token = access_token
+        self.session = session
+        self.retry = retry
+        self.batch_size = min(batch_size, self.MAX_BATCH_SIZE)
+        self.requests = []
+
+    def add(self, request):
+        """
+            Queue a GraphAPIRequest, return its index in the results
+        """
+        self.requests.append(request)
+        return len(self.requests) - 1
+
+    def __len__(self):
+        return len(self.requests)
+
+    def execute(self):
+        """
+            Send every queued request, return a list in the same order
+            holding a GraphReponse, or the GraphAPIError of that item.
+        """
+        urls = [None] * len(self.requests)
+        return self._send(list(zip(self.requests, urls)))
+
+    def get_all(self):
+        """
+            Fetch all pages of every queued request, the next pages of
+            all requests are fetched together in the following batches.
+            return a list of item lists in the same order.
+        """
+        results = [[] for _ in self.requests]
+        pending = [(i, request, None)
+                   for i, request in enumerate(self.requests)]
+        while pending:
+            responses = self._send([(request, url)
+                                    for _, request, url in pending])
+            next_pending = []
+            for (i, request, _), response in zip(pending, responses):
+                if isinstance(response, GraphAPIError):
+                    raise response
+                results[i].extend(response.response.get('data', []))
+                if response.next_page:
+                    next_pending.append((i, request, response.next_page))
+            pending = next_pending
+        return results
+
+    def _send(self, entries):
+        results = [None] * len(entries)
+        retry = self.retry or get_retry_policy()
+        deadline = retry.start()
+        pending = list(range(len(entries)))
+        attempt = 0
+        while pending:
+            for start in range(0, len(pending), self.batch_size):
+                chunk = pending[start:start + self.batch_size]
+                for i, result in zip(chunk, self._send_chunk(
+                        [entries[i] for i in chunk])):
+                    results[i] = result
+            # failed items are sent again in the next batches
+            retried = []
+            delay = 0
+            for i in pending:
+                if not isinstance(results[i], GraphAPIError):
+                    continue
+                item_delay = retry.next_delay(
+                    results[i], attempt, self._method(entries[i][0]),
+                    deadline)
+                if item_delay is not None:
+                    retried.append(i)
+                    delay = max(delay, item_delay)
+            if retried:
+                time.sleep(delay)
+            pending = retried
+            attempt += 1
+        return results
+
+    def _send_chunk(self, chunk):
+        batch = [self._encode(request, url) for request, url in chunk]
+        response = GraphAPIRequest(self.access_token, '', {},
+                                   session=self.session,
+                                   retry=self._retry_policy(batch))._request(
+            post_args={'batch': json.dumps(batch),
+                       'include_headers': 'true'})
+        items = response.response
+        if not isinstance(items, list):
+            raise GraphAPIError(items)
+        graph_url = get_graph_url()
+        return [self._decode(item, graph_url + entry['relative_url'])
+                for item, entry in zip(items, batch)]
+
+    def _retry_policy(self, batch):
+        retry = self.retry or get_retry_policy()
+        if all(entry['method'] in retry.idempotent_methods
+               for entry in batch):
+            # sending the batch again only repeats reads
+            retry = copy.copy(retry)
+            retry.idempotent_methods = \
+                tuple(retry.idempotent_methods) + ('POST',)
+        return retry
+
+    @staticmethod
+    def _method(request):
+        method = getattr(request, 'method', None) or 'GET'
+        if getattr(request, 'post_args', None) is not None and \
+                method == 'GET':
+            method = 'POST'
+        return method
+
+    def _encode(self, request, url=None):
+        method = self._method(request)
+        post_args = getattr(request, 'post_args', None)
+
+        if url:
+            relative_url = url
+        else:
+            args = dict(request.args or {})
+            if request.access_token and \
+                    request.access_token != self.access_token:
+                if post_args is not None:
+                    post_args = dict(post_args,
+                                     access_token=request.access_token)
+                else:
+                    args['access_token'] = request.access_token
+            relative_url = request.path
+            if args:
+                relative_url += '?' + urlencode(args)
+        if relative_url.startswith(get_graph_url()):
+            relative_url = relative_url[len(get_graph_url()):]
+
+        entry = {'method': method, 'relative_url': relative_url.lstrip('/')}
+        if post_args is not None:
+            entry['body'] = urlencode(post_args)
+        return entry
+
+    def _decode(self, item, url):
+        if item is None:
+            # the sub-request timed out
+            return GraphAPIError({'error': {
+                'message': 'Batch item was not processed',
+                'is_transient': True}})
+        try:
+            response = GraphReponse(BatchItemResponse(item, url))
+        except GraphAPIError as e:
+            error = e
+        except ValueError:
+            error = GraphAPIError({'error': {'message': item.get('body')}})
+        else:
+            if isinstance(response.response, dict) and \
+                    'error' in response.response:
+                error = GraphAPIError(response.response)
+            elif response.raw_reponse.status_code >= 400:
+                error = GraphAPIError({'error': {
+                    'message': item.get('body') or
+                    'Batch item failed with status %s' % item['code']}})
+            else:
+                return response
+        error.set_status(item.get('code'))
+        return error
@@ -0,0 +1,241 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCacheBackend(object):
+
+    """
+        In-process LRU cache with a TTL per entry
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.pop(key)
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class DjangoCacheBackend(object):
+
+    """
+        Backend over the Django cache framework, shared by all workers
+        using the same cache alias
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.cache.set(key, value, ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+def token_key(access_token):
+    """
+        Cache key of an access token, the token itself is never stored
+    """
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+
+
+class TokenValidationCache(object):
+
+    """
+        Cache of GraphAPIHelper.validate_access_token results.
+
+        Valid tokens are kept until the `expires_at` debug_token
+        returned, at most `max_ttl` seconds. Invalid tokens are kept
+        `invalid_ttl` seconds.
+    """
+
+    prefix = 'fb-token-valid:'
+
+    def __init__(self, backend=None, max_ttl=3600, invalid_ttl=60):
+        self.backend = backend if backend is not None else LocalCacheBackend()
+        self.max_ttl = max_ttl
+        self.invalid_ttl = invalid_ttl
+
+    def _key(self, access_token):
+        return self.prefix + token_key(access_token)
+
+    def get(self, access_token):
+        """
+            return the cached validation result, None when unknown
+        """
+        return self.backend.get(self._key(access_token))
+
+    def set(self, access_token, is_valid, expires_at=0):
+        if is_valid:
+            ttl = self.max_ttl
+            if expires_at:
+                ttl = min(ttl, int(expires_at - time.time()))
+        else:
+            ttl = self.invalid_ttl
+        if ttl > 0:
+            self.backend.set(self._key(access_token), bool(is_valid), ttl)
+
+    def invalidate(self, access_token):
+        if access_token:
+            self.backend.delete(self._key(access_token))
+
+
+class CachedResponse(object):
+
+    __slots__ = ('response', 'etag', 'fresh_until')
+
+    def __init__(self, response, etag, fresh_until):
+        self.response = response
+        self.etag = etag
+        self.fresh_until = fresh_until
+
+    @property
+    def fresh(self):
+        return time.time() < self.fresh_until
+
+
+class ResponseCache(object):
+
+    """
+        LRU cache of GET GraphReponse objects keyed on path, args and
+        access token.
+
+        default_ttl - seconds a response is served without a request.
+        ttls - per endpoint TTLs, e.g. {'me': 60, 'me/photos': 300},
+            the longest matching path prefix wins.
+
+        Stale responses with an ETag are revalidated with If-None-Match,
+        a 304 answer serves the cached GraphReponse again.
+    """
+
+    def __init__(self, maxsize=1000, default_ttl=60, ttls=None):
+        self.backend = LocalCacheBackend(maxsize)
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _endpoint(self, path):
+        if '://' in path:
+            path = path.split('://', 1)[1].partition('/')[2]
+        return path.split('?', 1)[0].strip('/')
+
+    def ttl(self, path):
+        endpoint = self._endpoint(path)
+        best = None
+        for prefix in self.ttls:
+            if endpoint == prefix or endpoint.startswith(prefix + '/'):
+                if best is None or len(prefix) > len(best):
+                    best = prefix
+        if best is None:
+            return self.default_ttl
+        return self.ttls[best]
+
+    def key(self, path, args, access_token):
+        args = sorted((str(k), str(v)) for k, v in (args or {}).items()
+                      if k != 'access_token')
+        token = token_key(access_token) if access_token else ''
+        return (path, tuple(args), token)
+
+    def get(self, key):
+        """
+            return the CachedResponse of key, fresh or stale
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+        elif entry.fresh:
+            self.hits += 1
+        return entry
+
+    def store(self, key, response):
+        ttl = self.ttl(key[0])
+        etag = response.headers.get('etag')
+        if ttl <= 0 and not etag:
+            return
+        self.backend.set(key, CachedResponse(response, etag,
+                                             time.time() + ttl))
+
+    def refresh(self, key, entry):
+        """
+            The server answered 304 Not Modified for a stale entry
+        """
+        self.revalidated += 1
+        entry.fresh_until = time.time() + self.ttl(key[0])
+        self.backend.set(key, entry)
+        return entry.response
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.backend),
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+        }
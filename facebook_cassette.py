@@ -0,0 +1,223 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from requests.structures import CaseInsensitiveDict
+from .facebook_session import get_default_session
+try:
+    from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+except ImportError:
+    from urlparse import urlsplit, urlunsplit, parse_qsl
+    from urllib import urlencode
+
+RECORD = 'record'
+REPLAY = 'replay'
+AUTO = 'auto'
+
+# size of the record that follows, in the data file
+_LENGTH = struct.Struct('>I')
+
+# the stored body is already decoded
+_DROPPED_HEADERS = ('content-encoding', 'transfer-encoding',
+                    'content-length', 'set-cookie')
+
+
+def _strip_token(url):
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query)
+             if k != 'access_token']
+    return urlunsplit(parts[:3] + (urlencode(query), parts.fragment))
+
+
+class CassetteMiss(LookupError):
+
+    """
+        Replayed request that was never recorded
+    """
+
+
+class CassetteResponse(object):
+
+    """
+        Recorded response, shaped like a requests Response
+    """
+
+    def __init__(self, url, status_code, headers, content, elapsed=0.0):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.headers['content-length'] = str(len(content))
+        self.content = content
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        stream = io.BytesIO(self.content)
+        return iter(lambda: stream.read(chunk_size), b'')
+
+    def close(self):
+        pass
+
+
+class CassetteStore(object):
+
+    """
+        Append-only store of responses: `<path>.data` holds the zlib
+        compressed records, `<path>.idx` one "key offset length" line
+        per record. The index is loaded in a dict, a lookup is a single
+        seek and read of the data file. A key recorded twice serves its
+        last record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path + '.idx'):
+            with open(path + '.idx') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 3:
+                        self.index[parts[0]] = (int(parts[1]), int(parts[2]))
+        self._data = open(path + '.data', 'a+b')
+        self._idx = open(path + '.idx', 'a')
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, key):
+        """
+            return the record dict of key, None when it is missing
+        """
+        position = self.index.get(key)
+        if position is None:
+            return None
+        offset, length = position
+        with self._lock:
+            self._data.seek(offset + _LENGTH.size)
+            data = zlib.decompress(self._data.read(length))
+        meta, _, content = data.partition(b'\n')
+        record = json.loads(meta.decode('utf-8'))
+        record['content'] = content
+        return record
+
+    def put(self, key, record):
+        content = record.pop('content')
+        data = zlib.compress(json.dumps(record).encode('utf-8') + b'\n' +
+                             content)
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(_LENGTH.pack(len(data)) + data)
+            self._data.flush()
+            self._idx.write('%s %d %d\n' % (key, offset, len(data)))
+            self._idx.flush()
+            self.index[key] = (offset, len(data))
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._idx.close()
+
+
+class CassetteSession(object):
+
+    """
+        Transport recording real Graph Api responses, or serving them
+        back without network. Pass it as the `session` of a request or
+        install it with set_default_session.
+
+        mode - RECORD sends every request through `session` and stores
+            the response, REPLAY only serves stored responses and raises
+            CassetteMiss otherwise, AUTO replays what it has and records
+            the rest.
+        latency - seconds slept before a replayed response, 'recorded'
+            sleeps as long as the recorded request took.
+
+        Requests are matched on method, url, params and form data,
+        the access token is ignored. It is removed from the stored url
+        and headers, but paging urls in recorded bodies keep it: treat
+        a cassette like the tokens it was recorded with.
+    """
+
+    def __init__(self, path, mode=REPLAY, session=None, latency=None):
+        if mode not in (RECORD, REPLAY, AUTO):
+            raise ValueError('Unknown cassette mode %r' % (mode,))
+        self.store = CassetteStore(path)
+        self.mode = mode
+        self.session = session
+        self.latency = latency
+        self.recorded = 0
+        self.replayed = 0
+
+    @staticmethod
+    def key(method, url, params=None, data=None):
+        parts = urlsplit(url)
+        args = parse_qsl(parts.query) + list((params or {}).items())
+        if isinstance(data, dict):
+            args += [('@' + str(k), v) for k, v in data.items()]
+        args = sorted((str(k), str(v)) for k, v in args
+                      if k not in ('access_token', '@access_token'))
+        url = urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+        return hashlib.sha1(json.dumps([method.upper(), url, args]).encode(
+            'utf-8')).hexdigest()
+
+    def request(self, method, url, **kwargs):
+        key = self.key(method, url, kwargs.get('params'), kwargs.get('data'))
+        if self.mode != RECORD:
+            record = self.store.get(key)
+            if record is not None:
+                self.replayed += 1
+                delay = record['elapsed'] if self.latency == 'recorded' \
+                    else self.latency
+                if delay:
+                    time.sleep(delay)
+                return CassetteResponse(record['url'], record['status'],
+                                        record['headers'], record['content'],
+                                        record['elapsed'])
+            if self.mode == REPLAY:
+                raise CassetteMiss('%s %s was not recorded' % (method, url))
+
+        session = self.session or get_default_session()
+        started = time.time()
+        raw = session.request(method, url, **kwargs)
+        content = raw.content
+        elapsed = time.time() - started
+        url = _strip_token(raw.url or url)
+        headers = dict((name, value) for name, value in raw.headers.items()
+                       if name.lower() not in _DROPPED_HEADERS)
+        self.store.put(key, {
+            'url': url,
+            'status': raw.status_code,
+            'headers': headers,
+            'elapsed': elapsed,
+            'content': content,
+        })
+        self.recorded += 1
+        return CassetteResponse(url, raw.status_code, headers, content,
+                                elapsed)
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'records': len(self.store),
+            'recorded': self.recorded,
+            'replayed': self.replayed,
+        }
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,18 @@
+import os
+
+
+def get_setting(name, default=None):
+    """
+        return the Django setting `name`, or the environment variable of
+        the same name when Django is not installed or not configured.
+        Resolved at call time so the SDK can be imported without
+        Django settings.
+    """
+    try:
+        from django.conf import settings
+    except ImportError:
+        settings = None
+    if settings is not None and settings.configured and \
+            hasattr(settings, name):
+        return getattr(settings, name)
+    return os.environ.get(name, default)
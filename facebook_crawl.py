@@ -0,0 +1,292 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# job priorities, lower runs first
+NEW_USER = 0
+REFRESH = 10
+
+# edge of the job fetching and storing every edge of a user
+ALL = 'all'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class CrawlJob(object):
+
+    """
+        Fetch of one edge ('photos', 'videos', 'posts'...) of one user
+    """
+
+    def __init__(self, fb_id, edge, access_token, priority=REFRESH):
+        self.fb_id = fb_id
+        self.edge = edge
+        self.access_token = access_token
+        self.priority = priority
+        self.status = QUEUED
+        self.items = None
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def key(self):
+        return (self.fb_id, self.edge)
+
+    def as_dict(self):
+        return {
+            'fb_id': self.fb_id,
+            'edge': self.edge,
+            'priority': self.priority,
+            'status': self.status,
+            'items': self.items,
+            'error': str(self.error) if self.error is not None else None,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class MemoryJobQueue(object):
+
+    """
+        In-process priority queue of CrawlJob objects.
+        Within a priority the jobs of different access tokens are
+        interleaved, so one user with many jobs cannot starve the rest.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._rounds = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def put(self, job):
+        with self._cond:
+            key = (job.priority, job.access_token)
+            fair_round = self._rounds.get(key, 0)
+            self._rounds[key] = fair_round + 1
+            heapq.heappush(self._heap, (job.priority, fair_round,
+                                        next(self._counter), job))
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+            return the next job, None after `timeout` seconds
+        """
+        with self._cond:
+            if not self._heap:
+                self._cond.wait(timeout)
+            if not self._heap:
+                return None
+            job = heapq.heappop(self._heap)[3]
+            key = (job.priority, job.access_token)
+            self._rounds[key] -= 1
+            if not self._rounds[key]:
+                del self._rounds[key]
+            return job
+
+    def __len__(self):
+        return len(self._heap)
+
+
+def fetch_user(job):
+    """
+        Fetch and store every edge of the user with the app's
+        tasks.fetch_all
+    """
+    import tasks
+    return tasks.fetch_all(job.fb_id)
+
+
+def fetch_edge(job):
+    """
+        Default job handler, fetch the edge through GraphAPIHelper.
+        An ALL job runs fetch_user, the items it fetches are stored.
+    """
+    if job.edge == ALL:
+        return fetch_user(job)
+    from .facebook_helper import GraphAPIHelper
+    from .facebook_tokens import get_token_manager
+    access_token = job.access_token
+    manager = get_token_manager()
+    if manager is not None:
+        access_token = manager.get_fresh_token(job.fb_id, access_token)
+    return getattr(GraphAPIHelper, 'get_user_' + job.edge)(
+        job.fb_id, access_token)
+
+
+class CrawlScheduler(object):
+
+    """
+        Runs CrawlJob objects from a job queue on a worker pool.
+
+        handler - callable(job) doing the fetch, its result is passed
+            to `on_result(job, result)`.
+        executor - concurrent.futures executor, a ThreadPoolExecutor of
+            `workers` threads by default. With a ProcessPoolExecutor
+            the handler must be a module level function.
+
+        A job for a (user, edge) already queued or running is not
+        queued again. Only the last `keep_finished` finished jobs are
+        kept in `jobs`.
+    """
+
+    def __init__(self, handler=fetch_edge, workers=4, queue=None,
+                 executor=None, on_result=None, keep_finished=1000):
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue if queue is not None else MemoryJobQueue()
+        self.executor = executor
+        self.on_result = on_result
+        self.jobs = {}
+        self.keep_finished = keep_finished
+        self.done = 0
+        self.failed = 0
+        self._finished = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(workers)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def submit(self, fb_id, edge, access_token, priority=REFRESH):
+        """
+            Queue a job, return it or the job already in flight
+        """
+        job = CrawlJob(fb_id, edge, access_token, priority)
+        with self._lock:
+            current = self.jobs.get(job.key)
+            if current is not None and current.status in (QUEUED, RUNNING):
+                return current
+            self.jobs[job.key] = job
+        self.queue.put(job)
+        self.start()
+        return job
+
+    def submit_user(self, fb_id, access_token, edges=('photos', 'videos',
+                                                       'posts'),
+                    priority=REFRESH):
+        return [self.submit(fb_id, edge, access_token, priority)
+                for edge in edges]
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._dispatch,
+                                            name='facebook-crawl')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if self._thread is not None and wait:
+            self._thread.join()
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            if not self._slots.acquire(timeout=0.1):
+                continue
+            job = self.queue.get(timeout=0.1)
+            if job is None:
+                self._slots.release()
+                continue
+            job.status = RUNNING
+            job.started_at = time.time()
+            future = self.executor.submit(self.handler, job)
+            future.add_done_callback(
+                lambda future, job=job: self._finish(job, future))
+
+    def _finish(self, job, future):
+        try:
+            result = future.result()
+            if isinstance(result, list):
+                job.items = len(result)
+            if self.on_result is not None:
+                self.on_result(job, result)
+        except Exception as e:
+            job.error = e
+            status = FAILED
+        else:
+            status = DONE
+        job.finished_at = time.time()
+        with self._lock:
+            if status == DONE:
+                self.done += 1
+            else:
+                self.failed += 1
+            job.status = status
+            self._finished.append(job)
+            while len(self._finished) > self.keep_finished:
+                old = self._finished.popleft()
+                if self.jobs.get(old.key) is old:
+                    del self.jobs[old.key]
+        self._slots.release()
+
+    def join(self, timeout=None):
+        """
+            Wait until every submitted job finished
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while any(job.status in (QUEUED, RUNNING)
+                  for job in list(self.jobs.values())):
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def clear_finished(self):
+        """
+            Forget the jobs that are done or failed
+        """
+        with self._lock:
+            for key, job in list(self.jobs.items()):
+                if job.status in (DONE, FAILED):
+                    del self.jobs[key]
+            self._finished.clear()
+
+    def progress(self):
+        """
+            Counts of jobs per status and the state of every job
+        """
+        jobs = list(self.jobs.values())
+        counts = dict((status, 0) for status in (QUEUED, RUNNING, DONE,
+                                                  FAILED))
+        for job in jobs:
+            counts[job.status] += 1
+        counts['jobs'] = [job.as_dict() for job in jobs]
+        return counts
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_crawl_scheduler():
+    """
+        return the per-process CrawlScheduler, created on first use
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CrawlScheduler()
+        return _scheduler
+
+
+def set_crawl_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
@@ -0,0 +1,57 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .facebook_request import GraphAPIRequest, GraphAPIError, \
+    BinaryGraphReponse
+
+
+def download_path(directory, url):
+    """
+        File path of url in directory, stable for the same url
+    """
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(directory, name)
+
+
+def download_all(urls, directory, access_token=None, workers=8,
+                 chunk_size=65536, hash_name=None, session=None):
+    """
+        Download image urls (photo sources, profile pictures) into
+        directory on a pool of `workers` threads, the bodies are
+        streamed to disk.
+
+        access_token is only needed for Graph urls, CDN urls should be
+        fetched without it.
+
+        return a list in the same order holding the response dict
+        (path, size, mime-type, url and the digest) of each url, or
+        the GraphAPIError it failed with, a failed url does not stop
+        the others.
+    """
+    def download(url):
+        request = GraphAPIRequest(access_token, url, {}, session=session)
+        try:
+            response = request.download(download_path(directory, url),
+                                        chunk_size, hash_name)
+        except GraphAPIError as e:
+            return e
+        except IOError as e:
+            # broken transfer or disk error, requests errors included
+            return GraphAPIError.from_exception(e)
+        if not isinstance(response, BinaryGraphReponse):
+            # give the unread streamed body back to the pool
+            raw = getattr(response, 'raw_reponse', None)
+            if hasattr(raw, 'close'):
+                raw.close()
+        if response.error is not None:
+            return response.error
+        if not isinstance(response, BinaryGraphReponse):
+            return GraphAPIError({"error": {
+                "message": "Not an image response: %s" % url}})
+        return response.response
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        return list(pool.map(download, urls))
+    finally:
+        pool.shutdown()
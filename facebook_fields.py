@@ -0,0 +1,278 @@
+import threading
+from .facebook_request import GraphAPIRequest, GraphAPIError
+from .facebook_retry import TRANSIENT
+try:
+    from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+except ImportError:
+    from urlparse import urlsplit, urlunsplit, parse_qsl
+    from urllib import urlencode
+
+
+def plan_fields(fields, modifiers=None):
+    """
+        Build the Graph field expansion of dotted field paths, in the
+        order they are first named:
+
+            plan_fields(['likes.id', 'likes.name', 'picture'],
+                        {'likes': 'summary(true)'})
+            -> 'likes.summary(true){id,name},picture'
+
+        modifiers - dotted path to the modifiers of that field,
+            e.g. 'limit(0).summary(true)'.
+    """
+    modifiers = modifiers or {}
+    tree = {}
+    order = {}
+    for field in fields:
+        node, node_order = tree, order
+        for name in field.split('.'):
+            if name not in node:
+                node[name] = {}
+                node_order.setdefault(None, []).append(name)
+                node_order[name] = {}
+            node, node_order = node[name], node_order[name]
+
+    def build(node, node_order, prefix):
+        parts = []
+        for name in node_order.get(None, []):
+            path = prefix + name
+            part = name
+            if path in modifiers:
+                part += '.' + modifiers[path]
+            if node[name]:
+                part += '{%s}' % build(node[name], node_order[name],
+                                       path + '.')
+            parts.append(part)
+        return ','.join(parts)
+
+    return build(tree, order, '')
+
+
+def with_limit(url, limit):
+    """
+        Copy of a paging url asking for `limit` items
+    """
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != 'limit']
+    query.append(('limit', str(limit)))
+    return urlunsplit(parts[:3] + (urlencode(query), parts.fragment))
+
+
+class AdaptiveLimit(object):
+
+    """
+        Page size that shrinks when a page fails with a transient error
+        (timeouts, "reduce the amount of data") or is larger than
+        `byte_budget`, and grows back while pages stay well under it.
+    """
+
+    def __init__(self, limit=500, min_limit=25, max_limit=500,
+                 byte_budget=None, grow=1.5):
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.byte_budget = byte_budget
+        self.grow = grow
+        self._lock = threading.Lock()
+
+    def observe(self, items, size):
+        """
+            Account a page of `size` bytes, return the limit of the next
+            one
+        """
+        with self._lock:
+            if self.byte_budget and size and items:
+                if size > self.byte_budget:
+                    self.limit = int(self.limit * self.byte_budget / size)
+                elif size * self.grow < self.byte_budget:
+                    self.limit = int(self.limit * self.grow)
+            self.limit = max(self.min_limit, min(self.max_limit, self.limit))
+            return self.limit
+
+    def backoff(self):
+        """
+            Halve the limit after a failed page, return the new limit,
+            None when it already is at min_limit
+        """
+        with self._lock:
+            if self.limit <= self.min_limit:
+                return None
+            self.limit = max(self.min_limit, self.limit // 2)
+            return self.limit
+
+
+class FieldPreset(object):
+
+    """
+        Named selection of fields for the get_user_* fetchers and the
+        page size bounds of its queries. A preset is shared, every
+        crawl gets its own PresetFetch through fetch() and adds its
+        pages to the totals of the preset, see stats().
+    """
+
+    def __init__(self, name, fields, modifiers=None, limit=500,
+                 min_limit=25, byte_budget=None):
+        self.name = name
+        self.fields = tuple(fields)
+        self.expansion = plan_fields(fields, modifiers)
+        self.limit = limit
+        self.min_limit = min_limit
+        self.byte_budget = byte_budget
+        self.pages = 0
+        self.items = 0
+        self.bytes = 0
+        self.backoffs = 0
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_per_item(self):
+        return float(self.bytes) / self.items if self.items else 0.0
+
+    def _add(self, pages=0, items=0, size=0, backoffs=0):
+        with self._lock:
+            self.pages += pages
+            self.items += items
+            self.bytes += size
+            self.backoffs += backoffs
+
+    def args(self, args=None):
+        args = dict(args or {})
+        args['fields'] = self.expansion
+        args['limit'] = str(self.limit)
+        return args
+
+    def fetch(self):
+        """
+            return a PresetFetch adapting the page size of one crawl
+        """
+        return PresetFetch(self)
+
+    def get_all(self, request, record=None):
+        return self.fetch().get_all(request, record)
+
+    def stats(self):
+        """
+            Totals of every crawl of the preset
+        """
+        with self._lock:
+            return {
+                'name': self.name,
+                'fields': self.expansion,
+                'pages': self.pages,
+                'items': self.items,
+                'bytes': self.bytes,
+                'bytes_per_item': self.bytes_per_item,
+                'backoffs': self.backoffs,
+            }
+
+
+class PresetFetch(object):
+
+    """
+        Pagination of one crawl with a FieldPreset: the adaptive page
+        size of its queries and the bytes per item its responses weigh.
+    """
+
+    def __init__(self, preset):
+        self.preset = preset
+        self.limiter = AdaptiveLimit(preset.limit, preset.min_limit,
+                                     preset.limit, preset.byte_budget)
+        self.pages = 0
+        self.items = 0
+        self.bytes = 0
+        self.backoffs = 0
+
+    @property
+    def bytes_per_item(self):
+        return float(self.bytes) / self.items if self.items else 0.0
+
+    def observe(self, page):
+        """
+            Account a page, return the limit of the next one
+        """
+        items = len(page.response.get('data', [])) \
+            if isinstance(page.response, dict) else 0
+        size = GraphAPIRequest._response_bytes(page.raw_reponse)
+        self.pages += 1
+        self.items += items
+        self.bytes += size or 0
+        self.preset._add(1, items, size or 0)
+        return self.limiter.observe(items, size)
+
+    def iter_pages(self, request):
+        """
+            Paginate request, the limit of every next page is adapted
+            to the size of the previous ones. A page failing with a
+            transient error is asked again with half the items.
+        """
+        resume = False
+        while True:
+            try:
+                for page in request.iter_pages(resume=resume):
+                    self._set_limit(request, self.observe(page))
+                    yield page
+                return
+            except GraphAPIError as e:
+                limit = e.category == TRANSIENT and self.limiter.backoff()
+                if not limit:
+                    raise
+                self.backoffs += 1
+                self.preset._add(backoffs=1)
+                self._set_limit(request, limit)
+                resume = True
+
+    @staticmethod
+    def _set_limit(request, limit):
+        # the next page is asked with the paging url and the request args
+        request.args = dict(request.args, limit=str(limit))
+        if request.cursor:
+            request.cursor = with_limit(request.cursor, limit)
+
+    def get_all(self, request, record=None):
+        items = []
+        for page in self.iter_pages(request):
+            for item in page.iter_data():
+                items.append(record.from_dict(item) if record is not None
+                             else item)
+        request.response = items
+        return items
+
+    def stats(self):
+        return {
+            'name': self.preset.name,
+            'fields': self.preset.expansion,
+            'limit': self.limiter.limit,
+            'pages': self.pages,
+            'items': self.items,
+            'bytes': self.bytes,
+            'bytes_per_item': self.bytes_per_item,
+            'backoffs': self.backoffs,
+        }
+
+
+# page size the built-in presets adapt their limit to
+PAGE_BYTES = 1 << 20
+
+PRESETS = dict((preset.name, preset) for preset in (
+    # what the fetchers always asked for
+    FieldPreset('full', ['likes.pic_small', 'likes.name', 'likes.id',
+                         'likes.can_post', 'picture', 'name'],
+                {'likes': 'summary(true)'}, byte_budget=PAGE_BYTES),
+    FieldPreset('basic', ['id', 'name', 'picture', 'created_time'],
+                byte_budget=PAGE_BYTES),
+    FieldPreset('like_counts', ['id', 'created_time', 'likes'],
+                {'likes': 'limit(0).summary(true)'}, byte_budget=PAGE_BYTES),
+    FieldPreset('ids', ['id', 'created_time'], byte_budget=PAGE_BYTES),
+))
+
+
+def get_preset(preset):
+    """
+        return the FieldPreset of a preset name, or preset itself
+    """
+    if isinstance(preset, FieldPreset):
+        return preset
+    try:
+        return PRESETS[preset]
+    except KeyError:
+        raise ValueError('Unknown field preset %r' % (preset,))
@@ -1,14 +1,59 @@
-from .facebook_request import GraphAPIRequest
-from django.conf import settings
+from .facebook_request import GraphAPIRequest, register_auth_error_handler
+from .facebook_batch import GraphBatchRequest
+from .facebook_cache import TokenValidationCache
+from .facebook_shard import ShardedCrawl
+from .facebook_upload import MultipartStream, ChunkedVideoUpload
+from .facebook_fields import PRESETS, get_preset
+from .facebook_nested import NestedEdgeFetch
+from .facebook_conf import get_setting
 
 
 class GraphAPIHelper(object):
 
-    @classmethod
-    def get_connections(cls, id, connection_name, **args):
+    # GraphSession used by every request the helper makes,
+    # None falls back to the per-process default pool
+    session = None
+
+    # TokenValidationCache of validate_access_token results,
+    # None validates every time
+    token_cache = TokenValidationCache()
+
+    # opt-in ResponseCache of the helper GET requests
+    response_cache = None
+
+    MEDIA_FIELDS = PRESETS['full'].expansion
+
+    def __init__(self, access_token=None, version=None, batch=None):
+        """
+            access_token - token used by the write operations.
+            batch - a GraphBatchRequest, when given requests are queued
+                on it instead of being sent right away.
+        """
+        self.access_token = access_token
+        self.version = version or get_setting('FACEBOOK_VERSION')
+        self.batch = batch
+
+    def request(self, path, args=None, post_args=None, files=None,
+                method=None, body=None):
+        """
+            Send a request with the helper access token, return the
+            response dict, or the index of the request when batching.
+        """
+        request = GraphAPIRequest(self.access_token, path, args or {},
+                                  session=self.session,
+                                  cache=self.response_cache,
+                                  method=method,
+                                  post_args=post_args,
+                                  files=files,
+                                  body=body)
+        if self.batch is not None and files is None and body is None:
+            return self.batch.add(request)
+        return request.get().response
+
+    def get_connections(self, id, connection_name, **args):
         """Fetchs the connections for given object."""
         return self.request(
-            settings.FACEBOOK_VERSION + "/" + id + "/" + connection_name, args)
+            self.version + "/" + id + "/" + connection_name, args)
 
     def put_object(self, parent_object, connection_name, **data):
         """Writes the given object to the graph, connected to the given parent.
@@ -79,15 +124,40 @@ class GraphAPIHelper(object):
         """
         Upload an image using multipart/form-data.
 
-        image - A file object representing the image to be uploaded.
+        image - A file-like object or the path of the image to be
+            uploaded, a seekable one is streamed rather than read in
+            memory.
         album_path - A path representing where the image should be uploaded.
 
         """
-        return self.request(
-            self.version + "/" + album_path,
-            post_args=kwargs,
-            files={"source": image},
-            method="POST")
+        if not hasattr(image, 'read'):
+            with open(image, 'rb') as image:
+                return self.put_photo(image, album_path, **kwargs)
+        try:
+            body = MultipartStream(kwargs, {"source": image})
+        except (AttributeError, IOError, ValueError):
+            # not seekable, let requests read it whole
+            return self.request(
+                self.version + "/" + album_path,
+                post_args=kwargs,
+                files={"source": image},
+                method="POST")
+        return self.request(self.version + "/" + album_path, body=body)
+
+    def put_video(self, video, target="me", **kwargs):
+        """
+        Upload a video in chunks, see ChunkedVideoUpload.
+
+        video - A file object or the path of the video to be uploaded.
+        target - The user or page the video is uploaded to.
+
+        """
+        if not hasattr(video, 'read'):
+            with open(video, 'rb') as video:
+                return self.put_video(video, target, **kwargs)
+        return ChunkedVideoUpload(self.access_token, video, target,
+                                  version=self.version,
+                                  session=self.session, **kwargs).run()
 
     def extend_access_token(self, access_token, app_id, app_secret):
         """
@@ -103,13 +173,35 @@ class GraphAPIHelper(object):
         }
         return GraphAPIRequest(None,
                                "oauth/access_token",
-                               args=args).get().response
+                               args=args,
+                               session=self.session).get().response
+
+    @classmethod
+    def batch_request(cls, access_token, batch_size=None):
+        """
+            return a GraphBatchRequest sharing the helper session, e.g.
+
+                batch = GraphAPIHelper.batch_request(access_token)
+                graph = GraphAPIHelper(access_token, batch=batch)
+                graph.put_like(post_id)
+                graph.put_comment(post_id, "First!")
+                results = batch.execute()
+        """
+        return GraphBatchRequest(
+            access_token, session=cls.session,
+            batch_size=batch_size or GraphBatchRequest.MAX_BATCH_SIZE)
 
     @classmethod
     def validate_access_token(cls, access_token):
         """
-            Validate access token with Graph API
+            Validate access token with Graph API,
+            the result is cached until the token expires
         """
+        if cls.token_cache is not None:
+            is_valid = cls.token_cache.get(access_token)
+            if is_valid is not None:
+                return is_valid
+
         params = {
             'input_token': access_token
         }
@@ -117,44 +209,138 @@ class GraphAPIHelper(object):
         res = GraphAPIRequest(
             access_token,
             '/debug_token',
-            params).get()
+            params,
+            session=cls.session).get()
 
-        if 'is_valid' in res.response['data']:
-            return bool(res.response['data']['is_valid'])
-        return False
+        data = res.response.get('data', {})
+        is_valid = bool(data.get('is_valid', False))
+        if cls.token_cache is not None and 'is_valid' in data:
+            cls.token_cache.set(access_token, is_valid,
+                                data.get('expires_at', 0))
+        return is_valid
 
-    @staticmethod
-    def get_user_photos(fb_id, access_token):
+    @classmethod
+    def invalidate_access_token(cls, access_token):
         """
-            return all user photos by access_token
+            Forget the cached validation of access token
         """
-        args = {
-            'fields': 'likes.summary(true){pic_small,name,id,can_post},picture,name',
-            'limit': '500'
-        }
-        res = GraphAPIRequest(access_token, '/me/photos', args).get_all()
-        return res
+        if cls.token_cache is not None:
+            cls.token_cache.invalidate(access_token)
 
-    @staticmethod
-    def get_user_videos(fb_id, access_token):
+    @classmethod
+    def get_user_photos(cls, fb_id, access_token, prefetch=0, sync=None,
+                        record=None, preset=None):
         """
             return all user photos by access_token
         """
-        args = {
-            'fields': 'likes.summary(true){pic_small,name,id,can_post},picture,name',
-            'limit': '500'
-        }
-        res = GraphAPIRequest(access_token, '/me/videos', args).get_all()
-        return res
+        return cls._get_user_edge(fb_id, access_token, 'photos', prefetch,
+                                  sync, record, preset)
+
+    @classmethod
+    def get_user_videos(cls, fb_id, access_token, prefetch=0, sync=None,
+                        record=None, preset=None):
+        """
+            return all user videos by access_token
+        """
+        return cls._get_user_edge(fb_id, access_token, 'videos', prefetch,
+                                  sync, record, preset)
 
-    @staticmethod
-    def get_user_posts(fb_id, access_token):
+    @classmethod
+    def get_user_posts(cls, fb_id, access_token, prefetch=0, sync=None,
+                        record=None, preset=None):
         """
-            return all user photos by access_token
+            return all user posts by access_token
         """
-        args = {
-            'fields': 'likes.summary(true){pic_small,name,id,can_post},picture,name',
+        return cls._get_user_edge(fb_id, access_token, 'posts', prefetch,
+                                  sync, record, preset)
+
+    @classmethod
+    def _get_user_edge(cls, fb_id, access_token, edge, prefetch=0,
+                       sync=None, record=None, preset=None):
+        """
+            preset - a FieldPreset or the name of one of PRESETS, only
+                its fields are fetched with an adaptive page size. With
+                sync the fields are fetched with the preset limit, the
+                adaptive page size cannot be combined with prefetch.
+        """
+        if preset is not None:
+            if prefetch:
+                raise ValueError('preset and prefetch cannot be combined')
+            preset = get_preset(preset)
+        request = cls._edge_request(access_token, edge, preset)
+        if sync is not None:
+            return sync.fetch(request, fb_id, edge, prefetch, record)
+        if preset is not None:
+            return preset.fetch().get_all(request, record)
+        return request.get_all(prefetch=prefetch, record=record)
+
+    @classmethod
+    def iter_user_edges(cls, fb_id, access_token,
+                        edges=('photos', 'videos', 'posts'), limit=100,
+                        preset=None, record=None):
+        """
+            return a dict of edge to an iterator of the user items, the
+            first page of every edge comes from a single request
+        """
+        return cls._nested_fetch(access_token, edges, limit,
+                                 preset).streams(record)
+
+    @classmethod
+    def get_user_edges(cls, fb_id, access_token,
+                       edges=('photos', 'videos', 'posts'), limit=100,
+                       preset=None, record=None):
+        """
+            return all user photos, videos and posts by access_token,
+            from one nested request then the paging of every edge
+            followed in parallel
+        """
+        return cls._nested_fetch(access_token, edges, limit,
+                                 preset).get_all(record)
+
+    @classmethod
+    def _nested_fetch(cls, access_token, edges, limit, preset=None):
+        fields = get_preset(preset).expansion if preset is not None \
+            else cls.MEDIA_FIELDS
+        return NestedEdgeFetch(access_token, edges, fields, limit=limit,
+                               session=cls.session,
+                               cache=cls.response_cache)
+
+    @classmethod
+    def get_user_edge_sharded(cls, fb_id, access_token, edge, since=None,
+                              until=None, shards=8, workers=8):
+        """
+            return all items of a user edge ('photos', 'posts'...),
+            crawled as `shards` time windows in parallel
+        """
+        return ShardedCrawl(cls._edge_request(access_token, edge),
+                            since=since, until=until, shards=shards,
+                            workers=workers).get_all()
+
+    @classmethod
+    def get_user_media(cls, fb_id, access_token,
+                       edges=('photos', 'videos', 'posts')):
+        """
+            return all user photos, videos and posts by access_token,
+            the pages of all edges are fetched together in batch calls.
+        """
+        batch = cls.batch_request(access_token)
+        for edge in edges:
+            batch.add(cls._edge_request(access_token, edge))
+        return dict(zip(edges, batch.get_all()))
+
+    @classmethod
+    def _edge_request(cls, access_token, edge, preset=None):
+        args = preset.args() if preset is not None else cls._media_args()
+        return GraphAPIRequest(access_token, '/me/' + edge, args,
+                               session=cls.session,
+                               cache=cls.response_cache)
+
+    @classmethod
+    def _media_args(cls):
+        return {
+            'fields': cls.MEDIA_FIELDS,
             'limit': '500'
         }
-        res = GraphAPIRequest(access_token, '/me/posts', args).get_all()
-        return res
+
+
+register_auth_error_handler(GraphAPIHelper.invalidate_access_token)
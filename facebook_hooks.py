@@ -0,0 +1,80 @@
+import threading
+
+# events emitted by GraphAPIRequest
+BEFORE_REQUEST = 'before_request'
+AFTER_RESPONSE = 'after_response'
+ON_ERROR = 'on_error'
+ON_RETRY = 'on_retry'
+AFTER_PAGINATION = 'after_pagination'
+
+EVENTS = (BEFORE_REQUEST, AFTER_RESPONSE, ON_ERROR, ON_RETRY,
+          AFTER_PAGINATION)
+
+
+class Hooks(object):
+
+    """
+        Registry of instrumentation handlers per event, called with
+        keyword arguments:
+
+        before_request - request, method, path, attempt.
+        after_response - the same and response, status, bytes, seconds
+            (the whole HTTP call), server_seconds (until the headers were
+            received), parse_seconds, log_seconds.
+        on_error - request, method, path, attempt, error.
+        on_retry - the same and delay.
+        after_pagination - request, path, pages.
+
+        An exception raised by a handler is counted in `failures` and
+        never reaches the request.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self.failures = 0
+
+    def register(self, event, handler):
+        if event not in EVENTS:
+            raise ValueError('Unknown event %r' % (event,))
+        with self._lock:
+            # copy on write, emit() reads the lists without the lock
+            self._handlers[event] = self._handlers.get(event, ()) + \
+                (handler,)
+
+    def unregister(self, event, handler):
+        with self._lock:
+            handlers = list(self._handlers.get(event, ()))
+            if handler in handlers:
+                handlers.remove(handler)
+            self._handlers[event] = tuple(handlers)
+
+    def __contains__(self, event):
+        return bool(self._handlers.get(event))
+
+    def emit(self, event, **info):
+        for handler in self._handlers.get(event, ()):
+            try:
+                handler(event=event, **info)
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+
+
+_hooks = Hooks()
+
+
+def get_hooks():
+    return _hooks
+
+
+def register_hook(event, handler):
+    """
+        Call handler(event=..., **info) on every `event` of every
+        GraphAPIRequest
+    """
+    _hooks.register(event, handler)
+
+
+def unregister_hook(event, handler):
+    _hooks.unregister(event, handler)
@@ -0,0 +1,74 @@
+# Graph Api responses are decoded with the fastest installed backend:
+# orjson, ujson, simplejson or json. ijson, when installed, decodes a
+# response while it downloads (see StreamingGraphReponse).
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+    backend = 'orjson'
+except ImportError:
+    try:
+        import ujson
+
+        def loads(data):
+            return ujson.loads(data)
+        backend = 'ujson'
+    except ImportError:
+        try:
+            import simplejson as _json
+            backend = 'simplejson'
+        except ImportError:
+            import json as _json
+            backend = 'json'
+
+        def loads(data):
+            if isinstance(data, bytes):
+                data = data.decode('utf-8')
+            return _json.loads(data)
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+SCALAR_EVENTS = ('null', 'boolean', 'integer', 'double', 'number',
+                 'string')
+
+
+def iter_graph_page(stream):
+    """
+        Incrementally decode a Graph Api page from a file-like object,
+        yield ('data', item) for every item of `data` as soon as it is
+        complete and (key, value) for the other top level keys.
+    """
+    if ijson is None:
+        page = loads(stream.read())
+        for key, value in page.items():
+            if key == 'data' and isinstance(value, list):
+                for item in value:
+                    yield 'data', item
+            else:
+                yield key, value
+        return
+
+    builder = None
+    target = None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == target and event in ('end_map', 'end_array'):
+                key = 'data' if target == 'data.item' else target
+                yield key, builder.value
+                builder = None
+            continue
+
+        if prefix == 'data.item' or ('.' not in prefix and
+                                     prefix not in ('', 'data')):
+            if event in ('start_map', 'start_array'):
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                target = prefix
+            elif event in SCALAR_EVENTS:
+                key = 'data' if prefix == 'data.item' else prefix
+                yield key, value
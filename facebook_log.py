@@ -0,0 +1,175 @@
+import atexit
+import random
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class NullLogSink(object):
+
+    """
+        Request log sink that discards every record
+    """
+
+    def emit(self, record):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MongoLogWriter(object):
+
+    """
+        Bulk writer of request records into login.models.RequestsLog.
+        Mongo is only imported and connected on the first write.
+    """
+
+    def __init__(self, db='test', host='mongodb://localhost/test'):
+        self.db = db
+        self.host = host
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            from mongoengine import connect
+            from login.models import RequestsLog
+            connect(self.db, host=self.host)
+            self._model = RequestsLog
+        return self._model
+
+    def __call__(self, records):
+        model = self._get_model()
+        model.objects.insert([model(**record) for record in records],
+                             load_bulk=False)
+
+
+class BufferedLogSink(object):
+
+    """
+        Request log sink that queues records in memory and hands them
+        to `writer` in batches from a background thread.
+
+        writer - callable receiving a list of records.
+        max_queue - bound of the in-memory queue, records are dropped
+            when it is full.
+        batch_size - flush as soon as that many records are waiting.
+        flush_interval - flush at least every that many seconds.
+        sample_rate - once the queue is more than `sample_above` full,
+            only this fraction of the new records is kept.
+    """
+
+    def __init__(self, writer, max_queue=10000, batch_size=500,
+                 flush_interval=1.0, sample_rate=1.0, sample_above=0.5):
+        self.writer = writer
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.sample_above = sample_above
+        self.emitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.failed = 0
+        self._queue = queue.Queue(max_queue)
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='facebook-request-log')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        if (self.sample_rate < 1.0 and
+                self._queue.qsize() >= self.max_queue * self.sample_above and
+                random.random() >= self.sample_rate):
+            with self._stats_lock:
+                self.sampled_out += 1
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+        else:
+            with self._stats_lock:
+                self.emitted += 1
+
+    def _drain(self, limit):
+        records = []
+        while len(records) < limit:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def _write(self, records):
+        if not records:
+            return
+        try:
+            self.writer(records)
+            self.written += len(records)
+        except Exception:
+            self.failed += len(records)
+
+    def flush(self):
+        """
+            Write everything that is queued right now
+        """
+        with self._flush_lock:
+            records = self._drain(self.batch_size)
+            while records:
+                self._write(records)
+                records = self._drain(self.batch_size)
+
+    def _run(self):
+        deadline = time.time() + self.flush_interval
+        while not self._stop.is_set():
+            if (self._queue.qsize() >= self.batch_size or
+                    time.time() >= deadline):
+                self.flush()
+                deadline = time.time() + self.flush_interval
+            self._stop.wait(min(0.05, self.flush_interval))
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'emitted': self.emitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'failed': self.failed,
+        }
+
+
+_log_sink = NullLogSink()
+
+
+def get_log_sink():
+    return _log_sink
+
+
+def set_log_sink(sink):
+    """
+        Install the sink every GraphAPIRequest logs to, e.g.
+
+            set_log_sink(BufferedLogSink(MongoLogWriter()))
+    """
+    global _log_sink
+    _log_sink = sink or NullLogSink()
@@ -1,9 +1,21 @@
-from django.conf import settings
-from login.models import Users
+from .facebook_conf import get_setting
 from .facebook_request import GraphAPIRequest
 from .facebook_helper import GraphAPIHelper
-from urllib import urlencode
-import tasks
+from .facebook_crawl import get_crawl_scheduler, ALL, NEW_USER
+from .facebook_tokens import get_token_manager, expires_at
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+def get_users():
+    """
+        The Users model, imported on first use so the handler module
+        loads without the Mongo models
+    """
+    from login.models import Users
+    return Users
 
 
 class FacebookLoginHandler(object):
@@ -39,7 +51,9 @@ class FacebookLoginHandler(object):
             if 'error' not in res and 'access_token' in res:
                 access_token = res['access_token']
                 res['user_data'] = GraphAPIRequest(
-                    access_token, '/me').get().response
+                    access_token, '/me', {},
+                    session=GraphAPIHelper.session,
+                    cache=GraphAPIHelper.response_cache).get().response
                 fb_id = res['user_data']['id']
 
                 self._set_login_session(res)
@@ -52,43 +66,60 @@ class FacebookLoginHandler(object):
         return False
 
     def on_new_user(self, data):
-        self._register_tasks(data)
         self._create_user(data)
+        self._register_tasks(data)
 
     def _create_user(self, data):
         fb_id = data['user_data']['id']
-        user_data = data['user_data']
+        user_data = dict(data['user_data'])
         del user_data['id']
+        access_token = data.get('access_token', None)
+        access_token_expires = expires_at(data)
 
-        Users.objects.create(
+        get_users().objects.create(
             fb_id=fb_id,
-            access_token=data.get('access_token', None),
-            access_token_expires=data.get('expires', 0),
+            access_token=access_token,
+            access_token_expires=access_token_expires,
             **user_data
         )
+        manager = get_token_manager()
+        if manager is not None and access_token:
+            manager.track(fb_id, access_token, access_token_expires)
 
     def get_user(self, fb_id):
-        user = Users.objects.filter(fb_id=fb_id).first()
+        user = get_users().objects.filter(fb_id=fb_id).first()
         if user:
             return user
         return False
 
     def _register_tasks(self, data):
-        tasks.fetch_all(data['user_data']['id'])
+        """
+            Queue the fetch and storage of the new user media on the
+            process CrawlScheduler, see set_crawl_scheduler
+        """
+        get_crawl_scheduler().submit(data['user_data']['id'], ALL,
+                                     data.get('access_token', None),
+                                     priority=NEW_USER)
+
+    def logout(self):
+        access_token = self._request.session.pop('access_token', None)
+        self._request.session.pop('fb_id', None)
+        self._user_data = {}
+        if access_token:
+            GraphAPIHelper.invalidate_access_token(access_token)
 
     def _set_login_session(self, res):
         self._request.session['fb_id'] = res['user_data']['id']
         self._request.session['access_token'] = res['access_token']
 
     @staticmethod
-    def get_access_token_from_code(code, redirect_uri=settings.URL_SITE,
-                                   app_id=settings.FACEBOOK_APP_ID,
-                                   app_secret=settings.FACEBOOK_SECRET):
+    def get_access_token_from_code(code, redirect_uri=None, app_id=None,
+                                   app_secret=None):
         args = {
             "code": code,
-            "redirect_uri": redirect_uri,
-            "client_id": app_id,
-            "client_secret": app_secret}
+            "redirect_uri": redirect_uri or get_setting('URL_SITE'),
+            "client_id": app_id or get_setting('FACEBOOK_APP_ID'),
+            "client_secret": app_secret or get_setting('FACEBOOK_SECRET')}
 
         return GraphAPIRequest(None, "oauth/access_token", args).get().response
 
@@ -96,9 +127,12 @@ class FacebookLoginHandler(object):
     def get_login_url():
         url = "https://www.facebook.com/dialog/oauth?"
         kvps = {
-            'client_id': settings.FACEBOOK_APP_ID,
-            'redirect_uri': settings.URL_SITE,
+            'client_id': get_setting('FACEBOOK_APP_ID'),
+            'redirect_uri': get_setting('URL_SITE'),
         }
-        kvps['scope'] = ",".join(settings.SCOPE_PREMISSON)
+        scope = get_setting('SCOPE_PREMISSON', ())
+        if not isinstance(scope, str):
+            scope = ",".join(scope)
+        kvps['scope'] = scope
 
         return url + urlencode(kvps)
@@ -0,0 +1,212 @@
+import re
+import threading
+from .facebook_hooks import (get_hooks, BEFORE_REQUEST, AFTER_RESPONSE,
+                             ON_ERROR, ON_RETRY, AFTER_PAGINATION)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PAGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+PHASES = ('server', 'parse', 'log')
+
+_VERSION = re.compile(r'^v\d+(\.\d+)?$')
+
+
+def endpoint(path):
+    """
+        Group urls by endpoint: https://graph.facebook.com/v2.4/1234/photos
+        becomes /{version}/{id}/photos
+    """
+    path = path.split('?', 1)[0]
+    if '://' in path:
+        path = path.split('://', 1)[1].partition('/')[2]
+    parts = ['{version}' if _VERSION.match(part) else
+             '{id}' if part.replace('_', '').isdigit() else part
+             for part in path.split('/') if part]
+    return '/' + '/'.join(parts)
+
+
+class Histogram(object):
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+        yield '+Inf', self.count
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict((str(bound), count)
+                                for bound, count in self.cumulative())}
+
+
+class EndpointMetrics(object):
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.pages = Histogram(PAGE_BUCKETS)
+        self.phases = dict((phase, 0.0) for phase in PHASES)
+        self.requests = 0
+        self.bytes = 0
+        self.errors = {}
+        self.retries = 0
+
+    def as_dict(self):
+        errors = sum(self.errors.values())
+        return {
+            'requests': self.requests,
+            'latency': self.latency.as_dict(),
+            'pages': self.pages.as_dict(),
+            'phases': dict(self.phases),
+            'bytes': self.bytes,
+            'errors': dict(self.errors),
+            'error_rate': float(errors) / self.requests
+            if self.requests else 0.0,
+            'retries': self.retries,
+        }
+
+
+class MetricsCollector(object):
+
+    """
+        Per-endpoint latency histograms, bytes received, page counts of
+        every pagination, errors and retries, fed by the request hooks.
+
+            metrics = MetricsCollector().install()
+            ...
+            metrics.snapshot()    # dict
+            metrics.prometheus()  # Prometheus text format
+    """
+
+    def __init__(self, prefix='facebook_graph'):
+        self.prefix = prefix
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self._hooks = None
+
+    def install(self, hooks=None):
+        self._hooks = hooks or get_hooks()
+        self._hooks.register(BEFORE_REQUEST, self.on_request)
+        self._hooks.register(AFTER_RESPONSE, self.on_response)
+        self._hooks.register(ON_ERROR, self.on_error)
+        self._hooks.register(ON_RETRY, self.on_retry)
+        self._hooks.register(AFTER_PAGINATION, self.on_pagination)
+        return self
+
+    def uninstall(self):
+        if self._hooks is not None:
+            self._hooks.unregister(BEFORE_REQUEST, self.on_request)
+            self._hooks.unregister(AFTER_RESPONSE, self.on_response)
+            self._hooks.unregister(ON_ERROR, self.on_error)
+            self._hooks.unregister(ON_RETRY, self.on_retry)
+            self._hooks.unregister(AFTER_PAGINATION, self.on_pagination)
+            self._hooks = None
+
+    def _metrics(self, path):
+        name = endpoint(path)
+        metrics = self.endpoints.get(name)
+        if metrics is None:
+            metrics = self.endpoints[name] = EndpointMetrics()
+        return metrics
+
+    def on_request(self, path, **info):
+        with self._lock:
+            self._metrics(path).requests += 1
+
+    def on_response(self, path, seconds, bytes=None, server_seconds=None,
+                    parse_seconds=0.0, log_seconds=0.0, **info):
+        with self._lock:
+            metrics = self._metrics(path)
+            metrics.latency.observe(seconds)
+            metrics.bytes += bytes or 0
+            if server_seconds is not None:
+                metrics.phases['server'] += server_seconds
+            metrics.phases['parse'] += parse_seconds
+            metrics.phases['log'] += log_seconds
+
+    def on_error(self, path, error, **info):
+        category = getattr(error, 'category', None) or 'unknown'
+        with self._lock:
+            errors = self._metrics(path).errors
+            errors[category] = errors.get(category, 0) + 1
+
+    def on_retry(self, path, **info):
+        with self._lock:
+            self._metrics(path).retries += 1
+
+    def on_pagination(self, path, pages, **info):
+        with self._lock:
+            self._metrics(path).pages.observe(pages)
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+    def snapshot(self):
+        with self._lock:
+            return dict((name, metrics.as_dict())
+                        for name, metrics in self.endpoints.items())
+
+    def prometheus(self):
+        """
+            return the metrics in the Prometheus text exposition format
+        """
+        p = self.prefix
+        lines = []
+        with self._lock:
+            endpoints = [('endpoint="%s"' % name.replace('"', '\\"'),
+                          self.endpoints[name])
+                         for name in sorted(self.endpoints)]
+            # every family is one group under its TYPE line
+            lines.append('# TYPE %s_requests_total counter' % p)
+            for label, metrics in endpoints:
+                lines.append('%s_requests_total{%s} %d' % (
+                    p, label, metrics.requests))
+            for metric, attr in (('request_seconds', 'latency'),
+                                 ('pages', 'pages')):
+                lines.append('# TYPE %s_%s histogram' % (p, metric))
+                for label, metrics in endpoints:
+                    histogram = getattr(metrics, attr)
+                    if not histogram.count:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append('%s_%s_bucket{%s,le="%s"} %d' % (
+                            p, metric, label, bound, count))
+                    lines.append('%s_%s_sum{%s} %r' % (p, metric, label,
+                                                       histogram.sum))
+                    lines.append('%s_%s_count{%s} %d' % (
+                        p, metric, label, histogram.count))
+            lines.append('# TYPE %s_phase_seconds_total counter' % p)
+            for label, metrics in endpoints:
+                for phase in PHASES:
+                    lines.append('%s_phase_seconds_total{%s,phase="%s"} %r'
+                                 % (p, label, phase, metrics.phases[phase]))
+            lines.append('# TYPE %s_response_bytes_total counter' % p)
+            for label, metrics in endpoints:
+                lines.append('%s_response_bytes_total{%s} %d' % (
+                    p, label, metrics.bytes))
+            lines.append('# TYPE %s_errors_total counter' % p)
+            for label, metrics in endpoints:
+                for category in sorted(metrics.errors):
+                    lines.append('%s_errors_total{%s,category="%s"} %d' % (
+                        p, label, category, metrics.errors[category]))
+            lines.append('# TYPE %s_retries_total counter' % p)
+            for label, metrics in endpoints:
+                lines.append('%s_retries_total{%s} %d' % (p, label,
+                                                          metrics.retries))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,89 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from .facebook_request import GraphAPIRequest
+
+
+def nested_fields(edges, fields, limit):
+    """
+        Field expansion asking the first page of every edge,
+        e.g. photos.limit(100){picture,name},videos.limit(100){...}
+    """
+    return ','.join('%s.limit(%d){%s}' % (edge, limit, fields)
+                    for edge in edges)
+
+
+class NestedEdgeFetch(object):
+
+    """
+        Fetch several edges of one object with a single request through
+        nested field expansion, then follow the paging of every edge on
+        its own prefetch thread.
+
+            fetch = NestedEdgeFetch(access_token, ('photos', 'videos'),
+                                    MEDIA_FIELDS)
+            for edge, items in fetch.streams().items(): ...
+
+        prefetch - pages fetched ahead per edge once its stream passed
+            the first page, 0 follows the paging in the caller thread.
+    """
+
+    def __init__(self, access_token, edges, fields, path='/me', limit=100,
+                 prefetch=2, session=None, cache=None):
+        self.access_token = access_token
+        self.edges = tuple(edges)
+        self.fields = fields
+        self.path = path
+        self.limit = limit
+        self.prefetch = prefetch
+        self.session = session
+        self.cache = cache
+        self.response = None
+
+    def first(self):
+        """
+            Send the nested request, return its response dict
+        """
+        if self.response is None:
+            request = GraphAPIRequest(
+                self.access_token, self.path,
+                {'fields': nested_fields(self.edges, self.fields,
+                                         self.limit)},
+                session=self.session, cache=self.cache)
+            response = request.get()
+            if response.error is not None:
+                raise response.error
+            self.response = response.response
+        return self.response
+
+    def _stream(self, edge, record=None):
+        page = self.first().get(edge) or {}
+        items = iter(page.get('data', []))
+        next_page = page.get('paging', {}).get('next')
+        if next_page:
+            # the paging url carries the fields and limit of the edge
+            request = GraphAPIRequest(self.access_token, next_page, {},
+                                      session=self.session)
+            items = itertools.chain(items, request.iter_all(
+                prefetch=self.prefetch))
+        if record is not None:
+            items = (record.from_dict(item) for item in items)
+        return items
+
+    def streams(self, record=None):
+        """
+            return a dict of edge to an iterator of its items
+        """
+        self.first()
+        return dict((edge, self._stream(edge, record)) for edge in self.edges)
+
+    def get_all(self, record=None):
+        """
+            return a dict of edge to the list of its items, the edges
+            are followed in parallel
+        """
+        streams = self.streams(record)
+        with ThreadPoolExecutor(max_workers=len(streams) or 1) as pool:
+            futures = dict((edge, pool.submit(list, stream))
+                           for edge, stream in streams.items())
+            return dict((edge, future.result())
+                        for edge, future in futures.items())
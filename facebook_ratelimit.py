@@ -0,0 +1,255 @@
+import json
+import threading
+import time
+from .facebook_retry import THROTTLE_CODES
+
+
+class TokenBucket(object):
+
+    """
+        Token bucket refilled with `rate` tokens per second,
+        holding at most `capacity` tokens
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    def _refill(self, now):
+        elapsed = max(now - self.updated, 0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """
+            Seconds until a token is available
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class UsageBudget(object):
+
+    """
+        Pacing state of one app or one access token
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = float(rate)
+        self.bucket = TokenBucket(rate, burst)
+        self.usage = {}
+        self.utilisation = 0.0
+        self.throttled_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def wait_time(self, now):
+        return max(self.bucket.wait_time(now), self.throttled_until - now)
+
+    def update(self, utilisation, target, min_rate):
+        """
+            Full rate up to half the utilisation target, then slowed
+            down linearly to min_rate at the target and above
+        """
+        self.utilisation = utilisation
+        if target > 0:
+            headroom = (target - utilisation) / (target * 0.5)
+        else:
+            headroom = 0.0
+        headroom = min(max(headroom, 0.0), 1.0)
+        rate = min_rate + (self.max_rate - min_rate) * headroom
+        self.bucket.rate = min(max(rate, min_rate), self.max_rate)
+
+    def metrics(self, now):
+        return {
+            'usage': dict(self.usage),
+            'utilisation': self.utilisation,
+            'rate': self.bucket.rate,
+            'available': self.bucket.tokens,
+            'throttled_for': max(self.throttled_until - now, 0.0),
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'waited': self.waited,
+        }
+
+
+class RateLimitScheduler(object):
+
+    """
+        Paces Graph Api Requests per app and per access token from the
+        X-App-Usage / X-Business-Use-Case-Usage headers.
+
+        target - utilisation (0..1) of the Facebook limits to stay under.
+        app_rate / token_rate - max requests per second.
+        burst - requests allowed at once before pacing starts.
+        cooldown - pause in seconds after a throttle error without an
+            estimated time to regain access.
+    """
+
+    def __init__(self, target=0.8, app_rate=50, token_rate=10, burst=10,
+                 min_rate=0.1, cooldown=60):
+        self.target = target
+        self.app_rate = app_rate
+        self.token_rate = token_rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._apps = {}
+        self._tokens = {}
+
+    def _budgets(self, access_token, app_id):
+        if app_id not in self._apps:
+            self._apps[app_id] = UsageBudget(self.app_rate, self.burst)
+        budgets = [self._apps[app_id]]
+        if access_token:
+            if access_token not in self._tokens:
+                self._tokens[access_token] = UsageBudget(self.token_rate,
+                                                         self.burst)
+            budgets.append(self._tokens[access_token])
+        return budgets
+
+    def reserve(self, access_token=None, app_id=None):
+        """
+            Take a request slot for that token if one is free and
+            return 0, else return the seconds to wait before asking
+            again
+        """
+        with self._lock:
+            now = time.time()
+            budgets = self._budgets(access_token, app_id)
+            wait = max(budget.wait_time(now) for budget in budgets)
+            if wait <= 0:
+                for budget in budgets:
+                    budget.bucket.take(now)
+                    budget.requests += 1
+                return 0
+            for budget in budgets:
+                budget.waited += wait
+            return wait
+
+    def acquire(self, access_token=None, app_id=None):
+        """
+            Block until a request for that token may be sent
+        """
+        while True:
+            wait = self.reserve(access_token, app_id)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def observe(self, response, access_token=None, app_id=None):
+        """
+            Update the budgets from the headers and error of a GraphReponse
+        """
+        headers = response.headers or {}
+        app_usage = parse_usage_header(headers.get('x-app-usage'))
+        business_usage = parse_business_usage_header(
+            headers.get('x-business-use-case-usage'))
+
+        with self._lock:
+            now = time.time()
+            budgets = self._budgets(access_token, app_id)
+            app_budget = budgets[0]
+            if app_usage:
+                app_budget.usage = app_usage
+                app_budget.update(utilisation(app_usage), self.target,
+                                  self.min_rate)
+            if business_usage and len(budgets) > 1:
+                token_budget = budgets[1]
+                token_budget.usage = business_usage
+                token_budget.update(utilisation(business_usage), self.target,
+                                    self.min_rate)
+                regain = business_usage.get(
+                    'estimated_time_to_regain_access', 0)
+                if regain:
+                    token_budget.throttled_until = now + regain * 60
+
+            if is_throttle_error(response.response):
+                for budget in budgets:
+                    budget.throttled += 1
+                    budget.throttled_until = max(budget.throttled_until,
+                                                 now + self.cooldown)
+                    budget.bucket.rate = max(budget.bucket.rate / 2,
+                                             self.min_rate)
+
+    def metrics(self):
+        """
+            return the current budget of every app and access token
+        """
+        with self._lock:
+            now = time.time()
+            return {
+                'apps': dict((app_id, budget.metrics(now))
+                             for app_id, budget in self._apps.items()),
+                'tokens': dict((token, budget.metrics(now))
+                               for token, budget in self._tokens.items()),
+            }
+
+
+def parse_usage_header(value):
+    """
+        X-App-Usage: {"call_count":28,"total_time":25,"total_cputime":25}
+    """
+    if not value:
+        return {}
+    try:
+        usage = json.loads(value)
+    except ValueError:
+        return {}
+    return usage if isinstance(usage, dict) else {}
+
+
+def parse_business_usage_header(value):
+    """
+        X-Business-Use-Case-Usage: {"<id>": [{"type": "pages",
+        "call_count": 1, ...}]}, reduced to the most used entry
+    """
+    usage = parse_usage_header(value)
+    worst = {}
+    for entries in usage.values():
+        for entry in entries or []:
+            if utilisation(entry) >= utilisation(worst):
+                worst = entry
+    return worst
+
+
+def utilisation(usage):
+    """
+        Highest of the usage percentages, as a 0..1 fraction
+    """
+    values = [usage.get(key, 0) or 0
+              for key in ('call_count', 'total_time', 'total_cputime')]
+    return max(values) / 100.0
+
+
+def is_throttle_error(result):
+    if not isinstance(result, dict) or 'error' not in result:
+        return False
+    error = result['error']
+    return isinstance(error, dict) and error.get('code') in THROTTLE_CODES
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def set_scheduler(scheduler):
+    """
+        Install the RateLimitScheduler every GraphAPIRequest is paced by,
+        None disables pacing
+    """
+    global _scheduler
+    _scheduler = scheduler
@@ -0,0 +1,124 @@
+from array import array
+
+
+class Like(object):
+
+    __slots__ = ('id', 'name', 'pic_small', 'can_post')
+
+    def __init__(self, id, name=None, pic_small=None, can_post=None):
+        self.id = id
+        self.name = name
+        self.pic_small = pic_small
+        self.can_post = can_post
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__
+                    if getattr(self, name) is not None)
+
+
+def _flag(value):
+    """
+        can_post as 0 / 1, 2 when unknown; the Graph Api may send
+        it as a bool, a number or a string
+    """
+    if value is None:
+        return 2
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ('1', 'true') else 0
+    return 1 if value else 0
+
+
+class LikeList(object):
+
+    """
+        Columnar storage of a `likes` edge: one tuple per field instead
+        of one dict per like
+    """
+
+    __slots__ = ('ids', 'names', 'pics', 'can_post', 'total_count',
+                 'next_page')
+
+    def __init__(self, likes=None):
+        likes = likes or {}
+        data = likes.get('data', [])
+        ids = [like.get('id') for like in data]
+        if all(id is not None and str(id).isdigit() for id in ids):
+            self.ids = array('Q', [int(id) for id in ids])
+        else:
+            self.ids = tuple(ids)
+        self.names = tuple(like.get('name') for like in data)
+        self.pics = tuple(like.get('pic_small') for like in data)
+        self.can_post = bytes(bytearray(_flag(like.get('can_post'))
+                                        for like in data))
+        self.total_count = likes.get('summary', {}).get('total_count')
+        self.next_page = likes.get('paging', {}).get('next')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        can_post = self.can_post[index]
+        return Like(str(self.ids[index]), self.names[index],
+                    self.pics[index],
+                    None if can_post == 2 else bool(can_post))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def as_dict(self):
+        likes = {'data': [like.as_dict() for like in self]}
+        if self.total_count is not None:
+            likes['summary'] = {'total_count': self.total_count}
+        if self.next_page:
+            likes['paging'] = {'next': self.next_page}
+        return likes
+
+
+class MediaItem(object):
+
+    """
+        Photo, video or post of the get_user_* fetchers.
+        `likes` is decoded into a LikeList on first access unless the
+        item was built with lazy=False. The other fields of the item
+        are kept in the `extra` dict.
+    """
+
+    FIELDS = ('id', 'name', 'picture', 'created_time', 'message')
+
+    __slots__ = FIELDS + ('extra', '_likes')
+
+    def __init__(self, id, name=None, picture=None, created_time=None,
+                 message=None, likes=None, extra=None):
+        self.id = id
+        self.name = name
+        self.picture = picture
+        self.created_time = created_time
+        self.message = message
+        self.extra = extra
+        self._likes = likes
+
+    @classmethod
+    def from_dict(cls, item, lazy=True):
+        extra = dict((key, value) for key, value in item.items()
+                     if key not in cls.FIELDS and key != 'likes')
+        record = cls(item.get('id'), item.get('name'), item.get('picture'),
+                     item.get('created_time'), item.get('message'),
+                     item.get('likes'), extra or None)
+        if not lazy:
+            record.likes
+        return record
+
+    @property
+    def likes(self):
+        if not isinstance(self._likes, LikeList):
+            self._likes = LikeList(self._likes)
+        return self._likes
+
+    def as_dict(self):
+        item = dict(self.extra or {})
+        item.update((name, getattr(self, name)) for name in self.FIELDS
+                    if getattr(self, name) is not None)
+        if self._likes is not None:
+            item['likes'] = self.likes.as_dict()
+        return item
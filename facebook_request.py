@@ -1,12 +1,64 @@
+import hashlib
+import io
+import os
 import requests
-import json
-from login.models import RequestsLog
-from mongoengine import connect
+import threading
+import time
+from .facebook_session import get_default_session
+from .facebook_log import get_log_sink
+from .facebook_conf import get_setting
+from .facebook_ratelimit import get_scheduler
+from .facebook_singleflight import get_single_flight
+from .facebook_json import loads, iter_graph_page
+from .facebook_hooks import (get_hooks, BEFORE_REQUEST, AFTER_RESPONSE,
+                             ON_ERROR, ON_RETRY, AFTER_PAGINATION)
+from .facebook_retry import (get_retry_policy, classify, TRANSIENT,
+                             THROTTLED, AUTH_EXPIRED)
 try:
     from urllib.parse import parse_qs, urlencode
 except ImportError:
     from urlparse import parse_qs
     from urllib import urlencode
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+GRAPH_URL = "https://graph.facebook.com/"
+
+_graph_url = GRAPH_URL
+_auth_error_handlers = []
+
+
+def get_graph_url():
+    return _graph_url
+
+
+def set_graph_url(url):
+    """
+        Send the requests with a relative path to another Graph Api
+        host, e.g. a local stand-in server; None restores GRAPH_URL
+    """
+    global _graph_url
+    _graph_url = url.rstrip('/') + '/' if url else GRAPH_URL
+
+
+def register_auth_error_handler(handler):
+    """
+        Call handler(access_token) whenever a request fails because
+        its access token expired or was revoked
+    """
+    if handler not in _auth_error_handlers:
+        _auth_error_handlers.append(handler)
+
+
+def notify_auth_error(access_token):
+    """
+        Call the registered auth error handlers for access_token
+    """
+    for handler in _auth_error_handlers:
+        handler(access_token)
 
 
 class GraphAPIRequest(object):
@@ -15,39 +67,180 @@ class GraphAPIRequest(object):
         Graph Api Request Object
     """
 
-    def __init__(self, access_token, path, args={}):
+    def __init__(self, access_token, path, args={}, session=None,
+                 method=None, post_args=None, files=None, scheduler=None,
+                 retry=None, cache=None, single_flight=None, body=None,
+                 app_id=None):
         self.path = path
         self.access_token = access_token
         self.args = args
+        self.session = session
+        self.scheduler = scheduler
+        # app the scheduler paces, FACEBOOK_APP_ID by default
+        self.app_id = app_id
+        self.retry = retry
+        self.cache = cache
+        # SingleFlight coalescing identical GETs, False never coalesces
+        self.single_flight = single_flight
+        # next page url of an interrupted pagination
+        self.cursor = None
+        self.method = method
+        self.post_args = post_args
+        self.files = files
+        # file-like request body streamed as is, see MultipartStream
+        self.body = body
         self.response = {}
 
     def get(self):
         """
             return the response from the request
         """
-        return self._request()
+        return self._request(post_args=self.post_args, files=self.files,
+                             method=self.method, body=self.body)
 
-    def get_all(self):
+    def download(self, sink, chunk_size=65536, hash_name=None):
+        """
+            Stream an image response into `sink`, a file path or a
+            file-like object, without holding the body in memory.
+            return a BinaryGraphReponse whose response holds the path,
+            size, mime-type and, with `hash_name` (e.g. 'sha1'), the
+            digest of the body.
+        """
+        response = self._request(stream=True)
+        if isinstance(response, BinaryGraphReponse):
+            response.save(sink, chunk_size, hash_name)
+        return response
+
+    def get_all(self, max_items=None, max_pages=None, prefetch=0,
+                resume=False, stream=False, record=None):
         """
             Fetch All data, until there no more data to retrive form.
             Facebook have limiting the numbers of items you can retrive
             on each Request.
+
+            When a page fails the items fetched so far stay in
+            `response`, get_all(resume=True) continues from `cursor`
+            and returns them together with the rest.
+        """
+        items = self.response \
+            if resume and isinstance(self.response, list) else []
+        self.response = items
+        if max_items is not None:
+            max_items -= len(items)
+        for item in self.iter_all(max_items, max_pages, prefetch, resume,
+                                  stream, record):
+            items.append(item)
+        return items
+
+    def iter_all(self, max_items=None, max_pages=None, prefetch=0,
+                 resume=False, stream=False, record=None):
+        """
+            Yield the items of every page one by one, only the current
+            page is kept in memory.
+            Stop after `max_items` items or `max_pages` pages.
+            With `record` (e.g. facebook_records.MediaItem) the items
+            are decoded by record.from_dict.
         """
-        res = []
-        response = self._request()
-        if 'data' in response.response:
-            res = res + response.response['data']
-        while response.next_page:
-            next_url = response.next_page
-            response = self._request(next_url)
-            if 'data' in response.response:
-                res = res + response.response['data']
+        if max_items is not None and max_items <= 0:
+            return
+        count = 0
+        for page in self.iter_pages(max_pages, prefetch, resume, stream):
+            for item in page.iter_data():
+                if record is not None:
+                    item = record.from_dict(item)
+                yield item
+                count += 1
+                if max_items is not None and count >= max_items:
+                    return
 
-        self.response = res
-        return self.response
+    def iter_pages(self, max_pages=None, prefetch=0, resume=False,
+                   stream=False):
+        """
+            Yield the GraphReponse of every page, following paging.next
+            until there are no more pages or `max_pages` were fetched.
+
+            With `prefetch` > 0 the pages are fetched on a worker thread,
+            up to `prefetch` pages ahead of the caller.
+
+            A page still failing with a transient error once the retries
+            are exhausted raises GraphAPIError and leaves `cursor` on
+            that page, iterate again with `resume=True` to continue.
+
+            With `stream` the pages are StreamingGraphReponse objects,
+            decoded while they download: consume page.iter_data() before
+            asking for the next page. Streaming and prefetch exclude
+            each other.
+        """
+        if prefetch > 0:
+            if stream:
+                raise ValueError('stream and prefetch cannot be combined')
+            return self._iter_pages_prefetch(max_pages, prefetch, resume)
+        return self._iter_pages(max_pages, resume, stream)
+
+    def _iter_pages(self, max_pages=None, resume=False, stream=False):
+        pages = 0
+        if not resume:
+            self.cursor = None
+        try:
+            while max_pages is None or pages < max_pages:
+                response = self._request(self.cursor, stream=stream)
+                error = response.error
+                if error is not None and error.category in (TRANSIENT,
+                                                            THROTTLED):
+                    raise error
+                pages += 1
+                if stream:
+                    # paging is only known once the page was consumed
+                    yield response
+                    self.cursor = response.next_page or None
+                else:
+                    self.cursor = response.next_page or None
+                    yield response
+                if not self.cursor:
+                    break
+        finally:
+            get_hooks().emit(AFTER_PAGINATION, request=self, path=self.path,
+                             pages=pages)
+
+    def _iter_pages_prefetch(self, max_pages, depth, resume=False):
+        pages = queue.Queue(depth)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            try:
+                for page in self._iter_pages(max_pages, resume):
+                    if not put((page, None)):
+                        return
+            except Exception as e:
+                put((None, e))
+                return
+            put((None, None))
+
+        worker = threading.Thread(target=fetch, name='graph-prefetch')
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                page, error = pages.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    break
+                yield page
+        finally:
+            stop.set()
 
     def _request(self, path=None, args=None, post_args=None, files=None,
-                 method=None, timeout=60):
+                 method=None, timeout=60, stream=False, body=None):
 
         if not args:
             args = self.args
@@ -55,7 +248,7 @@ class GraphAPIRequest(object):
         if not path:
             path = self.path
 
-        if post_args is not None:
+        if post_args is not None or body is not None:
             method = "POST"
 
         if self.access_token:
@@ -64,29 +257,158 @@ class GraphAPIRequest(object):
             else:
                 args["access_token"] = self.access_token
 
-        if not path.startswith('https://'):
-            path = "https://graph.facebook.com/" + path
-        try:
-            response = requests.request(method or "GET",
-                                        path,
-                                        timeout=timeout,
-                                        params=args,
-                                        data=post_args,
-                                        files=files)
-            connect('test', host='mongodb://localhost/test')
-            RequestsLog.objects.create(**{
-                'method': method,
-                'path': path,
-                'timeout': timeout,
-                'params': args,
-                'data': post_args,
-                'files': files
-            })
-        except requests.HTTPError as e:
-            response = json.loads(e.read())
-            raise GraphAPIError(response)
-
-        return GraphReponse(response)
+        if not path.startswith(('https://', 'http://')):
+            path = _graph_url + path
+        headers = {}
+        if body is not None:
+            headers['Content-Type'] = body.content_type
+        cache_key = cached = None
+        if self.cache is not None and (method or "GET") == "GET" and \
+                post_args is None and files is None and not stream:
+            cache_key = self.cache.key(path, args, self.access_token)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                if cached.fresh:
+                    return cached.response
+                if cached.etag:
+                    headers['If-None-Match'] = cached.etag
+
+        def send():
+            return self._send(method, path, args, post_args, files, timeout,
+                              headers, cache_key, cached, stream, body)
+
+        group = self.single_flight
+        if group is None:
+            group = get_single_flight()
+        if group and (method or "GET") == "GET" and \
+                post_args is None and files is None and not stream:
+            return group.do(group.key("GET", path, args, self.access_token),
+                            send)
+        return send()
+
+    def _send(self, method, path, args, post_args, files, timeout, headers,
+              cache_key=None, cached=None, stream=False, body=None):
+        session = self.session or get_default_session()
+        scheduler = self.scheduler or get_scheduler()
+        retry = self.retry or get_retry_policy()
+        hooks = get_hooks()
+        app_id = None
+        if scheduler is not None:
+            app_id = self.app_id or get_setting('FACEBOOK_APP_ID')
+        deadline = retry.start()
+        attempt = 0
+        while True:
+            if scheduler is not None:
+                scheduler.acquire(self.access_token, app_id)
+            response = None
+            if body is not None:
+                body.seek(0)
+            hooks.emit(BEFORE_REQUEST, request=self, method=method or "GET",
+                       path=path, attempt=attempt)
+            started = time.time()
+            try:
+                raw_response = session.request(method or "GET",
+                                               path,
+                                               timeout=timeout,
+                                               params=args,
+                                               data=post_args
+                                               if body is None else body,
+                                               files=files,
+                                               headers=headers,
+                                               stream=stream)
+            except requests.RequestException as e:
+                error = GraphAPIError.from_exception(e)
+            else:
+                received = time.time()
+                if cached is not None and \
+                        getattr(raw_response, 'status_code', None) == 304:
+                    response = self.cache.refresh(cache_key, cached)
+                    elapsed = getattr(raw_response, 'elapsed', None)
+                    hooks.emit(AFTER_RESPONSE, request=self,
+                               method=method or "GET", path=path,
+                               attempt=attempt, response=response,
+                               status=304,
+                               bytes=self._response_bytes(raw_response),
+                               seconds=received - started,
+                               server_seconds=elapsed.total_seconds()
+                               if elapsed is not None else None,
+                               parse_seconds=0.0, log_seconds=0.0)
+                    return response
+                get_log_sink().emit({
+                    'method': method,
+                    'path': path,
+                    'timeout': timeout,
+                    'params': dict(args) if args else args,
+                    'data': dict(post_args) if post_args else post_args,
+                    'files': files
+                })
+                logged = time.time()
+                try:
+                    response = self._parse(raw_response, stream)
+                except (GraphAPIError, ValueError) as e:
+                    if not isinstance(e, GraphAPIError):
+                        e = GraphAPIError({"error": {"message": str(e)}})
+                    error = e
+                    if stream and hasattr(raw_response, 'close'):
+                        raw_response.close()
+                    error.set_status(getattr(raw_response, 'status_code',
+                                             None))
+                else:
+                    error = response.error
+                    if scheduler is not None:
+                        scheduler.observe(response, self.access_token,
+                                          app_id)
+                elapsed = getattr(raw_response, 'elapsed', None)
+                hooks.emit(AFTER_RESPONSE, request=self,
+                           method=method or "GET", path=path,
+                           attempt=attempt, response=response,
+                           status=getattr(raw_response, 'status_code', None),
+                           bytes=self._response_bytes(raw_response, stream),
+                           seconds=received - started,
+                           server_seconds=elapsed.total_seconds()
+                           if elapsed is not None else None,
+                           parse_seconds=time.time() - logged,
+                           log_seconds=logged - received)
+
+            if error is None:
+                if cache_key is not None:
+                    self.cache.store(cache_key, response)
+                return response
+            hooks.emit(ON_ERROR, request=self, method=method or "GET",
+                       path=path, attempt=attempt, error=error)
+            delay = retry.next_delay(error, attempt, method or "GET",
+                                     deadline)
+            if delay is None:
+                break
+            hooks.emit(ON_RETRY, request=self, method=method or "GET",
+                       path=path, attempt=attempt, error=error, delay=delay)
+            time.sleep(delay)
+            attempt += 1
+
+        if error.category == AUTH_EXPIRED and self.access_token:
+            notify_auth_error(self.access_token)
+        if response is None:
+            raise error
+        return response
+
+    @staticmethod
+    def _response_bytes(raw_response, stream=False):
+        length = (getattr(raw_response, 'headers', None) or {}).get(
+            'content-length')
+        if length is not None:
+            return int(length)
+        content = None if stream else getattr(raw_response, 'content', None)
+        return len(content) if isinstance(content, bytes) else None
+
+    def _parse(self, raw_response, stream=False):
+        if stream:
+            content_type = raw_response.headers.get('content-type', '')
+            status = getattr(raw_response, 'status_code', None) or 200
+            if 'json' in content_type and status < 400:
+                return StreamingGraphReponse(raw_response)
+            if 'image/' in content_type and status < 400:
+                return BinaryGraphReponse(raw_response)
+        return GraphReponse(raw_response)
 
 
 class GraphReponse(object):
@@ -103,7 +425,11 @@ class GraphReponse(object):
         headers = response.headers
 
         if 'json' in headers['content-type']:
-            result = response.json()
+            content = getattr(response, 'content', None)
+            if isinstance(content, bytes):
+                result = loads(content)
+            else:
+                result = response.json()
         elif 'image/' in headers['content-type']:
             mimetype = headers['content-type']
             result = {"data": getattr(response, 'content', {}),
@@ -127,6 +453,27 @@ class GraphReponse(object):
     def response(self):
         return self._response
 
+    @property
+    def headers(self):
+        return getattr(self.raw_reponse, 'headers', None) or {}
+
+    def iter_data(self):
+        """
+            Yield the items of the page
+        """
+        if isinstance(self.response, dict):
+            for item in self.response.get('data', []):
+                yield item
+
+    @property
+    def error(self):
+        """
+            GraphAPIError of an error response, None otherwise
+        """
+        if isinstance(self.response, dict) and 'error' in self.response:
+            return GraphAPIError(self.response)
+        return None
+
     @property
     def next_page(self):
         if 'paging' in self.response and 'next' in self.response['paging']:
@@ -140,27 +487,153 @@ class GraphReponse(object):
         return False
 
 
+class StreamingGraphReponse(GraphReponse):
+
+    """
+        Page of a request sent with stream=True, the body is decoded
+        while it downloads by iter_data(), only the current item is
+        held in memory. `paging` and the other top level keys are
+        available in `response` once the items were consumed.
+    """
+
+    def serialize_raw_response(self):
+        self._response = {}
+        self.consumed = False
+
+    def iter_data(self):
+        if self.consumed:
+            return
+        raw = getattr(self.raw_reponse, 'raw', None)
+        if raw is None:
+            raw = io.BytesIO(self.raw_reponse.content)
+        else:
+            raw.decode_content = True
+        try:
+            for key, value in iter_graph_page(raw):
+                if key == 'data':
+                    yield value
+                else:
+                    self._response[key] = value
+        finally:
+            self.consumed = True
+            self.close()
+
+    def close(self):
+        close = getattr(self.raw_reponse, 'close', None)
+        if close is not None:
+            close()
+
+
+class BinaryGraphReponse(GraphReponse):
+
+    """
+        Image response of a request sent with stream=True, the body
+        is only read by save()
+    """
+
+    def serialize_raw_response(self):
+        response = self.raw_reponse
+        self._response = {"mime-type": response.headers['content-type'],
+                          "url": response.url}
+
+    def save(self, sink, chunk_size=65536, hash_name=None):
+        """
+            Write the body to `sink` chunk by chunk, a path is written
+            to a temporary file renamed once complete
+        """
+        digest = hashlib.new(hash_name) if hash_name else None
+        size = 0
+        path = None
+        if isinstance(sink, str):
+            path = sink
+            sink = open(path + '.part', 'wb')
+        try:
+            for chunk in self.raw_reponse.iter_content(chunk_size):
+                if not chunk:
+                    continue
+                sink.write(chunk)
+                size += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        except Exception:
+            if path is not None:
+                sink.close()
+                os.remove(path + '.part')
+            raise
+        finally:
+            self.raw_reponse.close()
+        if path is not None:
+            sink.close()
+            os.rename(path + '.part', path)
+
+        self._response["path"] = path
+        self._response["size"] = size
+        if digest is not None:
+            self._response[hash_name] = digest.hexdigest()
+        return self._response
+
+
 class GraphAPIError(Exception):
 
+    """
+        Graph Api error, `category` is one of transient, throttled,
+        auth_expired or permanent (see facebook_retry)
+    """
+
     def __init__(self, result):
         self.result = result
-        try:
-            self.type = result["error_code"]
-        except:
-            self.type = ""
+        error = {}
+        if isinstance(result, dict):
+            error = result.get("error", {})
+            if not isinstance(error, dict):
+                error = {}
 
-        # OAuth 2.0 Draft 10
-        try:
+        # REST server style
+        self.type = error.get("type", "")
+        if not self.type and isinstance(result, dict):
+            self.type = result.get("error_code", "")
+
+        if isinstance(result, dict) and "error_description" in result:
+            # OAuth 2.0 Draft 10
             self.message = result["error_description"]
-        except:
+        elif "message" in error:
             # OAuth 2.0 Draft 00
-            try:
-                self.message = result["error"]["message"]
-            except:
-                # REST server style
-                try:
-                    self.message = result["error_msg"]
-                except:
-                    self.message = result
+            self.message = error["message"]
+        elif isinstance(result, dict) and "error_msg" in result:
+            # REST server style
+            self.message = result["error_msg"]
+        elif isinstance(result, dict) and isinstance(result.get("error"),
+                                                     str):
+            self.message = result["error"]
+        else:
+            self.message = result
+
+        self.code = error.get("code")
+        if self.code is None and isinstance(result, dict):
+            self.code = result.get("error_code")
+        self.subcode = error.get("error_subcode")
+        self.fbtrace_id = error.get("fbtrace_id")
+        self.is_transient = bool(error.get("is_transient", False))
+        self.status = None
+        self.category = classify(self.code, self.subcode, self.is_transient)
 
         Exception.__init__(self, self.message)
+
+    def set_status(self, status):
+        """
+            HTTP status of the response that caused the error
+        """
+        self.status = status
+        self.category = classify(self.code, self.subcode, self.is_transient,
+                                 status)
+
+    @classmethod
+    def from_exception(cls, exception):
+        """
+            GraphAPIError for a connection error or timeout
+        """
+        error = cls({"error": {"message": str(exception),
+                               "type": exception.__class__.__name__,
+                               "is_transient": True}})
+        error.exception = exception
+        return error
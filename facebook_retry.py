@@ -0,0 +1,133 @@
+import random
+import threading
+import time
+
+TRANSIENT = 'transient'
+THROTTLED = 'throttled'
+AUTH_EXPIRED = 'auth_expired'
+PERMANENT = 'permanent'
+
+THROTTLE_CODES = (4, 17, 32, 613) + tuple(range(80000, 80015))
+TRANSIENT_CODES = (1, 2)
+AUTH_CODES = (102, 190)
+
+
+def classify(code=None, subcode=None, is_transient=False, status=None):
+    """
+        Category of a Graph Api error: transient, throttled,
+        auth_expired or permanent
+    """
+    if code in THROTTLE_CODES:
+        return THROTTLED
+    if code in AUTH_CODES:
+        return AUTH_EXPIRED
+    if is_transient or code in TRANSIENT_CODES:
+        return TRANSIENT
+    if status is not None and status >= 500:
+        return TRANSIENT
+    return PERMANENT
+
+
+class RetryBudget(object):
+
+    """
+        Caps retries to a fraction of the requests sent: every request
+        deposits `ratio`, every retry withdraws one, up to `capacity`.
+    """
+
+    def __init__(self, ratio=0.2, initial=10, capacity=100):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.balance = float(initial)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(self.balance + self.ratio, self.capacity)
+
+    def withdraw(self):
+        with self._lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class RetryPolicy(object):
+
+    """
+        Exponential backoff with full jitter.
+
+        max_retries - retries of a single call.
+        backoff / max_backoff - base and cap of the delay in seconds.
+        deadline - seconds a call may take including its retries.
+        budget - a RetryBudget shared by every call of this policy.
+        idempotent_methods - transient errors are only retried for
+            those methods, throttled requests are always retried since
+            Facebook rejected them before processing.
+    """
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30,
+                 jitter=True, deadline=None, budget=None,
+                 retry_on=(TRANSIENT, THROTTLED),
+                 idempotent_methods=('GET', 'DELETE')):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.budget = budget
+        self.retry_on = retry_on
+        self.idempotent_methods = idempotent_methods
+
+    def start(self):
+        """
+            Called once per call, return its deadline timestamp
+        """
+        if self.budget is not None:
+            self.budget.deposit()
+        if self.deadline is None:
+            return None
+        return time.time() + self.deadline
+
+    def delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def next_delay(self, error, attempt, method='GET', deadline=None):
+        """
+            return how long to sleep before retrying, None to give up
+        """
+        if attempt >= self.max_retries:
+            return None
+        if error.category not in self.retry_on:
+            return None
+        if error.category == TRANSIENT and \
+                (method or 'GET') not in self.idempotent_methods:
+            return None
+        delay = self.delay(attempt)
+        if deadline is not None and time.time() + delay >= deadline:
+            return None
+        if self.budget is not None and not self.budget.withdraw():
+            return None
+        return delay
+
+
+NO_RETRY = RetryPolicy(max_retries=0)
+
+_retry_policy = RetryPolicy()
+
+
+def get_retry_policy():
+    return _retry_policy
+
+
+def set_retry_policy(policy):
+    """
+        Install the RetryPolicy used by every GraphAPIRequest,
+        None disables retries
+    """
+    global _retry_policy
+    _retry_policy = policy or NO_RETRY
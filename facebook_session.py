@@ -0,0 +1,106 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
+
+class GraphSession(object):
+
+    """
+        Keep-alive connection pool shared by Graph Api Requests
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0,
+                 backoff_factor=0, pool_block=False, keep_alive=True):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self._lock = threading.Lock()
+        self._requests = 0
+        self.session = self._build_session()
+
+    def _build_session(self):
+        session = requests.Session()
+        retries = Retry(total=self.max_retries,
+                        backoff_factor=self.backoff_factor,
+                        status_forcelist=(500, 502, 503, 504),
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=retries,
+                              pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+            Same signature as requests.request, but over the pooled session
+        """
+        with self._lock:
+            self._requests += 1
+        return self.session.request(method, url, **kwargs)
+
+    def stats(self):
+        """
+            Connection reuse statistics for all pools of this session
+        """
+        connections = 0
+        pool_requests = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+
+        reused = max(pool_requests - connections, 0)
+        return {
+            'requests': self._requests,
+            'connections': connections,
+            'reused': reused,
+            'reuse_ratio': float(reused) / pool_requests
+            if pool_requests else 0.0,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_default_session = None
+_default_session_pid = None
+_default_session_lock = threading.Lock()
+
+
+def get_default_session():
+    """
+        return the per-process shared GraphSession, creating it on first use.
+        A forked child never reuses the sockets of its parent.
+    """
+    global _default_session, _default_session_pid
+    with _default_session_lock:
+        if _default_session is None or _default_session_pid != os.getpid():
+            _default_session = GraphSession()
+            _default_session_pid = os.getpid()
+        return _default_session
+
+
+def set_default_session(session):
+    """
+        Replace the per-process shared GraphSession
+    """
+    global _default_session, _default_session_pid
+    with _default_session_lock:
+        _default_session = session
+        _default_session_pid = os.getpid()
@@ -0,0 +1,121 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .facebook_request import GraphAPIRequest
+from .facebook_sync import parse_time, with_field
+
+# no Graph object is older than Facebook itself
+FACEBOOK_EPOCH = 1075593600
+
+
+class ShardedCrawl(object):
+
+    """
+        Crawl a time based edge (/me/photos, /me/posts...) as `shards`
+        since/until windows fetched concurrently on `workers` threads.
+
+        A window still having pages after `pages_per_window` pages is
+        split again, so dense periods get more, smaller windows.
+        Items are merged and deduplicated by id.
+    """
+
+    def __init__(self, request, since=None, until=None, shards=8,
+                 workers=8, pages_per_window=4, min_window=3600,
+                 time_field='created_time'):
+        self.request = request
+        self.since = int(since or FACEBOOK_EPOCH)
+        self.until = int(until or time.time())
+        self.shards = max(shards, 1)
+        self.workers = workers
+        self.pages_per_window = pages_per_window
+        self.min_window = min_window
+        self.time_field = time_field
+        self.windows = 0
+        self.splits = 0
+        self.pages = 0
+
+    def split(self, since, until, parts):
+        """
+            return `parts` consecutive (since, until) windows
+        """
+        step = max((until - since) // parts, 1)
+        bounds = [since + step * i for i in range(parts)] + [until]
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+    def _window_request(self, since, until):
+        request = self.request
+        args = with_field(request.args, self.time_field)
+        args['since'] = since
+        args['until'] = until
+        return GraphAPIRequest(request.access_token, request.path, args,
+                               session=request.session,
+                               scheduler=request.scheduler,
+                               retry=request.retry)
+
+    def _crawl_window(self, since, until, stop=None):
+        """
+            return the items of the window and the (since, until) range
+            left to crawl, None when the window is done or `stop` is set
+        """
+        request = self._window_request(since, until)
+        can_split = until - since > self.min_window
+        items = []
+        pages = 0
+        oldest = until
+        for page in request.iter_pages():
+            if stop is not None and stop.is_set():
+                break
+            pages += 1
+            for item in page.response.get('data', []):
+                items.append(item)
+                created = parse_time(item.get(self.time_field))
+                if created is not None and created < oldest:
+                    oldest = created
+            if can_split and pages >= self.pages_per_window and \
+                    page.next_page and oldest > since:
+                return items, pages, (since, oldest)
+        return items, pages, None
+
+    def iter_all(self):
+        """
+            Yield the unique items of all windows as they are fetched
+        """
+        seen = set()
+        stop = threading.Event()
+        pending = set()
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            pending.update(pool.submit(self._crawl_window, since, until,
+                                       stop)
+                           for since, until in
+                           self.split(self.since, self.until, self.shards))
+            self.windows += len(pending)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    items, pages, remaining = future.result()
+                    self.pages += pages
+                    if remaining is not None:
+                        windows = self.split(remaining[0], remaining[1], 2)
+                        self.splits += 1
+                        self.windows += len(windows)
+                        for since, until in windows:
+                            pending.add(pool.submit(self._crawl_window,
+                                                    since, until, stop))
+                    for item in items:
+                        key = item.get('id')
+                        if key is not None:
+                            if key in seen:
+                                continue
+                            seen.add(key)
+                        yield item
+        finally:
+            # the consumer may stop early, the queued windows are
+            # dropped and the running ones stop at their next page
+            stop.set()
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def get_all(self):
+        return list(self.iter_all())
@@ -0,0 +1,87 @@
+import threading
+from .facebook_cache import token_key
+
+
+class _Call(object):
+
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+
+    """
+        Coalesces identical calls running at the same time: the first
+        caller of a key runs the function, the others wait for it and
+        share its result or its exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.saved = 0
+
+    @staticmethod
+    def key(method, path, args, access_token):
+        args = sorted((str(k), str(v)) for k, v in (args or {}).items()
+                      if k != 'access_token')
+        token = token_key(access_token) if access_token else ''
+        return (method, path, tuple(args), token)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.saved += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'executed': self.executed,
+            'saved': self.saved,
+        }
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    return _single_flight
+
+
+def set_single_flight(group):
+    """
+        Install the SingleFlight group coalescing every GET of
+        GraphAPIRequest, None disables coalescing
+    """
+    global _single_flight
+    _single_flight = group
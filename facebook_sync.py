@@ -0,0 +1,155 @@
+import calendar
+import time
+from datetime import datetime
+from .facebook_cache import LocalCacheBackend
+
+
+def parse_time(value):
+    """
+        Graph Api time ("2015-07-20T10:00:00+0000") to unix timestamp
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z')
+    except ValueError:
+        return None
+    return calendar.timegm(parsed.utctimetuple())
+
+
+def with_field(args, field):
+    """
+        Copy of request args with `field` added to the top level fields
+    """
+    args = dict(args or {})
+    fields = args.get('fields')
+    if fields and field not in fields.split(','):
+        args['fields'] = fields + ',' + field
+    return args
+
+
+class SyncStateStore(object):
+
+    """
+        Per user, per edge sync state over a cache backend
+        (LocalCacheBackend, DjangoCacheBackend)
+    """
+
+    prefix = 'fb-sync:'
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = LocalCacheBackend(maxsize=100000)
+        self.backend = backend
+
+    def _key(self, fb_id, edge):
+        return '%s%s:%s' % (self.prefix, fb_id, edge)
+
+    def get(self, fb_id, edge):
+        return self.backend.get(self._key(fb_id, edge)) or {}
+
+    def set(self, fb_id, edge, state):
+        self.backend.set(self._key(fb_id, edge), state, None)
+
+    def reset(self, fb_id, edge):
+        self.backend.delete(self._key(fb_id, edge))
+
+
+class SyncStats(object):
+
+    __slots__ = ('fetched', 'skipped', 'pages', 'full', 'since')
+
+    def __init__(self, full=False, since=None):
+        self.fetched = 0
+        self.skipped = 0
+        self.pages = 0
+        self.full = full
+        self.since = since
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class IncrementalSync(object):
+
+    """
+        Fetch only the items of an edge created after the newest item
+        seen by the previous sync of that user.
+
+        store - SyncStateStore keeping the high-water marks.
+        reconcile_every - seconds between full fetches of an edge,
+            None never runs a full fetch after the first one.
+        time_field - item field the high-water mark is taken from.
+    """
+
+    def __init__(self, store=None, reconcile_every=None,
+                 time_field='created_time'):
+        self.store = store if store is not None else SyncStateStore()
+        self.reconcile_every = reconcile_every
+        self.time_field = time_field
+        self.stats = {}
+
+    def _is_full(self, state, now):
+        if not state.get('since'):
+            return True
+        if self.reconcile_every is None:
+            return False
+        return now - state.get('full_at', 0) >= self.reconcile_every
+
+    def fetch(self, request, fb_id, edge, prefetch=0, record=None):
+        """
+            return the new items of the paginated GraphAPIRequest,
+            the stats of the run are kept in self.stats[(fb_id, edge)]
+
+            Items created in the same second as the high-water mark are
+            fetched again and told apart by their id.
+            prefetch / record - see GraphAPIRequest.iter_all.
+        """
+        now = time.time()
+        state = self.store.get(fb_id, edge)
+        full = self._is_full(state, now)
+        since = None if full else state['since']
+        seen = set(state.get('seen') or ())
+        stats = SyncStats(full, since)
+        args = with_field(request.args, self.time_field)
+        if since:
+            args['since'] = since
+        request.args = args
+
+        items = []
+        newest = state.get('since') or 0
+        newest_ids = set(seen)
+        for page in request.iter_pages(prefetch=prefetch):
+            stats.pages += 1
+            old_items = 0
+            data = page.response.get('data', [])
+            for item in data:
+                created = parse_time(item.get(self.time_field))
+                if since and created is not None and (
+                        created < since or
+                        (created == since and item.get('id') in seen)):
+                    old_items += 1
+                    continue
+                items.append(item)
+                if created is None:
+                    continue
+                if created > newest:
+                    newest = created
+                    newest_ids = set()
+                if created == newest:
+                    newest_ids.add(item.get('id'))
+            stats.fetched += len(data) - old_items
+            stats.skipped += old_items
+            # edges are newest first, every later page is older
+            if old_items:
+                break
+
+        state = dict(state, since=newest or None, seen=sorted(newest_ids),
+                     synced_at=now)
+        if full:
+            state['full_at'] = now
+        self.store.set(fb_id, edge, state)
+        self.stats[(fb_id, edge)] = stats
+        if record is not None:
+            items = [record.from_dict(item) for item in items]
+        return items
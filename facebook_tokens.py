@@ -0,0 +1,320 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .facebook_request import GraphAPIError, register_auth_error_handler
+from .facebook_conf import get_setting
+
+VALID = 'valid'
+EXPIRED = 'expired'
+
+logger = logging.getLogger(__name__)
+
+# access_token_expires below this is a relative "expires in", not a date
+_MIN_TIMESTAMP = 10 ** 9
+
+
+def expires_at(response, now=None):
+    """
+        Expiry timestamp of an oauth/access_token response, 0 if unknown
+    """
+    expires = response.get('expires_in') or response.get('expires')
+    if not expires:
+        return 0
+    return int((now or time.time()) + int(expires))
+
+
+class TokenState(object):
+
+    __slots__ = ('fb_id', 'access_token', 'expires_at', 'status',
+                 'refresh_at', 'failures', 'lock')
+
+    def __init__(self, fb_id, access_token, expires_at=0):
+        self.fb_id = fb_id
+        self.access_token = access_token
+        self.expires_at = expires_at
+        self.status = VALID
+        self.refresh_at = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        return {'fb_id': self.fb_id, 'expires_at': self.expires_at,
+                'status': self.status, 'refresh_at': self.refresh_at,
+                'failures': self.failures}
+
+
+class TokenManager(object):
+
+    """
+        Keeps the access token of every tracked user fresh: tokens are
+        exchanged with extend_access_token `refresh_ahead` seconds
+        before they expire, at most `workers` at a time, and the new
+        token is saved on the Users document.
+
+        A token of unknown expiry is refreshed by the next run_due().
+        A failed refresh, whatever the error, is retried after
+        `retry_delay` until the token expires, a token Facebook reports
+        invalid (code 190) is marked expired: the user has to log in
+        again.
+    """
+
+    def __init__(self, app_id=None, app_secret=None, refresh_ahead=86400,
+                 retry_delay=300, workers=4, helper=None, persist=True):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.refresh_ahead = refresh_ahead
+        self.retry_delay = retry_delay
+        self.workers = workers
+        self.helper = helper
+        self.persist = persist
+        self.tokens = {}
+        self.refreshed = 0
+        self.failed = 0
+        self.expired = 0
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _get_helper(self):
+        if self.helper is None:
+            from .facebook_helper import GraphAPIHelper
+            self.helper = GraphAPIHelper()
+        return self.helper
+
+    def _schedule(self, state, refresh_at):
+        # older heap entries of the user are skipped when popped
+        state.refresh_at = refresh_at
+        heapq.heappush(self._heap, (refresh_at, next(self._counter),
+                                    state.fb_id))
+        self._cond.notify()
+
+    def track(self, fb_id, access_token, expires_at=0):
+        """
+            Start tracking the token of a user, expires_at is a
+            timestamp, 0 when unknown
+        """
+        if expires_at and expires_at < _MIN_TIMESTAMP:
+            expires_at = 0
+        with self._cond:
+            state = self.tokens.get(fb_id)
+            if state is None:
+                state = self.tokens[fb_id] = TokenState(fb_id, access_token)
+            state.access_token = access_token
+            state.expires_at = expires_at
+            state.status = VALID
+            state.failures = 0
+            self._schedule(state, expires_at - self.refresh_ahead
+                           if expires_at else 0)
+        return state
+
+    def untrack(self, fb_id):
+        with self._cond:
+            self.tokens.pop(fb_id, None)
+
+    def load_users(self):
+        """
+            Track the token of every stored user
+        """
+        from .facebook_login import get_users
+        count = 0
+        for user in get_users().objects.only('fb_id', 'access_token',
+                                             'access_token_expires'):
+            if user.access_token:
+                self.track(user.fb_id, user.access_token,
+                           int(user.access_token_expires or 0))
+                count += 1
+        return count
+
+    def due(self, now=None):
+        """
+            Pop the users whose token should be refreshed by now
+        """
+        now = time.time() if now is None else now
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                refresh_at, _, fb_id = heapq.heappop(self._heap)
+                state = self.tokens.get(fb_id)
+                if state is not None and state.status == VALID and \
+                        state.refresh_at == refresh_at:
+                    due.append(state)
+        return due
+
+    def refresh(self, state):
+        """
+            Exchange the token of a user, return True when it was renewed
+        """
+        with state.lock:
+            if state.status != VALID:
+                return False
+            try:
+                response = self._get_helper().extend_access_token(
+                    state.access_token,
+                    self.app_id or get_setting('FACEBOOK_APP_ID'),
+                    self.app_secret or get_setting('FACEBOOK_SECRET'))
+                if 'access_token' not in response:
+                    raise GraphAPIError(response)
+                token = response['access_token']
+                expires = expires_at(response)
+                error = None
+            except GraphAPIError as e:
+                error = e
+            except Exception as e:
+                logger.exception('Refresh of the token of user %s failed',
+                                 state.fb_id)
+                error = e
+            now = time.time()
+            with self._cond:
+                if error is None:
+                    state.access_token = token
+                    state.expires_at = expires
+                    state.failures = 0
+                    self.refreshed += 1
+                    self._schedule(state, state.expires_at -
+                                   self.refresh_ahead
+                                   if state.expires_at else
+                                   now + self.refresh_ahead)
+                elif getattr(error, 'code', None) == 190 or \
+                        (state.expires_at and state.expires_at <= now):
+                    state.status = EXPIRED
+                    self.expired += 1
+                else:
+                    state.failures += 1
+                    self.failed += 1
+                    self._schedule(state, now + self.retry_delay)
+            if error is None and self.persist:
+                try:
+                    self._save(state)
+                except Exception:
+                    # the token is renewed in memory, saved again with
+                    # the next refresh
+                    logger.exception('Saving the token of user %s failed',
+                                     state.fb_id)
+                    with self._cond:
+                        self.failed += 1
+                        self._schedule(state, now + self.retry_delay)
+                    return False
+            return error is None
+
+    def _save(self, state):
+        from .facebook_login import get_users
+        get_users().objects.filter(fb_id=state.fb_id).update(
+            access_token=state.access_token,
+            access_token_expires=state.expires_at)
+
+    def run_due(self, now=None):
+        """
+            Refresh every due token on the worker pool, wait for them,
+            return how many were renewed
+        """
+        due = self.due(now)
+        if not due:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return sum(pool.map(self.refresh, due))
+
+    def get_fresh_token(self, fb_id, access_token=None, min_validity=300):
+        """
+            return a token of the user valid for `min_validity` seconds
+            at least, refreshed now if needed. An untracked user gets
+            access_token back, an expired token raises GraphAPIError.
+        """
+        state = self.tokens.get(fb_id)
+        if state is None:
+            return access_token
+        if state.status == VALID and state.expires_at and \
+                state.expires_at - time.time() < min_validity:
+            self.refresh(state)
+        if state.status != VALID or (state.expires_at and
+                                     state.expires_at <= time.time()):
+            raise GraphAPIError({'error': {
+                'message': 'Access token of user %s expired' % fb_id,
+                'type': 'OAuthException', 'code': 190}})
+        return state.access_token
+
+    def on_auth_error(self, access_token):
+        """
+            Auth error handler, see register_auth_error_handler
+        """
+        with self._cond:
+            for state in self.tokens.values():
+                if state.access_token == access_token and \
+                        state.status == VALID:
+                    state.status = EXPIRED
+                    self.expired += 1
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='facebook-tokens')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread is not None and wait:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception('Token refresh run failed')
+            with self._cond:
+                if self._stop.is_set():
+                    break
+                timeout = 60.0
+                if self._heap:
+                    timeout = min(timeout,
+                                  max(0.0, self._heap[0][0] - time.time()))
+                self._cond.wait(timeout)
+
+    def stats(self):
+        with self._cond:
+            counts = {VALID: 0, EXPIRED: 0}
+            for state in self.tokens.values():
+                counts[state.status] += 1
+            return {
+                'tracked': len(self.tokens),
+                'valid': counts[VALID],
+                'expired_tokens': counts[EXPIRED],
+                'refreshed': self.refreshed,
+                'failed': self.failed,
+                'expired': self.expired,
+                'next_refresh': self._heap[0][0] if self._heap else None,
+            }
+
+
+_token_manager = None
+
+
+def get_token_manager():
+    return _token_manager
+
+
+def set_token_manager(manager):
+    """
+        Install the TokenManager handing fresh tokens to the crawl jobs,
+        None uses the token each job was queued with
+    """
+    global _token_manager
+    _token_manager = manager
+
+
+def _on_auth_error(access_token):
+    if _token_manager is not None:
+        _token_manager.on_auth_error(access_token)
+
+
+register_auth_error_handler(_on_auth_error)
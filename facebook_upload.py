@@ -0,0 +1,321 @@
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from .facebook_request import GraphAPIRequest
+
+GRAPH_VIDEO_URL = "https://graph-video.facebook.com/"
+
+
+class MultipartStream(object):
+
+    """
+        multipart/form-data body read from disk while it is sent.
+
+        fields - dict of form fields.
+        files - dict of name to a seekable file-like object (a file,
+            BytesIO, Django UploadedFile...), or to a
+            (file object, offset, length) window of it.
+    """
+
+    def __init__(self, fields=None, files=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + self.boundary
+        self._parts = []
+        for name, value in (fields or {}).items():
+            self._parts.append(self._header(name) + str(value).encode(
+                'utf-8') + b'\r\n')
+        for name, source in (files or {}).items():
+            if not isinstance(source, tuple):
+                source = (source, source.tell(), None)
+            fileobj, offset, length = source
+            if length is None:
+                fileobj.seek(0, os.SEEK_END)
+                length = fileobj.tell() - offset
+            filename = os.path.basename(getattr(fileobj, 'name', name))
+            mimetype = mimetypes.guess_type(filename)[0] or \
+                'application/octet-stream'
+            self._parts.append(self._header(name, filename, mimetype))
+            self._parts.append((fileobj, offset, length))
+            self._parts.append(b'\r\n')
+        self._parts.append(('--%s--\r\n' % self.boundary).encode('utf-8'))
+        self.len = sum(len(part) if isinstance(part, bytes) else part[2]
+                       for part in self._parts)
+        self.seek(0)
+
+    def _header(self, name, filename=None, mimetype=None):
+        header = '--%s\r\nContent-Disposition: form-data; name="%s"' % (
+            self.boundary, name)
+        if filename is not None:
+            header += '; filename="%s"\r\nContent-Type: %s' % (filename,
+                                                                mimetype)
+        return (header + '\r\n\r\n').encode('utf-8')
+
+    def __len__(self):
+        return self.len
+
+    def seek(self, position, whence=0):
+        """
+            Only rewinding is supported, so a request can be retried
+        """
+        if position != 0 or whence != 0:
+            raise IOError('MultipartStream can only be rewound')
+        self._index = 0
+        self._offset = 0
+        self.sent = 0
+
+    def tell(self):
+        return self.sent
+
+    def read(self, size=-1):
+        chunks = []
+        while self._index < len(self._parts) and size != 0:
+            part = self._parts[self._index]
+            if isinstance(part, bytes):
+                left = len(part) - self._offset
+                count = left if size < 0 else min(size, left)
+                chunk = part[self._offset:self._offset + count]
+            else:
+                fileobj, start, length = part
+                left = length - self._offset
+                count = left if size < 0 else min(size, left, 1 << 20)
+                fileobj.seek(start + self._offset)
+                chunk = fileobj.read(count)
+                if len(chunk) < count:
+                    raise IOError('File is shorter than expected')
+            chunks.append(chunk)
+            self._offset += count
+            self.sent += count
+            if size > 0:
+                size -= count
+            if self._offset >= (len(part) if isinstance(part, bytes)
+                                else part[2]):
+                self._index += 1
+                self._offset = 0
+        return b''.join(chunks)
+
+
+class UploadStats(object):
+
+    __slots__ = ('bytes', 'seconds')
+
+    def __init__(self, bytes=0, seconds=0.0):
+        self.bytes = bytes
+        self.seconds = seconds
+
+    @property
+    def throughput(self):
+        """
+            Bytes per second
+        """
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {'bytes': self.bytes, 'seconds': self.seconds,
+                'throughput': self.throughput}
+
+
+def upload_file(access_token, path, fileobj, session=None, **fields):
+    """
+        POST `fileobj` as the `source` of path, streamed from disk.
+        return the response dict and the UploadStats of the upload
+    """
+    body = MultipartStream(fields, {'source': fileobj})
+    started = time.time()
+    response = GraphAPIRequest(access_token, path, {}, session=session,
+                               body=body).get()
+    stats = UploadStats(len(body), time.time() - started)
+    if response.error is not None:
+        raise response.error
+    return response.response, stats
+
+
+class ChunkedVideoUpload(object):
+
+    """
+        Resumable upload of a large video with the start / transfer /
+        finish phases of the Graph Api video upload.
+        When a chunk fails, call run() again to continue from the
+        last offset Facebook acknowledged.
+    """
+
+    def __init__(self, access_token, fileobj, target='me', version=None,
+                 session=None, **fields):
+        self.access_token = access_token
+        self.fileobj = fileobj
+        self.path = GRAPH_VIDEO_URL + (version + '/' if version else '') + \
+            target + '/videos'
+        self.session = session
+        self.fields = fields
+        fileobj.seek(0, os.SEEK_END)
+        self.file_size = fileobj.tell()
+        self.upload_session_id = None
+        self.video_id = None
+        self.start_offset = 0
+        self.end_offset = 0
+        self.finished = False
+        self.stats = UploadStats()
+
+    def _post(self, fields, files=None):
+        body = MultipartStream(fields, files)
+        started = time.time()
+        response = GraphAPIRequest(self.access_token, self.path, {},
+                                   session=self.session, body=body).get()
+        self.stats.seconds += time.time() - started
+        if response.error is not None:
+            raise response.error
+        return response.response
+
+    def start(self):
+        res = self._post({'upload_phase': 'start',
+                          'file_size': self.file_size})
+        self.upload_session_id = res['upload_session_id']
+        self.video_id = res.get('video_id')
+        self.start_offset = int(res['start_offset'])
+        self.end_offset = int(res['end_offset'])
+
+    def transfer(self):
+        """
+            Send the chunk Facebook asked for, return False when the
+            whole file was transferred
+        """
+        if self.start_offset >= self.end_offset:
+            return False
+        length = self.end_offset - self.start_offset
+        res = self._post({'upload_phase': 'transfer',
+                          'upload_session_id': self.upload_session_id,
+                          'start_offset': self.start_offset},
+                         {'video_file_chunk': (self.fileobj,
+                                               self.start_offset, length)})
+        self.stats.bytes += length
+        self.start_offset = int(res['start_offset'])
+        self.end_offset = int(res['end_offset'])
+        return self.start_offset < self.end_offset
+
+    def finish(self):
+        fields = dict(self.fields, upload_phase='finish',
+                      upload_session_id=self.upload_session_id)
+        res = self._post(fields)
+        self.finished = True
+        return res
+
+    def run(self):
+        """
+            Upload the video, or continue an interrupted upload
+        """
+        if self.upload_session_id is None:
+            self.start()
+        while self.transfer():
+            pass
+        res = self.finish()
+        res.setdefault('video_id', self.video_id)
+        return res
+
+
+class UploadQueue(object):
+
+    """
+        Runs uploads on a pool of `workers` threads, at most
+        `token_limit` at the same time for one access token. The uploads
+        over the limit wait in a queue of their token rather than in the
+        pool, so one busy token cannot hold every worker.
+    """
+
+    def __init__(self, workers=8, token_limit=2, session=None):
+        self.workers = workers
+        self.token_limit = token_limit
+        self.session = session
+        self.uploaded = 0
+        self.failed = 0
+        self.stats = UploadStats()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._cond = threading.Condition()
+        self._running = {}
+        self._pending = {}
+        self._outstanding = 0
+
+    def _submit(self, access_token, upload):
+        future = Future()
+        with self._cond:
+            self._outstanding += 1
+            if self._running.get(access_token, 0) >= self.token_limit:
+                self._pending.setdefault(access_token, deque()).append(
+                    (upload, future))
+                return future
+            self._running[access_token] = \
+                self._running.get(access_token, 0) + 1
+        self._pool.submit(self._run, access_token, upload, future)
+        return future
+
+    def _run(self, access_token, upload, future):
+        if future.set_running_or_notify_cancel():
+            try:
+                result, stats = upload()
+            except Exception as e:
+                with self._cond:
+                    self.failed += 1
+                future.set_exception(e)
+            else:
+                with self._cond:
+                    self.uploaded += 1
+                    self.stats.bytes += stats.bytes
+                    self.stats.seconds += stats.seconds
+                future.set_result((result, stats))
+        with self._cond:
+            self._outstanding -= 1
+            pending = self._pending.get(access_token)
+            if pending:
+                upload, future = pending.popleft()
+                if not pending:
+                    del self._pending[access_token]
+            else:
+                upload = None
+                self._running[access_token] -= 1
+                if not self._running[access_token]:
+                    del self._running[access_token]
+            self._cond.notify_all()
+        if upload is not None:
+            self._pool.submit(self._run, access_token, upload, future)
+
+    def submit_photo(self, access_token, path, album_path='me/photos',
+                     **fields):
+        """
+            Queue the upload of the image file at path, return a future
+            of (response dict, UploadStats)
+        """
+        def upload():
+            with open(path, 'rb') as fileobj:
+                return upload_file(access_token, album_path, fileobj,
+                                   session=self.session, **fields)
+        return self._submit(access_token, upload)
+
+    def submit_video(self, access_token, path, target='me', **fields):
+        """
+            Queue the chunked upload of the video file at path
+        """
+        def upload():
+            with open(path, 'rb') as fileobj:
+                video = ChunkedVideoUpload(access_token, fileobj, target,
+                                           session=self.session, **fields)
+                return video.run(), video.stats
+        return self._submit(access_token, upload)
+
+    def shutdown(self, wait=True):
+        """
+            With wait, return once every queued upload finished
+        """
+        if wait:
+            with self._cond:
+                while self._outstanding:
+                    self._cond.wait()
+        self._pool.shutdown(wait=wait)
+
+    def report(self):
+        with self._cond:
+            report = self.stats.as_dict()
+            report['uploaded'] = self.uploaded
+            report['failed'] = self.failed
+            return report
@@ -2,6 +2,49 @@ from django.test import TestCase
 from django.conf import settings
 from .facebook_request import GraphReponse, GraphAPIError, GraphAPIRequest
 from .facebook_login import FacebookLoginHandler
+from .facebook_session import GraphSession
+from .facebook_log import BufferedLogSink
+from .facebook_batch import GraphBatchRequest
+from .facebook_ratelimit import RateLimitScheduler
+from .facebook_helper import GraphAPIHelper
+from .facebook_cache import TokenValidationCache, LocalCacheBackend, \
+    ResponseCache
+from .facebook_sync import IncrementalSync
+from .facebook_shard import ShardedCrawl
+from .facebook_crawl import CrawlScheduler, CrawlJob, MemoryJobQueue, \
+    NEW_USER, get_crawl_scheduler, set_crawl_scheduler
+from . import facebook_login
+from .facebook_singleflight import SingleFlight, get_single_flight, \
+    set_single_flight
+from .facebook_records import MediaItem, LikeList
+from .facebook_download import download_all
+from .facebook_conf import get_setting
+from .facebook_tokens import TokenManager, EXPIRED, VALID
+from .facebook_nested import NestedEdgeFetch, nested_fields
+from .facebook_fields import plan_fields, with_limit, AdaptiveLimit, \
+    FieldPreset
+from .facebook_request import set_graph_url
+from .benchmarks.graph_server import GraphServer, GraphStandIn
+from .facebook_cassette import CassetteSession, CassetteMiss, RECORD, \
+    REPLAY, AUTO
+from .facebook_hooks import Hooks, BEFORE_REQUEST, AFTER_RESPONSE, \
+    ON_ERROR, ON_RETRY, register_hook, unregister_hook
+from .facebook_metrics import MetricsCollector, endpoint
+from .facebook_upload import MultipartStream, ChunkedVideoUpload, \
+    UploadQueue, UploadStats, upload_file
+from .facebook_retry import RetryPolicy, NO_RETRY, TRANSIENT, THROTTLED, \
+    AUTH_EXPIRED, PERMANENT
+import hashlib
+import io
+import json
+import os
+import requests
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
 from login.models import Users
 from mongoengine import connect
 
@@ -22,6 +65,28 @@ class MockGraphResponse(object):
         return self.__dict__['response']
 
 
+class MockSession(object):
+
+    """
+        Stand-in for GraphSession, answers every request with the
+        queued MockGraphResponse objects in order
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return self.responses.pop(0)
+
+
+def json_mock(response, headers=None):
+    d = {'content-type': 'application/json; charset=UTF-8'}
+    d.update(headers or {})
+    return MockGraphResponse({'headers': d, 'response': response})
+
+
 class TestGraphResponse(TestCase):
 
     def setUp(self):
@@ -177,6 +242,1456 @@ class TestRequestGraph(TestCase):
         )
 
 
+class TestGraphSession(TestCase):
+
+    def test_stats_before_requests(self):
+        session = GraphSession(pool_maxsize=4)
+        self.assertEqual({
+            'requests': 0,
+            'connections': 0,
+            'reused': 0,
+            'reuse_ratio': 0.0,
+        }, session.stats())
+
+    def test_injected_session(self):
+        session = MockSession([json_mock({'id': '1'})])
+        res = GraphAPIRequest("access_token", "/me", {},
+                              session=session).get()
+        self.assertEqual({'id': '1'}, res.response)
+        self.assertEqual(1, len(session.calls))
+        method, url, kwargs = session.calls[0]
+        self.assertEqual('GET', method)
+        self.assertTrue(url.startswith('https://graph.facebook.com/'))
+        self.assertEqual('access_token', kwargs['params']['access_token'])
+
+
+class TestBufferedLogSink(TestCase):
+
+    def test_flush_in_batches(self):
+        batches = []
+        sink = BufferedLogSink(batches.append, batch_size=2,
+                               flush_interval=60)
+        for i in range(5):
+            sink.emit({'path': i})
+        sink.close()
+        self.assertEqual(5, sum(len(b) for b in batches))
+        self.assertTrue(all(len(b) <= 2 for b in batches))
+        self.assertEqual(5, sink.stats()['written'])
+
+    def test_drop_when_full(self):
+        sink = BufferedLogSink(lambda records: None, max_queue=2,
+                               flush_interval=60)
+        for i in range(5):
+            sink.emit({'path': i})
+        self.assertEqual(3, sink.stats()['dropped'])
+        sink.close()
+
+    def test_counts_from_threads(self):
+        import threading
+        sink = BufferedLogSink(lambda records: None, max_queue=100,
+                               flush_interval=60)
+
+        def emit():
+            for i in range(1000):
+                sink.emit({'path': i})
+        threads = [threading.Thread(target=emit) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = sink.stats()
+        sink.close()
+        self.assertEqual(8000, stats['emitted'] + stats['dropped'])
+
+
+class TestPagination(TestCase):
+
+    def pages(self):
+        return [
+            json_mock({'data': [1, 2], 'paging': {'next': 'https://next/1'}}),
+            json_mock({'data': [3, 4], 'paging': {'next': 'https://next/2'}}),
+            json_mock({'data': [5]}),
+        ]
+
+    def test_get_all(self):
+        session = MockSession(self.pages())
+        req = GraphAPIRequest("access_token", "/me/photos", {},
+                              session=session)
+        self.assertEqual([1, 2, 3, 4, 5], req.get_all())
+        self.assertEqual(3, len(session.calls))
+        self.assertEqual('https://next/2', session.calls[2][1])
+
+    def test_iter_all_max_items(self):
+        session = MockSession(self.pages())
+        req = GraphAPIRequest("access_token", "/me/photos", {},
+                              session=session)
+        self.assertEqual([1, 2], list(req.iter_all(max_items=2)))
+        self.assertEqual(1, len(session.calls))
+
+    def test_iter_all_max_pages(self):
+        session = MockSession(self.pages())
+        req = GraphAPIRequest("access_token", "/me/photos", {},
+                              session=session)
+        self.assertEqual([1, 2, 3, 4], req.get_all(max_pages=2))
+        self.assertEqual(2, len(session.calls))
+
+    def test_prefetch(self):
+        session = MockSession(self.pages())
+        req = GraphAPIRequest("access_token", "/me/photos", {},
+                              session=session)
+        self.assertEqual([1, 2, 3, 4, 5], req.get_all(prefetch=2))
+        self.assertEqual(3, len(session.calls))
+
+    def test_prefetch_error(self):
+        session = MockSession(self.pages()[:1])
+        req = GraphAPIRequest("access_token", "/me/photos", {},
+                              session=session)
+        self.assertRaises(IndexError, lambda: req.get_all(prefetch=1))
+
+
+class TestGraphBatchRequest(TestCase):
+
+    def batch_item(self, body, code=200):
+        return {'code': code,
+                'headers': [{'name': 'Content-Type',
+                             'value': 'application/json'}],
+                'body': json.dumps(body)}
+
+    def test_execute(self):
+        session = MockSession([json_mock([
+            self.batch_item({'id': '1'}),
+            self.batch_item({'error': {'message': 'bad', 'code': 100}},
+                            code=400),
+        ])])
+        batch = GraphBatchRequest('token', session=session)
+        batch.add(GraphAPIRequest('token', '/me', {'fields': 'id'}))
+        batch.add(GraphAPIRequest('token', '123/likes', {},
+                                  post_args={}))
+        res = batch.execute()
+
+        self.assertEqual({'id': '1'}, res[0].response)
+        self.assertTrue(isinstance(res[1], GraphAPIError))
+        self.assertEqual('bad', res[1].message)
+
+        method, url, kwargs = session.calls[0]
+        self.assertEqual('POST', method)
+        self.assertEqual([
+            {'method': 'GET', 'relative_url': 'me?fields=id'},
+            {'method': 'POST', 'relative_url': '123/likes', 'body': ''},
+        ], json.loads(kwargs['data']['batch']))
+
+    def test_chunks(self):
+        session = MockSession([
+            json_mock([self.batch_item({'id': str(i)}) for i in range(2)]),
+            json_mock([self.batch_item({'id': '2'})]),
+        ])
+        batch = GraphBatchRequest('token', session=session, batch_size=2)
+        for i in range(3):
+            batch.add(GraphAPIRequest('token', str(i), {}))
+        res = batch.execute()
+        self.assertEqual(['0', '1', '2'], [r.response['id'] for r in res])
+        self.assertEqual(2, len(session.calls))
+
+    def test_get_all(self):
+        session = MockSession([
+            json_mock([
+                self.batch_item({'data': [1], 'paging': {
+                    'next': 'https://graph.facebook.com/me/photos?after=a'}}),
+                self.batch_item({'data': [2]}),
+            ]),
+            json_mock([self.batch_item({'data': [3]})]),
+        ])
+        batch = GraphBatchRequest('token', session=session)
+        batch.add(GraphAPIRequest('token', '/me/photos', {}))
+        batch.add(GraphAPIRequest('token', '/me/videos', {}))
+        self.assertEqual([[1, 3], [2]], batch.get_all())
+        self.assertEqual(
+            [{'method': 'GET', 'relative_url': 'me/photos?after=a'}],
+            json.loads(session.calls[1][2]['data']['batch']))
+
+    def transient_error(self):
+        error = json_mock({'error': {'message': 'boom', 'code': 2}})
+        error.status_code = 500
+        return error
+
+    def test_read_only_batch_is_retried(self):
+        session = MockSession([self.transient_error(),
+                               json_mock([self.batch_item({'id': '1'})])])
+        batch = GraphBatchRequest('token', session=session,
+                                  retry=RetryPolicy(backoff=0))
+        batch.add(GraphAPIRequest('token', '/me', {}))
+        self.assertEqual({'id': '1'}, batch.execute()[0].response)
+        self.assertEqual(2, len(session.calls))
+
+    def test_retry_failed_items(self):
+        session = MockSession([
+            json_mock([self.batch_item({'id': '1'}),
+                       self.batch_item({'error': {'message': 'boom',
+                                                  'code': 2}}, code=500)]),
+            json_mock([self.batch_item({'id': '2'})]),
+        ])
+        batch = GraphBatchRequest('token', session=session,
+                                  retry=RetryPolicy(backoff=0))
+        batch.add(GraphAPIRequest('token', '1', {}))
+        batch.add(GraphAPIRequest('token', '2', {}))
+        self.assertEqual(['1', '2'],
+                         [res.response['id'] for res in batch.execute()])
+        self.assertEqual([{'method': 'GET', 'relative_url': '2'}],
+                         json.loads(session.calls[1][2]['data']['batch']))
+
+    def test_retry_timed_out_items(self):
+        session = MockSession([
+            json_mock([None, {'code': 502, 'headers': [], 'body': '{}'}]),
+            json_mock([self.batch_item({'id': '1'}),
+                       self.batch_item({'id': '2'})]),
+        ])
+        batch = GraphBatchRequest('token', session=session,
+                                  retry=RetryPolicy(backoff=0))
+        batch.add(GraphAPIRequest('token', '1', {}))
+        batch.add(GraphAPIRequest('token', '2', {}))
+        self.assertEqual(['1', '2'],
+                         [res.response['id'] for res in batch.execute()])
+        self.assertEqual(2, len(session.calls))
+
+    def test_write_batch_is_not_retried(self):
+        session = MockSession([self.transient_error(),
+                               json_mock([self.batch_item({'id': '1'})])])
+        batch = GraphBatchRequest('token', session=session,
+                                  retry=RetryPolicy(backoff=0))
+        batch.add(GraphAPIRequest('token', '123/likes', {}, post_args={}))
+        self.assertRaises(GraphAPIError, batch.execute)
+        self.assertEqual(1, len(session.calls))
+
+
+class MockAsyncSession(MockSession):
+
+    async def request(self, method, url, **kwargs):
+        return MockSession.request(self, method, url, **kwargs)
+
+
+class TestAsyncGraphAPIRequest(TestCase):
+
+    def test_get_all(self):
+        import asyncio
+        from .facebook_async import AsyncGraphAPIRequest
+        session = MockAsyncSession([
+            json_mock({'data': [1, 2], 'paging': {'next': 'https://next/1'}}),
+            json_mock({'data': [3]}),
+        ])
+        req = AsyncGraphAPIRequest('access_token', '/me/photos', {},
+                                   session=session)
+        self.assertEqual([1, 2, 3], asyncio.run(req.get_all()))
+        self.assertEqual('access_token', session.calls[0][2]['access_token'])
+        self.assertEqual({}, req.args)
+
+    def test_retry_scheduler_and_hooks(self):
+        import asyncio
+        from .facebook_async import AsyncGraphAPIRequest
+        error = json_mock({'error': {'message': 'boom', 'code': 2}})
+        error.status_code = 500
+        session = MockAsyncSession([error, json_mock({'id': '1'})])
+        scheduler = RateLimitScheduler()
+        events = []
+
+        def on_retry(**info):
+            events.append(info['attempt'])
+        register_hook(ON_RETRY, on_retry)
+        try:
+            req = AsyncGraphAPIRequest('token', '/me', {}, session=session,
+                                       scheduler=scheduler,
+                                       retry=RetryPolicy(backoff=0))
+            res = asyncio.run(req.get())
+        finally:
+            unregister_hook(ON_RETRY, on_retry)
+        self.assertEqual({'id': '1'}, res.response)
+        self.assertEqual([0], events)
+        self.assertEqual(2, scheduler.metrics()['tokens']['token']['requests'])
+
+    def test_token_semaphores_are_released(self):
+        import asyncio
+        from .facebook_async import AsyncGraphAPIRequest, AsyncGraphSession
+        server = GraphServer(GraphStandIn(items=5))
+        url = server.start()
+
+        async def fetch():
+            session = AsyncGraphSession(token_limit=1)
+            try:
+                responses = await asyncio.gather(*[
+                    AsyncGraphAPIRequest(token, url + 'me/photos', {},
+                                         session=session).get()
+                    for token in ('a', 'a', 'b')])
+                return responses, session._token_semaphores
+            finally:
+                await session.close()
+        try:
+            responses, semaphores = asyncio.run(fetch())
+        finally:
+            server.stop()
+        self.assertEqual([5, 5, 5],
+                         [len(res.response['data']) for res in responses])
+        self.assertEqual({}, semaphores)
+
+    def test_app_limit(self):
+        import asyncio
+        import threading
+        from .facebook_async import AsyncGraphAPIRequest, AsyncGraphSession
+
+        class CountingStandIn(GraphStandIn):
+
+            def __init__(self, **kwargs):
+                GraphStandIn.__init__(self, **kwargs)
+                self.in_flight = self.max_in_flight = 0
+                self._count_lock = threading.Lock()
+
+            def handle(self, *args):
+                with self._count_lock:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight,
+                                             self.in_flight)
+                try:
+                    return GraphStandIn.handle(self, *args)
+                finally:
+                    with self._count_lock:
+                        self.in_flight -= 1
+
+        async def fetch(session):
+            try:
+                await asyncio.gather(*[
+                    AsyncGraphAPIRequest(token, url + 'me/photos', {},
+                                         session=session).get()
+                    for token in ('a', 'b', 'c', 'd')])
+            finally:
+                await session.close()
+
+        graph = CountingStandIn(items=5, latency=0.05)
+        server = GraphServer(graph)
+        url = server.start()
+        try:
+            with self.settings(FACEBOOK_APP_ID='42'):
+                asyncio.run(fetch(AsyncGraphSession(app_limit=1)))
+                self.assertEqual(1, graph.max_in_flight)
+
+                graph.max_in_flight = 0
+                session = AsyncGraphSession(app_limit=4)
+                session.set_app_limit('42', 2)
+                asyncio.run(fetch(session))
+                self.assertEqual(2, graph.max_in_flight)
+        finally:
+            server.stop()
+
+
+class TestRateLimitScheduler(TestCase):
+
+    def test_slow_down_above_target(self):
+        scheduler = RateLimitScheduler(target=0.5, app_rate=10)
+        session = MockSession([json_mock({'id': '1'}, {
+            'x-app-usage': '{"call_count": 90, "total_time": 10}'})])
+        GraphAPIRequest('token', '/me', {}, session=session,
+                        scheduler=scheduler, app_id='1').get()
+
+        app = scheduler.metrics()['apps']['1']
+        self.assertEqual(0.9, app['utilisation'])
+        self.assertEqual(1, app['requests'])
+        self.assertTrue(app['rate'] < 10)
+
+    def test_throttle_error(self):
+        scheduler = RateLimitScheduler(cooldown=30)
+        session = MockSession([json_mock({'error': {'code': 613}}, {
+            'x-business-use-case-usage':
+                '{"1": [{"call_count": 100, '
+                '"estimated_time_to_regain_access": 2}]}'})])
+        GraphAPIRequest('token', '/me', {}, session=session,
+                        scheduler=scheduler, retry=NO_RETRY).get()
+
+        token = scheduler.metrics()['tokens']['token']
+        self.assertEqual(1, token['throttled'])
+        self.assertTrue(token['throttled_for'] > 60)
+
+    def test_rate_follows_utilisation(self):
+        scheduler = RateLimitScheduler(target=0.8, app_rate=10)
+        for usage, rate in ((90, 0.1), (90, 0.1), (60, 5.05), (10, 10),
+                            (10, 10)):
+            session = MockSession([json_mock({'id': '1'}, {
+                'x-app-usage': '{"call_count": %d}' % usage})])
+            GraphAPIRequest('token', '/me', {}, session=session,
+                            scheduler=scheduler, app_id='1').get()
+            self.assertAlmostEqual(
+                rate, scheduler.metrics()['apps']['1']['rate'])
+
+    def test_zero_target(self):
+        scheduler = RateLimitScheduler(target=0, app_rate=10)
+        session = MockSession([json_mock({'id': '1'}, {
+            'x-app-usage': '{"call_count": 0}'})])
+        GraphAPIRequest('token', '/me', {}, session=session,
+                        scheduler=scheduler, app_id='1').get()
+        self.assertEqual(0.1, scheduler.metrics()['apps']['1']['rate'])
+
+
+class TestRetry(TestCase):
+
+    def retry(self):
+        return RetryPolicy(max_retries=2, backoff=0)
+
+    def test_error_category(self):
+        error = GraphAPIError({'error': {
+            'message': 'Invalid OAuth access token.', 'code': 190,
+            'error_subcode': 463, 'type': 'OAuthException',
+            'fbtrace_id': 'abc'}})
+        self.assertEqual('Invalid OAuth access token.', error.message)
+        self.assertEqual('OAuthException', error.type)
+        self.assertEqual(190, error.code)
+        self.assertEqual(463, error.subcode)
+        self.assertEqual('abc', error.fbtrace_id)
+        self.assertEqual(AUTH_EXPIRED, error.category)
+
+        self.assertEqual(THROTTLED, GraphAPIError(
+            {'error': {'code': 613}}).category)
+        self.assertEqual(TRANSIENT, GraphAPIError(
+            {'error': {'code': 2}}).category)
+        self.assertEqual(PERMANENT, GraphAPIError(
+            {'error': {'code': 100}}).category)
+        self.assertEqual('plain', GraphAPIError('plain').message)
+
+    def test_retry_transient(self):
+        session = MockSession([
+            json_mock({'error': {'code': 2}}),
+            json_mock({'id': '1'}),
+        ])
+        res = GraphAPIRequest('token', '/me', {}, session=session,
+                              retry=self.retry()).get()
+        self.assertEqual({'id': '1'}, res.response)
+        self.assertEqual(2, len(session.calls))
+
+    def test_no_retry_permanent(self):
+        session = MockSession([json_mock({'error': {'code': 100}})])
+        res = GraphAPIRequest('token', '/me', {}, session=session,
+                              retry=self.retry()).get()
+        self.assertEqual(100, res.error.code)
+        self.assertEqual(1, len(session.calls))
+
+    def test_resume_pagination(self):
+        session = MockSession([
+            json_mock({'data': [1], 'paging': {'next': 'https://next/1'}}),
+            json_mock({'error': {'code': 2}}),
+            json_mock({'data': [2]}),
+        ])
+        req = GraphAPIRequest('token', '/me/photos', {}, session=session,
+                              retry=NO_RETRY)
+        self.assertRaises(GraphAPIError, req.get_all)
+        self.assertEqual([1], req.response)
+        self.assertEqual('https://next/1', req.cursor)
+        self.assertEqual([1, 2], req.get_all(resume=True))
+        self.assertEqual('https://next/1', session.calls[2][1])
+
+
+class TestTokenValidationCache(TestCase):
+
+    def setUp(self):
+        self.token_cache = GraphAPIHelper.token_cache
+        self.session = GraphAPIHelper.session
+        GraphAPIHelper.token_cache = TokenValidationCache()
+
+    def tearDown(self):
+        GraphAPIHelper.token_cache = self.token_cache
+        GraphAPIHelper.session = self.session
+
+    def test_cached_until_invalidated(self):
+        GraphAPIHelper.session = MockSession([
+            json_mock({'data': {'is_valid': True, 'expires_at': 0}}),
+            json_mock({'data': {'is_valid': False}}),
+        ])
+        self.assertTrue(GraphAPIHelper.validate_access_token('token'))
+        self.assertTrue(GraphAPIHelper.validate_access_token('token'))
+        self.assertEqual(1, len(GraphAPIHelper.session.calls))
+
+        GraphAPIHelper.invalidate_access_token('token')
+        self.assertFalse(GraphAPIHelper.validate_access_token('token'))
+        self.assertEqual(2, len(GraphAPIHelper.session.calls))
+
+    def test_invalidate_on_auth_error(self):
+        GraphAPIHelper.token_cache.set('token', True)
+        session = MockSession([json_mock({'error': {'code': 190}})])
+        GraphAPIRequest('token', '/me', {}, session=session).get()
+        self.assertEqual(None, GraphAPIHelper.token_cache.get('token'))
+
+    def test_ttl_from_expires_at(self):
+        backend = LocalCacheBackend()
+        cache = TokenValidationCache(backend)
+        cache.set('expired', True, expires_at=1)
+        self.assertEqual(None, cache.get('expired'))
+        self.assertEqual(0, len(backend))
+
+
+class TestResponseCache(TestCase):
+
+    def test_fresh_hit(self):
+        cache = ResponseCache(default_ttl=60)
+        session = MockSession([json_mock({'id': '1'})])
+        for i in range(2):
+            res = GraphAPIRequest('token', '/me', {}, session=session,
+                                  cache=cache).get()
+            self.assertEqual({'id': '1'}, res.response)
+        self.assertEqual(1, len(session.calls))
+        self.assertEqual(1, cache.stats()['hits'])
+
+    def test_revalidate_etag(self):
+        cache = ResponseCache(default_ttl=0)
+        session = MockSession([
+            json_mock({'id': '1'}, {'etag': '"abc"'}),
+            MockGraphResponse({'status_code': 304, 'headers': {}}),
+        ])
+        statuses = []
+
+        def on_response(status, **info):
+            statuses.append(status)
+        register_hook(AFTER_RESPONSE, on_response)
+        try:
+            first = GraphAPIRequest('token', '/me', {}, session=session,
+                                    cache=cache).get()
+            second = GraphAPIRequest('token', '/me', {}, session=session,
+                                     cache=cache).get()
+        finally:
+            unregister_hook(AFTER_RESPONSE, on_response)
+        self.assertTrue(first is second)
+        self.assertEqual(2, len(statuses))
+        self.assertEqual(304, statuses[1])
+        self.assertEqual('"abc"',
+                         session.calls[1][2]['headers']['If-None-Match'])
+        self.assertEqual(1, cache.stats()['revalidated'])
+
+    def test_endpoint_ttl(self):
+        cache = ResponseCache(default_ttl=10, ttls={'me': 60,
+                                                     'me/photos': 300})
+        self.assertEqual(60, cache.ttl('https://graph.facebook.com//me'))
+        self.assertEqual(300, cache.ttl('/me/photos?limit=5'))
+        self.assertEqual(10, cache.ttl('/debug_token'))
+
+
+class TestIncrementalSync(TestCase):
+
+    def setUp(self):
+        self.session = GraphAPIHelper.session
+
+    def tearDown(self):
+        GraphAPIHelper.session = self.session
+
+    def test_fetch_only_new_items(self):
+        sync = IncrementalSync()
+        old = {'id': '1', 'created_time': '2015-07-20T10:00:00+0000'}
+        new = {'id': '2', 'created_time': '2015-07-21T10:00:00+0000'}
+        GraphAPIHelper.session = MockSession([
+            json_mock({'data': [old]}),
+            json_mock({'data': [new, old],
+                       'paging': {'next': 'https://next/1'}}),
+        ])
+        self.assertEqual([old], GraphAPIHelper.get_user_photos(
+            1, 'token', sync=sync))
+        self.assertTrue(sync.stats[(1, 'photos')].full)
+
+        self.assertEqual([new], GraphAPIHelper.get_user_photos(
+            1, 'token', sync=sync))
+        stats = sync.stats[(1, 'photos')]
+        self.assertEqual((1, 1, False), (stats.fetched, stats.skipped,
+                                         stats.full))
+        params = GraphAPIHelper.session.calls[1][2]['params']
+        self.assertEqual(1437386400, params['since'])
+        self.assertTrue(params['fields'].endswith(',created_time'))
+
+    def test_same_second_items(self):
+        sync = IncrementalSync()
+        first = {'id': '1', 'created_time': '2015-07-20T10:00:00+0000'}
+        second = {'id': '2', 'created_time': '2015-07-20T10:00:00+0000'}
+        older = {'id': '0', 'created_time': '2015-07-19T10:00:00+0000'}
+        GraphAPIHelper.session = MockSession([
+            json_mock({'data': [first, older]}),
+            json_mock({'data': [second, first, older]}),
+        ])
+        GraphAPIHelper.get_user_photos(1, 'token', sync=sync)
+        records = GraphAPIHelper.get_user_photos(1, 'token', sync=sync,
+                                                 record=MediaItem)
+        self.assertEqual(['2'], [record.id for record in records])
+        self.assertEqual(['1', '2'], sync.store.get(1, 'photos')['seen'])
+
+    def test_reconcile(self):
+        sync = IncrementalSync(reconcile_every=0)
+        sync.store.set(1, 'posts', {'since': 100, 'full_at': 0})
+        GraphAPIHelper.session = MockSession([json_mock({'data': []})])
+        GraphAPIHelper.get_user_posts(1, 'token', sync=sync)
+        self.assertTrue(sync.stats[(1, 'posts')].full)
+        self.assertFalse(
+            'since' in GraphAPIHelper.session.calls[0][2]['params'])
+
+
+class WindowSession(object):
+
+    """
+        Answers /me/photos with the items created inside since/until,
+        newest first
+    """
+
+    def __init__(self, times, page_size=2):
+        self.items = [{'id': str(t), 'created_time': time.strftime(
+            '%Y-%m-%dT%H:%M:%S+0000', time.gmtime(t))}
+            for t in sorted(times, reverse=True)]
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def request(self, method, url, params=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+        offset = int(url.split('offset=')[1]) if 'offset=' in url else 0
+        items = [item for item in self.items
+                 if params['since'] <= int(item['id']) < params['until']]
+        page = {'data': items[offset:offset + self.page_size]}
+        if offset + self.page_size < len(items):
+            page['paging'] = {'next': 'https://next/?offset=%d' % (
+                offset + self.page_size)}
+        return json_mock(page)
+
+
+class TestShardedCrawl(TestCase):
+
+    def test_merge_windows(self):
+        session = WindowSession(range(1000, 1100, 10))
+        request = GraphAPIRequest('token', '/me/photos',
+                                  {'fields': 'id'}, session=session)
+        crawl = ShardedCrawl(request, since=1000, until=1100, shards=4,
+                             workers=2)
+        items = crawl.get_all()
+        self.assertEqual(sorted(str(t) for t in range(1000, 1100, 10)),
+                         sorted(item['id'] for item in items))
+        self.assertEqual(4, crawl.windows)
+
+    def test_split_dense_window(self):
+        session = WindowSession(range(1000, 1040), page_size=5)
+        request = GraphAPIRequest('token', '/me/photos', {},
+                                  session=session)
+        crawl = ShardedCrawl(request, since=1000, until=1040, shards=1,
+                             pages_per_window=1, min_window=10)
+        self.assertEqual(40, len(crawl.get_all()))
+        self.assertTrue(crawl.splits > 0)
+
+    def test_early_stop_cancels_windows(self):
+        session = WindowSession(range(1000, 1080))
+        request = GraphAPIRequest('token', '/me/photos', {},
+                                  session=session)
+        crawl = ShardedCrawl(request, since=1000, until=1080, shards=8,
+                             workers=1)
+        items = crawl.iter_all()
+        next(items)
+        items.close()
+        time.sleep(0.1)
+        # a window takes 5 pages, all 8 would take 40
+        self.assertLessEqual(session.calls, 10)
+
+
+class TestCrawlScheduler(TestCase):
+
+    def test_queue_priority_and_fairness(self):
+        queue = MemoryJobQueue()
+        queue.put(CrawlJob(1, 'photos', 'a'))
+        queue.put(CrawlJob(1, 'videos', 'a'))
+        queue.put(CrawlJob(2, 'photos', 'b'))
+        queue.put(CrawlJob(3, 'photos', 'c', priority=NEW_USER))
+        self.assertEqual([(3, 'photos'), (1, 'photos'), (2, 'photos'),
+                          (1, 'videos')],
+                         [queue.get(0).key for i in range(4)])
+        self.assertEqual(None, queue.get(0))
+
+    def test_run_jobs(self):
+        results = []
+        scheduler = CrawlScheduler(
+            handler=lambda job: [job.fb_id] * 3, workers=2,
+            on_result=lambda job, result: results.append(job.key))
+        jobs = scheduler.submit_user(1, 'token')
+        self.assertTrue(scheduler.join(5))
+        scheduler.stop()
+
+        self.assertEqual(sorted(job.key for job in jobs), sorted(results))
+        progress = scheduler.progress()
+        self.assertEqual(3, progress['done'])
+        self.assertEqual([3, 3, 3],
+                         [job['items'] for job in progress['jobs']])
+
+    def test_dedup_in_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def handler(job):
+            started.set()
+            release.wait(5)
+
+        scheduler = CrawlScheduler(handler=handler, workers=1)
+        first = scheduler.submit(1, 'photos', 'token')
+        started.wait(5)
+        self.assertTrue(first is scheduler.submit(1, 'photos', 'token'))
+        release.set()
+        scheduler.join(5)
+        scheduler.stop()
+        self.assertEqual(1, scheduler.done)
+
+    def test_failed_job(self):
+        def handler(job):
+            raise ValueError('boom')
+
+        scheduler = CrawlScheduler(handler=handler)
+        job = scheduler.submit(1, 'photos', 'token')
+        scheduler.join(5)
+        scheduler.stop()
+        self.assertEqual('failed', job.status)
+        self.assertEqual('boom', job.as_dict()['error'])
+
+    def test_keep_finished(self):
+        scheduler = CrawlScheduler(handler=lambda job: [], keep_finished=2)
+        for fb_id in range(5):
+            scheduler.submit(fb_id, 'photos', 'token')
+            scheduler.join(5)
+        scheduler.stop()
+        self.assertEqual(5, scheduler.done)
+        self.assertEqual([(3, 'photos'), (4, 'photos')],
+                         sorted(scheduler.jobs))
+
+
+class FakeUsers(object):
+
+    class objects(object):
+        created = []
+
+        @classmethod
+        def create(cls, **fields):
+            cls.created.append(fields)
+
+
+class TestNewUserCrawl(TestCase):
+
+    def setUp(self):
+        self.stored = []
+        self.tasks = sys.modules.get('tasks')
+        self.get_users = facebook_login.get_users
+        self.scheduler = get_crawl_scheduler()
+        tasks = types.ModuleType('tasks')
+        tasks.fetch_all = lambda fb_id: self.stored.append(fb_id) or []
+        sys.modules['tasks'] = tasks
+        facebook_login.get_users = lambda: FakeUsers
+        set_crawl_scheduler(CrawlScheduler())
+
+    def tearDown(self):
+        get_crawl_scheduler().stop()
+        set_crawl_scheduler(self.scheduler)
+        facebook_login.get_users = self.get_users
+        if self.tasks is None:
+            del sys.modules['tasks']
+        else:
+            sys.modules['tasks'] = self.tasks
+
+    def test_new_user_media_is_stored(self):
+        FacebookLoginHandler({}).on_new_user({
+            'user_data': {'id': '42', 'name': 'Unit Test'},
+            'access_token': 'token', 'expires_in': 3600})
+        scheduler = get_crawl_scheduler()
+        self.assertTrue(scheduler.join(5))
+        self.assertEqual(['42'], self.stored)
+        self.assertEqual('42', FakeUsers.objects.created[-1]['fb_id'])
+        self.assertEqual(1, scheduler.done)
+
+
+class SlowSession(MockSession):
+
+    def __init__(self, responses, release):
+        MockSession.__init__(self, responses)
+        self.release = release
+
+    def request(self, method, url, **kwargs):
+        self.release.wait(5)
+        return MockSession.request(self, method, url, **kwargs)
+
+
+class TestSingleFlight(TestCase):
+
+    def test_coalesce_concurrent_gets(self):
+        group = SingleFlight()
+        release = threading.Event()
+        session = SlowSession([json_mock({'id': '1'})], release)
+        results = []
+
+        def get():
+            results.append(GraphAPIRequest(
+                'token', '/me', {}, session=session,
+                single_flight=group).get())
+
+        threads = [threading.Thread(target=get) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        while group.stats()['saved'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(session.calls))
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(res is results[0] for res in results))
+        self.assertEqual({'in_flight': 0, 'executed': 1, 'saved': 3},
+                         group.stats())
+
+    def test_share_error(self):
+        group = SingleFlight()
+
+        def fail():
+            raise GraphAPIError('boom')
+
+        self.assertRaises(GraphAPIError, lambda: group.do('key', fail))
+        self.assertEqual(0, group.stats()['in_flight'])
+
+    def test_opt_out(self):
+        default = get_single_flight()
+        group = SingleFlight()
+        set_single_flight(group)
+        try:
+            session = MockSession([json_mock({'id': '1'})])
+            GraphAPIRequest('token', '/me', {}, session=session,
+                            single_flight=False).get()
+        finally:
+            set_single_flight(default)
+        self.assertEqual(0, group.stats()['executed'])
+        self.assertEqual(1, len(session.calls))
+
+
+class TestStreamingResponse(TestCase):
+
+    def stream_mock(self, page):
+        return MockGraphResponse({
+            'headers': {'content-type': 'application/json'},
+            'status_code': 200,
+            'content': json.dumps(page).encode('utf-8'),
+        })
+
+    def test_iter_all_stream(self):
+        session = MockSession([
+            self.stream_mock({
+                'data': [{'id': '1', 'likes': {'data': [{'id': 'a'}]}},
+                         {'id': '2'}],
+                'paging': {'next': 'https://next/1'}}),
+            self.stream_mock({'data': [{'id': '3'}]}),
+        ])
+        req = GraphAPIRequest('token', '/me/photos', {}, session=session)
+        items = list(req.iter_all(stream=True))
+        self.assertEqual(['1', '2', '3'], [item['id'] for item in items])
+        self.assertEqual([{'id': 'a'}], items[0]['likes']['data'])
+        self.assertTrue(session.calls[0][2]['stream'])
+        self.assertEqual('https://next/1', session.calls[1][1])
+
+    def test_stream_and_prefetch(self):
+        req = GraphAPIRequest('token', '/me/photos', {},
+                              session=MockSession([]))
+        self.assertRaises(ValueError,
+                          lambda: req.iter_pages(prefetch=1, stream=True))
+
+
+class TestRecords(TestCase):
+
+    item = {
+        'id': '10', 'name': 'photo', 'picture': 'http://pic',
+        'likes': {
+            'data': [{'id': '1', 'name': 'a', 'pic_small': 'http://a',
+                      'can_post': True},
+                     {'id': '2', 'name': 'b', 'pic_small': 'http://b',
+                      'can_post': False}],
+            'summary': {'total_count': 2},
+        },
+    }
+
+    def test_round_trip(self):
+        record = MediaItem.from_dict(self.item)
+        self.assertEqual(self.item, record.as_dict())
+        self.assertEqual(2, len(record.likes))
+        self.assertEqual('b', record.likes[1].name)
+        self.assertTrue(record.likes[0].can_post)
+
+    def test_extra_fields(self):
+        item = dict(self.item, source='http://video', length=12.5)
+        record = MediaItem.from_dict(item)
+        self.assertEqual({'source': 'http://video', 'length': 12.5},
+                         record.extra)
+        self.assertEqual(item, record.as_dict())
+        self.assertIsNone(MediaItem.from_dict(self.item).extra)
+
+    def test_can_post_values(self):
+        likes = LikeList({'data': [{'id': str(i), 'can_post': value}
+                                   for i, value in enumerate(
+                                       ['true', 'false', 1, 0, None])]})
+        self.assertEqual([True, False, True, False, None],
+                         [like.can_post for like in likes])
+
+    def test_lazy_likes(self):
+        record = MediaItem.from_dict(self.item)
+        self.assertTrue(isinstance(record._likes, dict))
+        record.likes
+        self.assertTrue(isinstance(record._likes, LikeList))
+        self.assertTrue(isinstance(
+            MediaItem.from_dict(self.item, lazy=False)._likes, LikeList))
+
+    def test_get_all_records(self):
+        session = MockSession([json_mock({'data': [self.item]})])
+        req = GraphAPIRequest('token', '/me/photos', {}, session=session)
+        res = req.get_all(record=MediaItem)
+        self.assertEqual('10', res[0].id)
+        self.assertFalse(hasattr(res[0], '__dict__'))
+
+
+class ImageResponse(MockGraphResponse):
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def image_mock(body, url='http://img'):
+    return ImageResponse({'headers': {'content-type': 'image/jpeg'},
+                          'status_code': 200, 'body': body, 'url': url})
+
+
+class TestDownload(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_download_to_path(self):
+        raw = image_mock(b'x' * 10)
+        session = MockSession([raw])
+        path = os.path.join(self.directory, 'img.jpg')
+        req = GraphAPIRequest(None, 'https://img', {}, session=session)
+        res = req.download(path, chunk_size=3, hash_name='sha1')
+
+        self.assertEqual(path, res.response['path'])
+        self.assertEqual(10, res.response['size'])
+        self.assertEqual('image/jpeg', res.response['mime-type'])
+        self.assertEqual(hashlib.sha1(b'x' * 10).hexdigest(),
+                         res.response['sha1'])
+        self.assertTrue(raw.closed)
+        with open(path, 'rb') as f:
+            self.assertEqual(b'x' * 10, f.read())
+
+    def test_download_all(self):
+        session = MockSession([image_mock(b'a'), image_mock(b'b')])
+        res = download_all(['https://a', 'https://b'], self.directory,
+                           workers=1, session=session)
+        self.assertEqual([1, 1], [r['size'] for r in res])
+        self.assertEqual(2, len(os.listdir(self.directory)))
+
+    def test_download_all_failures(self):
+        broken = image_mock(b'a')
+
+        def iter_content(chunk_size):
+            yield b'a'
+            raise requests.exceptions.ChunkedEncodingError('broken')
+        broken.iter_content = iter_content
+        page = ImageResponse({'headers': {'content-type': 'text/html'},
+                              'status_code': 200, 'body': b'', 'url': 'c',
+                              'text': '<html>'})
+        session = MockSession([broken, image_mock(b'b'), page])
+        res = download_all(['https://a', 'https://b', 'https://c'],
+                           self.directory, workers=1, session=session)
+        self.assertTrue(isinstance(res[0], GraphAPIError))
+        self.assertEqual(1, res[1]['size'])
+        self.assertTrue(isinstance(res[2], GraphAPIError))
+        self.assertTrue(broken.closed and page.closed)
+        self.assertEqual(1, len(os.listdir(self.directory)))
+
+
+class TestUpload(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.jpg')
+        os.write(fd, b'0123456789')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_multipart_stream(self):
+        with open(self.path, 'rb') as f:
+            body = MultipartStream({'message': 'hi'}, {'source': f})
+            data = b''.join(iter(lambda: body.read(7), b''))
+            self.assertEqual(len(body), len(data))
+            self.assertIn(b'name="message"\r\n\r\nhi\r\n', data)
+            self.assertIn(b'Content-Type: image/jpeg\r\n\r\n0123456789\r\n',
+                          data)
+            self.assertTrue(data.endswith(
+                ('--%s--\r\n' % body.boundary).encode('utf-8')))
+            body.seek(0)
+            self.assertEqual(data, body.read())
+
+    def test_multipart_stream_in_memory(self):
+        body = MultipartStream(files={'source': io.BytesIO(b'0123456789')})
+        data = body.read()
+        self.assertEqual(len(body), len(data))
+        self.assertIn(b'\r\n\r\n0123456789\r\n', data)
+
+    def test_upload_file(self):
+        session = MockSession([json_mock({'id': '1'})])
+        with open(self.path, 'rb') as f:
+            res, stats = upload_file('token', 'me/photos', f,
+                                     session=session)
+        self.assertEqual({'id': '1'}, res)
+        method, url, kwargs = session.calls[0]
+        self.assertEqual('POST', method)
+        self.assertEqual('token', kwargs['params']['access_token'])
+        self.assertIsInstance(kwargs['data'], MultipartStream)
+        self.assertTrue(kwargs['headers']['Content-Type'].startswith(
+            'multipart/form-data; boundary='))
+        self.assertEqual(len(kwargs['data']), stats.bytes)
+
+    def test_chunked_video_resume(self):
+        error = json_mock({'error': {'message': 'boom', 'code': 1}})
+        error.status_code = 500
+        session = MockSession([
+            json_mock({'upload_session_id': 's', 'video_id': 'v',
+                       'start_offset': '0', 'end_offset': '4'}),
+            json_mock({'start_offset': '4', 'end_offset': '8'}),
+            error,
+            json_mock({'start_offset': '8', 'end_offset': '10'}),
+            json_mock({'start_offset': '10', 'end_offset': '10'}),
+            json_mock({'success': True}),
+        ])
+        with open(self.path, 'rb') as f:
+            video = ChunkedVideoUpload('token', f, session=session)
+            with self.assertRaises(GraphAPIError):
+                video.run()
+            self.assertEqual(4, video.start_offset)
+            res = video.run()
+        self.assertEqual({'success': True, 'video_id': 'v'}, res)
+        self.assertEqual(10, video.stats.bytes)
+        self.assertEqual(6, len(session.calls))
+
+    def test_upload_queue(self):
+        session = MockSession([json_mock({'id': '1'}),
+                               json_mock({'id': '2'})])
+        queue = UploadQueue(workers=2, token_limit=1, session=session)
+        futures = [queue.submit_photo('token', self.path) for _ in range(2)]
+        ids = sorted(future.result()[0]['id'] for future in futures)
+        queue.shutdown()
+        self.assertEqual(['1', '2'], ids)
+        self.assertEqual(2, queue.report()['uploaded'])
+
+    def test_upload_queue_token_fairness(self):
+        queue = UploadQueue(workers=2, token_limit=1)
+        release = threading.Event()
+
+        def slow():
+            release.wait(5)
+            return {}, UploadStats()
+
+        slow_futures = [queue._submit('busy', slow) for _ in range(3)]
+        other = queue._submit('other', lambda: ({'id': '1'}, UploadStats()))
+        self.assertEqual({'id': '1'}, other.result(timeout=5)[0])
+        self.assertFalse(slow_futures[1].done())
+        release.set()
+        queue.shutdown()
+        self.assertTrue(all(future.done() for future in slow_futures))
+        self.assertEqual(4, queue.report()['uploaded'])
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.metrics = MetricsCollector().install()
+
+    def tearDown(self):
+        self.metrics.uninstall()
+
+    def test_endpoint(self):
+        self.assertEqual('/{version}/{id}/photos', endpoint(
+            'https://graph.facebook.com/v2.4/1234/photos?after=x'))
+        self.assertEqual('/me', endpoint('/me'))
+
+    def test_request_events(self):
+        events = []
+        hooks = Hooks()
+        for event in (BEFORE_REQUEST, AFTER_RESPONSE, ON_ERROR, ON_RETRY):
+            hooks.register(event, lambda event, **info: events.append(event))
+        hooks.register(ON_ERROR, lambda **info: 1 / 0)
+        hooks.emit(BEFORE_REQUEST, path='/me')
+        hooks.emit(ON_ERROR, path='/me', error=None)
+        self.assertEqual([BEFORE_REQUEST, ON_ERROR], events)
+        self.assertEqual(1, hooks.failures)
+
+    def test_collects_retries_and_pages(self):
+        throttled = json_mock({'error': {'message': 'limit', 'code': 4}})
+        session = MockSession([
+            throttled,
+            json_mock({'data': [1], 'paging': {'next': 'https://n/1'}}),
+            json_mock({'data': [2]}),
+        ])
+        req = GraphAPIRequest(None, 'v2.4/me/photos', {}, session=session,
+                              retry=RetryPolicy(backoff=0, jitter=False))
+        self.assertEqual([1, 2], req.get_all())
+
+        snapshot = self.metrics.snapshot()
+        photos = snapshot['/{version}/me/photos']
+        self.assertEqual(2, photos['requests'])
+        self.assertEqual(1, photos['retries'])
+        self.assertEqual({THROTTLED: 1}, photos['errors'])
+        self.assertEqual(0.5, photos['error_rate'])
+        self.assertEqual(1, photos['pages']['count'])
+        self.assertEqual(2, photos['pages']['sum'])
+        self.assertEqual(1, snapshot['/{id}']['latency']['count'])
+
+        text = self.metrics.prometheus()
+        self.assertIn('facebook_graph_requests_total'
+                      '{endpoint="/{version}/me/photos"} 2', text)
+        self.assertIn('facebook_graph_request_seconds_bucket'
+                      '{endpoint="/{id}",le="+Inf"} 1', text)
+        self.assertIn('facebook_graph_errors_total'
+                      '{endpoint="/{version}/me/photos",category="%s"} 1'
+                      % THROTTLED, text)
+
+    def test_prometheus_families_are_grouped(self):
+        session = MockSession([json_mock({'data': [1]}),
+                               json_mock({'data': [2]})])
+        for path in ('/me/photos', '/me/videos'):
+            GraphAPIRequest(None, path, {}, session=session).get_all()
+        families = []
+        for line in self.metrics.prometheus().splitlines():
+            if line.startswith('# TYPE'):
+                families.append(line.split()[2])
+                continue
+            name = line.split('{')[0]
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in families:
+                    name = name[:-len(suffix)]
+            self.assertEqual(families[-1], name)
+        self.assertEqual(len(families), len(set(families)))
+
+    def test_async_pagination(self):
+        import asyncio
+        from .facebook_async import AsyncGraphAPIRequest
+        session = MockAsyncSession([
+            json_mock({'data': [1], 'paging': {'next': 'https://n/1'}}),
+            json_mock({'data': [2]})])
+        req = AsyncGraphAPIRequest(None, 'v2.4/me/photos', {},
+                                   session=session)
+        self.assertEqual([1, 2], asyncio.run(req.get_all()))
+        pages = self.metrics.snapshot()['/{version}/me/photos']['pages']
+        self.assertEqual((1, 2), (pages['count'], pages['sum']))
+
+
+class TestGraphStandIn(TestCase):
+
+    def setUp(self):
+        self.server = GraphServer(GraphStandIn(items=25, page_size=10))
+        set_graph_url(self.server.start())
+
+    def tearDown(self):
+        set_graph_url(None)
+        self.server.stop()
+
+    def test_relative_path_uses_graph_url(self):
+        session = MockSession([json_mock({})])
+        GraphAPIRequest(None, 'me', {}, session=session).get()
+        self.assertEqual(self.server.url + 'me', session.calls[0][1])
+
+    def test_get_all(self):
+        req = GraphAPIRequest('token', 'v2.4/me/photos', {'limit': 100})
+        items = req.get_all()
+        self.assertEqual(25, len(items))
+        self.assertEqual(3, self.server.graph.requests)
+
+    def test_nested_edges(self):
+        edges = GraphAPIHelper.get_user_edges('me', 'token', limit=10)
+        self.assertEqual({'photos': 25, 'videos': 25, 'posts': 25},
+                         dict((edge, len(items))
+                              for edge, items in edges.items()))
+        self.assertEqual('photos 24', edges['photos'][-1]['name'])
+        # one nested request, then two more pages per edge
+        self.assertEqual(7, self.server.graph.requests)
+
+    def test_batch(self):
+        batch = GraphBatchRequest('token')
+        batch.add(GraphAPIRequest('token', '/me/photos', {}))
+        batch.add(GraphAPIRequest('token', '/me/videos', {}))
+        self.assertEqual([25, 25], [len(items) for items in batch.get_all()])
+
+
+class TestCassette(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'crawl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self):
+        server = GraphServer(GraphStandIn(items=25, page_size=10))
+        url = server.start()
+        cassette = CassetteSession(self.path, RECORD)
+        try:
+            items = GraphAPIRequest('secret', url + 'v2.4/me/photos', {},
+                                    session=cassette).get_all()
+        finally:
+            server.stop()
+        cassette.close()
+        return url, items
+
+    def test_record_and_replay(self):
+        url, items = self.record()
+        cassette = CassetteSession(self.path, REPLAY)
+        replayed = GraphAPIRequest('other-token', url + 'v2.4/me/photos', {},
+                                   session=cassette).get_all(stream=True)
+        self.assertEqual(items, replayed)
+        self.assertEqual({'mode': REPLAY, 'records': 3, 'recorded': 0,
+                          'replayed': 3}, cassette.stats())
+        cassette.close()
+
+    def test_replay_miss(self):
+        cassette = CassetteSession(self.path, REPLAY)
+        with self.assertRaises(CassetteMiss):
+            GraphAPIRequest(None, 'http://localhost/me', {},
+                            session=cassette).get()
+        cassette.close()
+
+    def test_auto_records_missing(self):
+        session = MockSession([MockGraphResponse({
+            'url': 'http://localhost/me?access_token=x',
+            'status_code': 200,
+            'headers': {'content-type': 'application/json'},
+            'content': b'{"id": "1"}'})])
+        cassette = CassetteSession(self.path, AUTO, session=session)
+        for _ in range(2):
+            res = GraphAPIRequest('x', 'http://localhost/me', {},
+                                  session=cassette).get()
+            self.assertEqual({'id': '1'}, res.response)
+        self.assertEqual(1, len(session.calls))
+        self.assertEqual(1, cassette.recorded)
+        cassette.close()
+
+
+class TestFieldPresets(TestCase):
+
+    def test_plan_fields(self):
+        self.assertEqual(
+            'likes.summary(true){id,name},picture',
+            plan_fields(['likes.id', 'picture', 'likes.name', 'likes.id'],
+                        {'likes': 'summary(true)'}))
+        self.assertEqual('a{b{c,d}},e',
+                         plan_fields(['a.b.c', 'a.b.d', 'e']))
+
+    def test_with_limit(self):
+        self.assertEqual('https://n/me/photos?after=x&limit=50',
+                         with_limit('https://n/me/photos?limit=500&after=x',
+                                    50))
+
+    def test_adaptive_limit(self):
+        limit = AdaptiveLimit(100, min_limit=10, max_limit=200,
+                              byte_budget=1000)
+        self.assertEqual(50, limit.observe(100, 2000))
+        self.assertEqual(75, limit.observe(50, 500))
+        self.assertEqual(37, limit.backoff())
+        limit.limit = 10
+        self.assertIsNone(limit.backoff())
+
+    def test_byte_budget(self):
+        server = GraphServer(GraphStandIn(items=100, page_size=100))
+        url = server.start()
+        preset = FieldPreset('test', ['id', 'name'], limit=50,
+                             byte_budget=4000)
+        try:
+            req = GraphAPIRequest('token', url + 'me/photos', preset.args())
+            fetch = preset.fetch()
+            items = fetch.get_all(req)
+        finally:
+            server.stop()
+        stats = fetch.stats()
+        self.assertEqual(100, len(items))
+        self.assertEqual(100, stats['items'])
+        self.assertGreater(stats['pages'], 2)
+        self.assertLess(stats['limit'], 50)
+        self.assertEqual(float(stats['bytes']) / 100, stats['bytes_per_item'])
+
+    def test_backoff_on_transient_error(self):
+        error = json_mock({'error': {'message': 'Please reduce the amount '
+                                                'of data', 'code': 1}})
+        session = MockSession([
+            json_mock({'data': [1], 'paging': {'next': 'https://n?limit=40'}}),
+            error,
+            json_mock({'data': [2]}),
+        ])
+        preset = FieldPreset('test', ['id'], limit=40, min_limit=10)
+        req = GraphAPIRequest(None, 'me/photos', preset.args(),
+                              session=session, retry=NO_RETRY)
+        fetch = preset.fetch()
+        self.assertEqual([1, 2], fetch.get_all(req))
+        self.assertEqual('https://n?limit=20', session.calls[2][1])
+        self.assertEqual(1, fetch.stats()['backoffs'])
+        self.assertEqual(40, preset.fetch().limiter.limit)
+
+    def test_preset_totals_through_helper(self):
+        pages = ('{"data": [{"id": "1"}, {"id": "2"}], '
+                 '"paging": {"next": "https://n/me/photos"}}',
+                 '{"data": [{"id": "3"}]}') * 2
+        session = GraphAPIHelper.session
+        GraphAPIHelper.session = MockSession([MockGraphResponse({
+            'headers': {'content-type': 'application/json',
+                        'content-length': str(len(page))},
+            'response': json.loads(page)}) for page in pages])
+        preset = FieldPreset('test', ['id'], limit=10)
+        try:
+            for _ in range(2):
+                self.assertEqual(3, len(GraphAPIHelper.get_user_photos(
+                    1, 'token', preset=preset)))
+        finally:
+            GraphAPIHelper.session = session
+        stats = preset.stats()
+        self.assertEqual((4, 6), (stats['pages'], stats['items']))
+        self.assertEqual(sum(len(page) for page in pages), stats['bytes'])
+        self.assertEqual(stats['bytes'] / 6.0, stats['bytes_per_item'])
+
+    def test_preset_with_prefetch(self):
+        with self.assertRaises(ValueError):
+            GraphAPIHelper.get_user_photos(1, 'token', prefetch=2,
+                                           preset='ids')
+
+
+class TestNestedEdgeFetch(TestCase):
+
+    def test_nested_fields(self):
+        self.assertEqual('photos.limit(5){id},posts.limit(5){id}',
+                         nested_fields(['photos', 'posts'], 'id', 5))
+
+    def test_streams_without_paging(self):
+        session = MockSession([json_mock({
+            'id': '1',
+            'photos': {'data': [{'id': 'p1'}, {'id': 'p2'}]},
+            'videos': {'data': []},
+        })])
+        fetch = NestedEdgeFetch('token', ('photos', 'videos', 'posts'),
+                                'id', session=session)
+        streams = fetch.streams(record=MediaItem)
+        self.assertEqual(['p1', 'p2'],
+                         [item.id for item in streams['photos']])
+        self.assertEqual([], list(streams['videos']))
+        self.assertEqual([], list(streams['posts']))
+        self.assertEqual(1, len(session.calls))
+        self.assertEqual('photos.limit(100){id},videos.limit(100){id},'
+                         'posts.limit(100){id}',
+                         session.calls[0][2]['params']['fields'])
+
+
+class FakeTokenHelper(object):
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def extend_access_token(self, access_token, app_id, app_secret):
+        self.calls.append(access_token)
+        response = self.responses[access_token]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class TestTokenManager(TestCase):
+
+    def setUp(self):
+        self.now = time.time()
+        self.helper = FakeTokenHelper({
+            'soon': {'access_token': 'soon2', 'expires_in': 5184000},
+            'unknown': {'access_token': 'unknown2'},
+            'invalid': {'error': {'message': 'Error validating access '
+                                             'token', 'code': 190}},
+            'down': GraphAPIError.from_exception(IOError('timeout')),
+        })
+        self.manager = TokenManager('1', 's', refresh_ahead=3600,
+                                    retry_delay=60, helper=self.helper,
+                                    persist=False)
+
+    def test_refresh_due_tokens(self):
+        self.manager.track('1', 'soon', self.now + 600)
+        self.manager.track('2', 'later', self.now + 86400)
+        self.manager.track('3', 'unknown', 0)
+        self.manager.track('4', 'invalid', self.now + 60)
+        self.manager.track('5', 'down', self.now + 1800)
+
+        self.assertEqual(2, self.manager.run_due())
+        self.assertEqual(['down', 'invalid', 'soon', 'unknown'],
+                         sorted(self.helper.calls))
+        tokens = self.manager.tokens
+        self.assertEqual('soon2', tokens['1'].access_token)
+        self.assertGreater(tokens['1'].expires_at, self.now + 5000000)
+        self.assertEqual('unknown2', tokens['3'].access_token)
+        self.assertEqual(EXPIRED, tokens['4'].status)
+        self.assertEqual(VALID, tokens['5'].status)
+        self.assertEqual(1, tokens['5'].failures)
+
+        stats = self.manager.stats()
+        self.assertEqual((2, 1, 1), (stats['refreshed'], stats['failed'],
+                                     stats['expired']))
+        # nothing due until the failed refresh is retried
+        self.assertEqual(0, self.manager.run_due())
+        self.manager.run_due(self.now + 120)
+        self.assertEqual(2, tokens['5'].failures)
+
+    def test_unexpected_errors_count_as_failed(self):
+        self.helper.responses['broken'] = KeyError('access_token')
+        self.manager.track('1', 'broken', self.now + 600)
+        self.manager.track('2', 'soon', self.now + 600)
+        self.manager.persist = True
+
+        def save(state):
+            raise IOError('mongo is down')
+        self.manager._save = save
+
+        with self.assertLogs(TokenManager.__module__, 'ERROR') as logs:
+            self.assertEqual(0, self.manager.run_due())
+        self.assertEqual(2, len(logs.records))
+        stats = self.manager.stats()
+        self.assertEqual((1, 2), (stats['refreshed'], stats['failed']))
+        self.assertEqual(VALID, self.manager.tokens['1'].status)
+        self.assertEqual('soon2', self.manager.tokens['2'].access_token)
+        self.assertEqual(2, len(self.manager.due(self.now + 120)))
+
+    def test_get_fresh_token(self):
+        self.manager.track('1', 'soon', self.now + 60)
+        self.manager.track('2', 'later', self.now + 86400)
+        self.manager.track('4', 'invalid', self.now + 60)
+        self.assertEqual('soon2', self.manager.get_fresh_token('1'))
+        self.assertEqual('later', self.manager.get_fresh_token('2'))
+        self.assertEqual('x', self.manager.get_fresh_token('9', 'x'))
+        with self.assertRaises(GraphAPIError) as e:
+            self.manager.get_fresh_token('4')
+        self.assertEqual(AUTH_EXPIRED, e.exception.category)
+
+    def test_auth_error_expires_token(self):
+        self.manager.track('2', 'later', self.now + 86400)
+        self.manager.on_auth_error('later')
+        self.assertEqual(EXPIRED, self.manager.tokens['2'].status)
+        self.assertEqual([], self.manager.due(self.now + 86400))
+
+
+class TestSettings(TestCase):
+
+    def test_django_setting(self):
+        self.assertEqual(settings.FACEBOOK_VERSION,
+                         get_setting('FACEBOOK_VERSION'))
+
+    def test_environment_fallback(self):
+        os.environ['FACEBOOK_TEST_SETTING'] = 'value'
+        try:
+            self.assertEqual('value', get_setting('FACEBOOK_TEST_SETTING'))
+        finally:
+            del os.environ['FACEBOOK_TEST_SETTING']
+        self.assertEqual('x', get_setting('FACEBOOK_TEST_SETTING', 'x'))
+
+
 class TestLoginHandler(TestCase):
 
     def setUp(self):